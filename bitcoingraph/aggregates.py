@@ -0,0 +1,140 @@
+"""
+aggregates
+
+Summary properties of addresses computed from exported CSV files.
+
+"""
+
+import csv
+import itertools
+import os
+import shutil
+
+from bitcoingraph.helper import sort
+
+__author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
+__copyright__ = 'Copyright 2015, Bernhard Haslhofer'
+__license__ = "MIT"
+
+
+AGGREGATE_HEADER = ['tx_count:int', 'first_timestamp:int', 'last_timestamp:int',
+                    'total_received:double', 'unspent:double']
+
+
+def _rows(path, name):
+    with open(os.path.join(path, name + '.csv')) as f:
+        yield from csv.reader(f)
+
+
+def _join(left, right, left_key, right_key):
+    """
+    Yields all pairs of rows with equal keys from two sequences of rows,
+    which are sorted by their keys.
+    """
+    left_groups = itertools.groupby(left, left_key)
+    right_groups = itertools.groupby(right, right_key)
+    left_group = next(left_groups, None)
+    right_group = next(right_groups, None)
+    while left_group is not None and right_group is not None:
+        if left_group[0] < right_group[0]:
+            left_group = next(left_groups, None)
+        elif left_group[0] > right_group[0]:
+            right_group = next(right_groups, None)
+        else:
+            right_rows = list(right_group[1])
+            for left_row in left_group[1]:
+                for right_row in right_rows:
+                    yield left_row, right_row
+            left_group = next(left_groups, None)
+            right_group = next(right_groups, None)
+
+
+def _write_rows(path, name, rows):
+    with open(os.path.join(path, name + '.csv'), 'w') as f:
+        csv.writer(f).writerows(rows)
+
+
+def compute_address_aggregates(input_path, plain_header=False, buffer_size='50%'):
+    """
+    Adds the columns of AGGREGATE_HEADER to addresses.csv of an export
+    with separate headers: the number of transactions using an
+    address, the timestamps of the first and last of them, the sum of
+    the positive values of these transactions for the address and the
+    value of the unspent outputs of the address.
+
+    The output and address files are sorted, and intermediate files
+    are joined by sorting them, whereas rel_input.csv keeps its order.
+    Inputs spending outputs of blocks before the export are not taken
+    into account, so the export has to start at the genesis block.
+
+    :param str input_path: export directory
+    :param bool plain_header: create the header without field types
+    :param str buffer_size: main memory used by sort
+    """
+    print('calculating address aggregates')
+    timestamps = {block_hash: timestamp
+                  for block_hash, height, timestamp in _rows(input_path, 'blocks')}
+    _write_rows(input_path, 'aggregate_tx_times',
+                ([txid, timestamps[block_hash]]
+                 for block_hash, txid in _rows(input_path, 'rel_block_tx')))
+    sort(input_path, 'aggregate_tx_times.csv', '-t , -k 1,1 -u', buffer_size)
+    del timestamps
+
+    # values of outputs per address, ordered by output
+    for name in ['outputs', 'rel_output_address']:
+        sort(input_path, name + '.csv', '-u', buffer_size)
+    _write_rows(input_path, 'aggregate_outputs',
+                ([output_ref, address, output[2]] for output, (output_ref, address)
+                 in _join(_rows(input_path, 'outputs'), _rows(input_path, 'rel_output_address'),
+                          lambda row: row[0], lambda row: row[0])))
+
+    # received and spent values per transaction and address, rel_input.csv stays in chain
+    # order, which the entity computation relies on
+    shutil.copyfile(os.path.join(input_path, 'rel_input.csv'),
+                    os.path.join(input_path, 'aggregate_inputs.csv'))
+    sort(input_path, 'aggregate_inputs.csv', '-t , -k 2', buffer_size)
+    with open(os.path.join(input_path, 'aggregate_values.csv'), 'w') as f:
+        writer = csv.writer(f)
+        for output_ref, address, value in _rows(input_path, 'aggregate_outputs'):
+            writer.writerow([output_ref.rpartition('_')[0], address, value])
+        for (txid, _), (_, address, value) in _join(
+                _rows(input_path, 'aggregate_inputs'), _rows(input_path, 'aggregate_outputs'),
+                lambda row: row[1], lambda row: row[0]):
+            writer.writerow([txid, address, '-' + value])
+    os.remove(os.path.join(input_path, 'aggregate_outputs.csv'))
+    os.remove(os.path.join(input_path, 'aggregate_inputs.csv'))
+    sort(input_path, 'aggregate_values.csv', '-t , -k 1,1', buffer_size)
+    _write_rows(input_path, 'aggregate_address_values',
+                ([address, txid, timestamp, value] for (txid, address, value), (_, timestamp)
+                 in _join(_rows(input_path, 'aggregate_values'),
+                          _rows(input_path, 'aggregate_tx_times'),
+                          lambda row: row[0], lambda row: row[0])))
+    os.remove(os.path.join(input_path, 'aggregate_values.csv'))
+    os.remove(os.path.join(input_path, 'aggregate_tx_times.csv'))
+    sort(input_path, 'aggregate_address_values.csv', '-t , -k 1,2', buffer_size)
+
+    with open(os.path.join(input_path, 'addresses.csv'), 'w') as f:
+        writer = csv.writer(f)
+        for address, rows in itertools.groupby(_rows(input_path, 'aggregate_address_values'),
+                                               lambda row: row[0]):
+            tx_count = 0
+            first = last = None
+            received = unspent = 0.0
+            for (txid, timestamp), tx_rows in itertools.groupby(
+                    rows, lambda row: (row[1], int(row[2]))):
+                value = sum(float(row[3]) for row in tx_rows)
+                tx_count += 1
+                first = timestamp if first is None else min(first, timestamp)
+                last = timestamp if last is None else max(last, timestamp)
+                if value > 0:
+                    received += value
+                unspent += value
+            writer.writerow([address, tx_count, first, last,
+                             round(received, 8), round(unspent, 8)])
+    os.remove(os.path.join(input_path, 'aggregate_address_values.csv'))
+    sort(input_path, 'addresses.csv', '-u', buffer_size)
+
+    header = ['address:ID(Address)'] + AGGREGATE_HEADER
+    if plain_header:
+        header = [entry.partition(':')[0] for entry in header]
+    _write_rows(input_path, 'addresses_header', [header])
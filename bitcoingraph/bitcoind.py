@@ -6,24 +6,50 @@ Bitcoin Core JSON-RPC interface.
 import requests
 import json
 
+import threading
 import time
 
+from bitcoingraph.serialization import deserialize_block
+
 
 __author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
 __copyright__ = 'Copyright 2015, Bernhard Haslhofer'
 __license__ = "MIT"
 
 
+# JSON-RPC error codes of Bitcoin Core for parameters of the wrong type or value
+RPC_TYPE_ERROR = -3
+RPC_INVALID_PARAMETER = -8
+
+
 class BitcoindException(Exception):
     """
     Exception raised when accessing Bitcoin Core via JSON-RPCS.
+
+    The code attribute holds the JSON-RPC error code, if any.
     """
-    pass
+
+    def __init__(self, *args, code=None):
+        super().__init__(*args)
+        self.code = code
+
+
+def _error_code(error):
+    return error.get('code') if isinstance(error, dict) else None
+
+
+def _thread_session(local):
+    if not hasattr(local, 'session'):
+        local.session = requests.Session()
+    return local.session
 
 
 class JSONRPCInterface:
     """
     A generic JSON-RPC interface with keep-alive session reuse.
+
+    Each thread uses its own session, so that an interface object can be
+    shared by the threads prefetching blocks.
     """
 
     def __init__(self, url):
@@ -34,10 +60,14 @@ class JSONRPCInterface:
         :return: JSON-RPC proxy object
         :rtype: JSONRPCInterface
         """
-        self._session = requests.Session()
+        self._local = threading.local()
         self._url = url
         self._headers = {'content-type': 'application/json'}
 
+    @property
+    def _session(self):
+        return _thread_session(self._local)
+
     def call(self, rpcMethod, *params):
         """
         Execute a single request against a JSON-RPC interface
@@ -93,22 +123,39 @@ class JSONRPCInterface:
         responseJSON = response.json()
         if 'error' in responseJSON and responseJSON['error'] is not None:
             raise BitcoindException('Error in RPC call: ' +
-                                    str(responseJSON['error']))
+                                    str(responseJSON['error']),
+                                    code=_error_code(responseJSON['error']))
         return responseJSON
 
 
 class RESTInterface:
 
     def __init__(self, url):
-        self._session = requests.Session()
+        self._local = threading.local()
         self._url = url
 
+    @property
+    def _session(self):
+        return _thread_session(self._local)
+
     def get_block(self, hash):
         r = self._session.get(self._url + 'block/{}.json'.format(hash))
         if r.status_code != 200:
             raise Exception('REST request was not successful')
         return r.json()
 
+    def get_block_binary(self, hash):
+        r = self._session.get(self._url + 'block/{}.bin'.format(hash))
+        if r.status_code != 200:
+            raise Exception('REST request was not successful')
+        return r.content
+
+    def get_block_header(self, hash):
+        r = self._session.get(self._url + 'headers/1/{}.json'.format(hash))
+        if r.status_code != 200:
+            raise Exception('REST request was not successful')
+        return r.json()[0]
+
 
 class BitcoinProxy:
     """
@@ -116,6 +163,16 @@ class BitcoinProxy:
 
     Implements a subset of call list described
     `here <https://en.bitcoin.it/wiki/Original_Bitcoin_client/API_Calls_list>`_
+
+    Blocks are retrieved with one of the following methods:
+
+    * ``RPC``: ``getblock`` via JSON-RPC
+    * ``REST``: ``block/<hash>.json`` via the REST interface
+    * ``RPC_BINARY``: serialized blocks (``getblock`` with verbosity 0)
+    * ``REST_BINARY``: serialized blocks (``block/<hash>.bin``)
+
+    The binary methods deserialize blocks locally, which avoids decoding
+    large JSON documents, and yield the same structures as ``REST``.
     """
 
     def __init__(self, host, port, rpc_user=None, rpc_pass=None, method='RPC'):
@@ -130,21 +187,80 @@ class BitcoinProxy:
         rest_url = 'http://{}:{}/rest/'.format(host, port)
         rpc_url = 'http://{}:{}@{}:{}/'.format(rpc_user, rpc_pass, host, port)
         self._jsonrpc_proxy = JSONRPCInterface(rpc_url)
-        if method == 'REST':
+        if method in ('REST', 'REST_BINARY'):
             self._rest_proxy = RESTInterface(rest_url)
 
-    def getblock(self, block_hash):
+    def getblock(self, block_hash, verbosity=None):
         """
         Returns information about the block with the given hash.
 
+        The verbosity is only passed on with the RPC method (e.g. 3 for
+        transactions including the spent outputs).
+
         :param str block_hash: the block hash
+        :param int verbosity: verbosity of the getblock RPC call
         :return: block as JSON
         :rtype: str
         """
         if self.method == 'REST':
             r = self._rest_proxy.get_block(block_hash)
+        elif self.method == 'REST_BINARY':
+            r = self._decode_block(self._rest_proxy.get_block_binary(block_hash),
+                                   self._rest_proxy.get_block_header(block_hash))
+        elif self.method == 'RPC_BINARY':
+            raw_block = self._jsonrpc_proxy.call('getblock', block_hash, 0)
+            r = self._decode_block(bytes.fromhex(raw_block), self.getblockheader(block_hash))
         else:
-            r = self._jsonrpc_proxy.call('getblock', block_hash)
+            r = self._jsonrpc_proxy.call('getblock', *self._getblock_params(block_hash, verbosity))
+        return r
+
+    @staticmethod
+    def _getblock_params(block_hash, verbosity):
+        return [block_hash] if verbosity is None else [block_hash, verbosity]
+
+    def getblocks(self, block_hashes, verbosity=None):
+        """
+        Returns information about the blocks with the given hashes.
+
+        Uses a single batch request unless the REST interface is used.
+
+        :param block_hashes: list of block hashes
+        :param int verbosity: verbosity of the getblock RPC call
+        :return: list of blocks as JSON (in the order of the given hashes)
+        :rtype: list
+        """
+        if self.method in ('REST', 'REST_BINARY'):
+            return [self.getblock(block_hash) for block_hash in block_hashes]
+        elif self.method == 'RPC_BINARY':
+            raw_blocks = self._batch('getblock', [[block_hash, 0] for block_hash in block_hashes])
+            headers = self._batch('getblockheader', [[block_hash] for block_hash in block_hashes])
+            return [self._decode_block(bytes.fromhex(raw_block), header)
+                    for raw_block, header in zip(raw_blocks, headers)]
+        else:
+            return self._batch('getblock', [self._getblock_params(block_hash, verbosity)
+                                            for block_hash in block_hashes])
+
+    @staticmethod
+    def _decode_block(raw_block, header):
+        """
+        Deserializes a binary block and completes it with the chain
+        information of its header.
+        """
+        block = deserialize_block(raw_block)
+        for key in ('height', 'confirmations', 'nextblockhash'):
+            if key in header:
+                block[key] = header[key]
+        return block
+
+    def getblockheader(self, block_hash):
+        """
+        Returns information about the header of the block with the given hash.
+
+        :param str block_hash: the block hash
+        :return: block header as JSON
+        :rtype: dict
+        """
+        r = self._jsonrpc_proxy.call('getblockheader', block_hash)
         return r
 
     def getblockcount(self):
@@ -168,6 +284,17 @@ class BitcoinProxy:
         r = self._jsonrpc_proxy.call('getblockhash', height)
         return r
 
+    def getblockhashes(self, heights):
+        """
+        Returns hashes of blocks in best-block-chain at given heights
+        using a single batch request.
+
+        :param heights: list of block heights
+        :return: list of block hashes (in the order of the given heights)
+        :rtype: list
+        """
+        return self._batch('getblockhash', [[height] for height in heights])
+
     def getinfo(self):
         """
         Returns an object containing various state info.
@@ -200,15 +327,24 @@ class BitcoinProxy:
         :return: array of raw transaction data as JSON
         :rtype: dictionary (key=id, value=result)
         """
-        calls = []
-        for tx_id in tx_ids:
-            call = {'method': 'getrawtransaction',
-                    'params': [tx_id, verbose],
-                    'id': tx_id}
-            calls.append(call)
+        return self._batch('getrawtransaction', [[tx_id, verbose] for tx_id in tx_ids])
+
+    def _batch(self, method, params_list):
+        """
+        Executes one batch request calling the given method once for each
+        parameter list and returns the results in the order of the
+        parameter lists.
+        """
+        if not params_list:
+            return []
+        calls = [{'method': method, 'params': params, 'id': index}
+                 for index, params in enumerate(params_list)]
         r = self._jsonrpc_proxy.batch(calls)
 
-        results = []
+        results = [None] * len(calls)
         for entry in r:
-            results.append(entry['result'])
+            if entry.get('error') is not None:
+                raise BitcoindException('Error in RPC call: ' + str(entry['error']),
+                                        code=_error_code(entry['error']))
+            results[entry['id']] = entry['result']
         return results
@@ -6,14 +6,27 @@ the Bitcoin block chain.
 
 """
 
+import itertools
 import logging
-
+from multiprocessing import Pool
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+from bitcoingraph.aggregates import compute_address_aggregates
 from bitcoingraph.bitcoind import BitcoinProxy, BitcoindException
 from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.blockfiles import BlockFileProxy
+from bitcoingraph.cache import BlockCache, CachedBitcoinProxy
+from bitcoingraph.columnar import ParquetDumpWriter
+from bitcoingraph.compression import SUFFIXES
 from bitcoingraph import entities
 from bitcoingraph.graphdb import GraphController
 from bitcoingraph.helper import sort
-from bitcoingraph.writer import CSVDumpWriter
+from bitcoingraph.writer import CHECKPOINT_MANIFEST, CSVDumpWriter, read_checkpoint, \
+    write_checkpoint
 
 logger = logging.getLogger('bitcoingraph')
 
@@ -37,25 +50,54 @@ class BitcoinGraph:
 
     def __init__(self, **config):
         """Create an instance based on the configuration."""
+        self._blockchain_config = config['blockchain']
+        self._block_files = None
+        self._block_cache = None
         self.blockchain = self.__get_blockchain(config['blockchain'])
         if 'neo4j' in config:
             nc = config['neo4j']
             self.graph_db = GraphController(nc['host'], nc['port'], nc['user'], nc['pass'])
 
-    @staticmethod
-    def __get_blockchain(config):
+    def __get_blockchain(self, config):
         """Connect to Bitcoin Core (via JSON-RPC) and return a
         Blockchain object.
+
+        If the configuration contains a blocks_dir, the block files
+        of Bitcoin Core are read directly instead (using a
+        block_file_index of ``BlockFileProxy.index_range`` if given).
+        If it contains a cache_path, blocks and transactions are
+        cached on disk (up to cache_size bytes), or only read from
+        there with cache_read_only. With memory_cache_entries or
+        memory_cache_size, transaction and block objects are kept in
+        an in-memory LRU cache. With resolve_prevouts, the spent
+        outputs of all inputs are resolved per block.
         """
+        config = dict(config)
+        resolve_prevouts = config.pop('resolve_prevouts', False)
+        memory_cache_entries = config.pop('memory_cache_entries', None)
+        memory_cache_size = config.pop('memory_cache_size', None)
+        cache_path = config.pop('cache_path', None)
+        cache_size = config.pop('cache_size', 1024 ** 3)
+        cache_read_only = config.pop('cache_read_only', False)
+        block_file_index = config.pop('block_file_index', None)
+        source = config.get('blocks_dir', config.get('host'))
         try:
-            logger.debug("Connecting to Bitcoin Core at {}".format(config['host']))
-            bc_proxy = BitcoinProxy(**config)
+            logger.debug("Connecting to Bitcoin Core at {}".format(source))
+            if 'blocks_dir' in config:
+                bc_proxy = self._block_files = BlockFileProxy(index=block_file_index, **config)
+            else:
+                bc_proxy = BitcoinProxy(**config)
             bc_proxy.getinfo()
             logger.debug("Connection successful.")
-            blockchain = Blockchain(bc_proxy)
+            if cache_path is not None:
+                self._block_cache = BlockCache(cache_path, cache_size, cache_read_only)
+                bc_proxy = CachedBitcoinProxy(bc_proxy, self._block_cache)
+            blockchain = Blockchain(bc_proxy, resolve_prevouts,
+                                    cache_entries=memory_cache_entries,
+                                    cache_size=memory_cache_size)
             return blockchain
         except BitcoindException as exc:
-            raise BitcoingraphException("Couldn't connect to {}.".format(config['host']), exc)
+            raise BitcoingraphException("Couldn't connect to {}.".format(source), exc)
 
     def get_transaction(self, tx_id):
         """Return a transaction."""
@@ -91,11 +133,13 @@ class BitcoinGraph:
         return self.graph_db.get_address_info(address, date_from, date_to)
 
     def get_address(self, address, current_page, date_from, date_to,
-                    rows_per_page=GraphController.rows_per_page_default):
+                    rows_per_page=GraphController.rows_per_page_default, cursor=None):
         """Return an address with its transaction uses in a given
-        time period.
+        time period. The next_cursor of the address selects the
+        following page.
         """
-        return self.graph_db.get_address(address, current_page, date_from, date_to, rows_per_page)
+        return self.graph_db.get_address(address, current_page, date_from, date_to, rows_per_page,
+                                         cursor)
 
     def get_identities(self, address):
         """Return a list of identities."""
@@ -126,31 +170,209 @@ class BitcoinGraph:
         return self.graph_db.get_unspent_bitcoins(address)
 
     def export(self, start, end, output_path=None, plain_header=False, separate_header=True,
-               progress=None, deduplicate_transactions=True):
-        """Export the blockchain into CSV files."""
+               progress=None, deduplicate_transactions=True, batch_size=None,
+               lookahead=None, input_addresses=False, workers=None,
+               deduplicate_in_writer=False, deduplication_memory=1 << 28,
+               compression=None, format='csv', checkpoint_interval=None, resume=False,
+               integer_ids=False, address_aggregates=False, deduplication_keys=None):
+        """Export the blockchain into CSV files.
+
+        If batch_size is given, blocks are retrieved with batched
+        JSON-RPC requests of that many blocks. If lookahead is given,
+        up to that many blocks are prefetched while writing. With
+        input_addresses, input_addresses.csv is written as well, so
+        that compute_entities can skip resolving the inputs (this
+        requires the export to start at the genesis block).
+
+        With several workers, the range is split into contiguous
+        shards, which are exported by separate processes into shard
+        directories and concatenated in height order afterwards.
+
+        With deduplicate_in_writer, addresses and transactions are
+        deduplicated while writing (using about deduplication_memory
+        bytes, with Bloom filters sized for deduplication_keys keys, see
+        ``CSVDumpWriter``). Afterwards, only addresses.csv is sorted, since the
+        entity computation depends on its order, and the transaction
+        files are left in chain order (unless several workers were
+        used, whose shards may overlap in duplicate transactions).
+
+        If compression ('gzip' or 'zstd') is given, the data files are
+        written compressed, and sorting decompresses them on the fly.
+
+        With format 'parquet', typed Parquet files are written instead
+        (see ``columnar.ParquetDumpWriter``), and compression names the
+        Parquet codec. These files are not sorted, so duplicates are
+        only removed with deduplicate_in_writer.
+
+        With checkpoint_interval, the files are synced to disk every
+        that many blocks and the progress is recorded in a checkpoint
+        manifest. With resume, an export interrupted after a checkpoint
+        is continued from there (checkpointing every 1000 blocks if no
+        interval is given). The manifest is marked before the files are
+        sorted, and it is removed when the export is finished. Input
+        addresses and integer ids cannot be checkpointed.
+
+        With integer_ids, transactions and outputs get consecutive
+        integer ids in the CSV files (see ``CSVDumpWriter``), which
+        requires the export to start at the genesis block. These files
+        are unique without sorting and can only be imported with Neo4j 5.
+
+        With address_aggregates, addresses.csv gets the summary columns
+        of ``aggregates.compute_address_aggregates`` (this requires the
+        export to start at the genesis block as well).
+        """
+        if start != 0 and (input_addresses or integer_ids or address_aggregates):
+            # inputs spending outputs of earlier blocks could not be resolved
+            raise ValueError('input addresses, integer ids and address aggregates require the '
+                             'export to start at the genesis block')
+        if address_aggregates and (compression is not None or integer_ids or
+                                   format != 'csv' or not separate_header):
+            raise ValueError('address aggregates require uncompressed CSV files with string '
+                             'ids and separate headers')
         if output_path is None:
             output_path = 'blocks_{}_{}'.format(start, end)
 
-        number_of_blocks = end - start + 1
-        with CSVDumpWriter(output_path, plain_header, separate_header) as writer:
-            for block in self.blockchain.get_blocks_in_range(start, end):
-                writer.write(block)
-                if progress:
-                    processed_blocks = block.height - start + 1
-                    last_percentage = ((processed_blocks - 1) * 100) // number_of_blocks
-                    percentage = (processed_blocks * 100) // number_of_blocks
-                    if percentage > last_percentage:
-                        progress(processed_blocks / number_of_blocks)
-        if separate_header:
-            sort(output_path, 'addresses.csv', '-u')
-            if deduplicate_transactions:
+        checkpoint = None
+        if resume and checkpoint_interval is None:
+            checkpoint_interval = 1000
+        if checkpoint_interval is not None:
+            if format != 'csv' or (workers is not None and workers > 1):
+                raise ValueError('only CSV exports of a single process can be checkpointed')
+            if input_addresses or integer_ids:
+                raise ValueError('exports with input addresses or integer ids cannot be '
+                                 'checkpointed')
+            if resume:
+                checkpoint = read_checkpoint(output_path)
+            if checkpoint is not None and (checkpoint['start'], checkpoint['end']) != (start, end):
+                raise ValueError('the checkpoint belongs to the export of blocks {} to {}'.format(
+                    checkpoint['start'], checkpoint['end']))
+
+        if workers is not None and workers > 1:
+            if input_addresses or integer_ids:
+                raise ValueError('input addresses and integer ids cannot be written by '
+                                 'several workers')
+            if format != 'csv':
+                raise ValueError('only CSV files can be written by several workers')
+            self._export_shards(start, end, output_path, plain_header, separate_header,
+                                progress, batch_size, lookahead, workers,
+                                deduplicate_in_writer, deduplication_memory, compression,
+                                deduplication_keys)
+        elif checkpoint is not None and (checkpoint.get('sorting') or
+                                         checkpoint['height'] == end):
+            # interrupted before or while sorting, which leaves each file unsorted or sorted
+            pass
+        else:
+            number_of_blocks = end - start + 1
+            first = start if checkpoint is None else checkpoint['height'] + 1
+            if format == 'parquet':
+                writer = ParquetDumpWriter(output_path, input_addresses, deduplicate_in_writer,
+                                           deduplication_memory, compression,
+                                           deduplication_keys=deduplication_keys)
+            elif format == 'csv':
+                writer = CSVDumpWriter(output_path, plain_header, separate_header,
+                                       input_addresses, deduplicate_in_writer,
+                                       deduplication_memory, compression, checkpoint,
+                                       integer_ids, deduplication_keys)
+            else:
+                raise ValueError('Unknown export format: {}'.format(format))
+            with writer:
+                if checkpoint_interval is not None and checkpoint is None:
+                    writer.checkpoint(start - 1, start=start, end=end)
+                for block in self.blockchain.get_blocks_in_range(first, end, batch_size,
+                                                                 lookahead):
+                    writer.write(block)
+                    if checkpoint_interval is not None and (
+                            (block.height - start + 1) % checkpoint_interval == 0
+                            or block.height == end):
+                        writer.checkpoint(block.height, start=start, end=end)
+                    if progress:
+                        processed_blocks = block.height - start + 1
+                        last_percentage = ((processed_blocks - 1) * 100) // number_of_blocks
+                        percentage = (processed_blocks * 100) // number_of_blocks
+                        if percentage > last_percentage:
+                            progress(processed_blocks / number_of_blocks)
+        if checkpoint_interval is not None:
+            write_checkpoint(output_path, dict(read_checkpoint(output_path), sorting=True))
+        if separate_header and format == 'csv':
+            suffix = '.csv' + SUFFIXES.get(compression, '')
+            sort(output_path, 'addresses' + suffix, '-u')
+            # integer ids are unique, so only the address file can contain duplicates
+            unique_transactions = integer_ids or (
+                deduplicate_in_writer and (workers is None or workers <= 1))
+            if deduplicate_transactions and not unique_transactions:
                 for base_name in ['transactions', 'rel_tx_output',
                                   'outputs', 'rel_output_address']:
-                    sort(output_path, base_name + '.csv', '-u')
-
-    def synchronize(self, max_blocks=None):
+                    sort(output_path, base_name + suffix, '-u')
+        if address_aggregates:
+            compute_address_aggregates(output_path, plain_header)
+        if checkpoint_interval is not None:
+            os.remove(os.path.join(output_path, CHECKPOINT_MANIFEST))
+
+    def _export_shards(self, start, end, output_path, plain_header, separate_header,
+                       progress, batch_size, lookahead, workers, deduplicate,
+                       deduplication_memory, compression, deduplication_keys):
+        # more shards than workers, since later blocks take much longer
+        number_of_blocks = end - start + 1
+        number_of_shards = min(workers * 4, number_of_blocks)
+        blockchain_config = dict(self._blockchain_config)
+        if self._block_cache is not None:
+            # the workers only read the cache, which is not locked by pending writes
+            self._block_cache.commit()
+            blockchain_config['cache_read_only'] = True
+        shards = []
+        for number in range(number_of_shards):
+            shard_start = start + number_of_blocks * number // number_of_shards
+            shard_end = start + number_of_blocks * (number + 1) // number_of_shards - 1
+            shard_path = os.path.join(output_path, 'shard_{}_{}'.format(shard_start, shard_end))
+            shard_config = blockchain_config
+            if self._block_files is not None:
+                # the block files are indexed once instead of in each worker
+                shard_config = dict(blockchain_config, block_file_index=(
+                    self._block_files.index_range(shard_start, shard_end)))
+            shards.append((shard_config, shard_start, shard_end, shard_path,
+                           batch_size, lookahead, deduplicate, deduplication_memory,
+                           compression, deduplication_keys))
+        # writes the headers
+        CSVDumpWriter(output_path, plain_header, separate_header, compression=compression)
+        exported_blocks = 0
+        with Pool(workers) as pool:
+            for shard_start, shard_end in pool.imap_unordered(_export_shard, shards):
+                exported_blocks += shard_end - shard_start + 1
+                if progress:
+                    progress(exported_blocks / number_of_blocks)
+        suffix = '.csv' + SUFFIXES.get(compression, '')
+        for shard in shards:
+            shard_path = shard[3]
+            for filename in sorted(os.listdir(shard_path)):
+                # compressed shards are concatenated as gzip members or zstd frames
+                if filename.endswith(suffix) and not filename.endswith('_header.csv'):
+                    with open(os.path.join(shard_path, filename), 'rb') as shard_file, \
+                            open(os.path.join(output_path, filename), 'ab') as output_file:
+                        shutil.copyfileobj(shard_file, output_file)
+            shutil.rmtree(shard_path)
+
+    def synchronize(self, max_blocks=None, batch_size=None, lookahead=None, queue_size=4,
+                    catch_up_threshold=None, staging_path=None, load_batch_size=10000,
+                    progress=None):
         """Synchronise the graph database with the blockchain
         information from the bitcoin client.
+
+        Blocks are fetched, converted into statement parameters and
+        committed by concurrent stages, connected by queues holding up
+        to queue_size blocks. Blocks are committed in height order, and
+        the entities of each block are created before the next block is
+        committed, as both write the same address nodes. If a stage
+        fails, the pipeline stops and a BitcoingraphException names the
+        last synchronised height.
+
+        If catch_up_threshold is given and more blocks are missing, all
+        but the last catch_up_threshold of them are exported into the
+        staging directory (a temporary directory by default) and loaded
+        in batches of about load_batch_size rows first.
+
+        If progress is given, it is called with the fraction of the
+        blocks synchronised block by block after the entities of each
+        block have been created.
         """
         start = self.graph_db.get_max_block_height() + 1
         blockchain_end = self.blockchain.get_max_block_height() - 2
@@ -161,18 +383,136 @@ class BitcoinGraph:
                 end = blockchain_end
             else:
                 end = min(start + max_blocks - 1, blockchain_end)
+            if catch_up_threshold is not None and end - start + 1 > catch_up_threshold:
+                catch_up_end = end - catch_up_threshold
+                self._catch_up(start, catch_up_end, batch_size, lookahead, staging_path,
+                               load_batch_size)
+                start = catch_up_end + 1
+                if start > end:
+                    return
             print('add blocks', start, 'to', end)
-            for block in self.blockchain.get_blocks_in_range(start, end):
-                self.graph_db.add_block(block)
+            blocks = self.blockchain.get_blocks_in_range(start, end, batch_size, lookahead)
+            self._synchronize_blocks(blocks, start, end, queue_size, progress)
 
-
-def compute_entities(input_path, sort_input=False):
+    def _catch_up(self, start, end, batch_size, lookahead, staging_path, load_batch_size):
+        print('catch up on blocks', start, 'to', end)
+        if staging_path is None:
+            output_path = tempfile.mkdtemp(prefix='bcgraph_')
+        else:
+            output_path = os.path.join(staging_path, 'blocks_{}_{}'.format(start, end))
+            if os.path.exists(output_path):
+                # left behind by an interrupted catch-up
+                shutil.rmtree(output_path)
+        self.export(start, end, output_path, deduplicate_transactions=False,
+                    batch_size=batch_size, lookahead=lookahead)
+        self.graph_db.load_export(output_path, load_batch_size)
+        shutil.rmtree(output_path)
+
+    def _synchronize_blocks(self, blocks, start, end, queue_size, progress=None):
+        errors = []
+        prepared = queue.Queue(queue_size)
+        synchronized = queue.Queue(queue_size)
+        last_committed = [start - 1]
+
+        def synchronize(parameters):
+            self.graph_db.commit_block(parameters)
+            last_committed[0] = parameters['height']
+            # the entities are created before the next block is committed, since both
+            # write the address nodes
+            self.graph_db.create_entities([tx['txid'] for tx in parameters['transactions']])
+            return parameters['height']
+
+        stages = [
+            threading.Thread(target=_pipeline_stage, args=(
+                self.graph_db.prepare_block,
+                itertools.takewhile(lambda block: not errors, blocks), prepared, errors)),
+            threading.Thread(target=_pipeline_stage, args=(
+                synchronize, iter(prepared.get, _END_OF_PIPELINE), synchronized, errors))]
+        for stage in stages:
+            stage.start()
+        last_synchronized = start - 1
+        for height in iter(synchronized.get, _END_OF_PIPELINE):
+            last_synchronized = height
+            if progress:
+                progress((height - start + 1) / (end - start + 1))
+        for stage in stages:
+            stage.join()
+        if errors:
+            msg = 'Synchronisation stopped after block {}'.format(last_synchronized)
+            if last_committed[0] > last_synchronized:
+                msg += ', entities of block {} are missing'.format(last_committed[0])
+            raise BitcoingraphException(msg, errors[0])
+
+
+_END_OF_PIPELINE = object()
+
+
+def _pipeline_stage(function, items, output, errors):
+    """Pass the results of a function for all items on to the output
+    queue, until an error occurs in any stage."""
+    try:
+        for item in items:
+            if not errors:
+                output.put(function(item))
+    except Exception as exc:
+        errors.append(exc)
+        # unblock the previous stage
+        for item in items:
+            pass
+    finally:
+        output.put(_END_OF_PIPELINE)
+
+
+def _export_shard(shard):
+    """Export a shard of blocks in a worker process."""
+    (blockchain_config, start, end, shard_path, batch_size, lookahead,
+     deduplicate, deduplication_memory, compression, deduplication_keys) = shard
+    blockchain = BitcoinGraph(blockchain=blockchain_config).blockchain
+    with CSVDumpWriter(shard_path, deduplicate=deduplicate,
+                       deduplication_memory=deduplication_memory,
+                       compression=compression,
+                       deduplication_keys=deduplication_keys) as writer:
+        for block in blockchain.get_blocks_in_range(start, end, batch_size, lookahead):
+            writer.write(block)
+    return start, end
+
+
+def compute_entities(input_path, sort_input=False, memory_limit=None, state_path=None,
+                     workers=None, hash_index=False, resolve_inputs=True):
     """Read exported CSV files containing blockchain information and
     export entities into CSV files.
+
+    If memory_limit (in bytes) is given, the entities are computed
+    out-of-core and sorting uses buffers within that limit. If
+    state_path is given, the entity state is saved there for later
+    updates with update_entities. With workers, the inputs are
+    clustered by that many processes. With hash_index, spent outputs
+    are resolved with an on-disk hash index and no file is sorted
+    (except rel_output_address.csv if state_path is given). Without
+    resolve_inputs, the input_addresses.csv written during the export
+    is used.
+    """
+    buffer_size = '50%' if memory_limit is None else '{}b'.format(memory_limit // 2)
+    if resolve_inputs and hash_index:
+        entities.resolve_input_addresses(input_path)
+    elif resolve_inputs:
+        if sort_input:
+            sort(input_path, 'rel_output_address.csv', buffer_size=buffer_size)
+        sort(input_path, 'rel_input.csv', '-k 2 -t ,', buffer_size)
+        entities.calculate_input_addresses(input_path)
+        sort(input_path, 'input_addresses.csv', buffer_size=buffer_size)
+    if state_path is not None and (hash_index or not resolve_inputs):
+        # update_entities searches the output addresses of this export
+        sort(input_path, 'rel_output_address.csv', buffer_size=buffer_size)
+    entities.compute_entities(input_path, memory_limit, state_path, workers)
+
+
+def update_entities(input_path, state_path, sort_input=False):
+    """Update the entity state saved by compute_entities with the
+    export of further blocks and export the new entities, the
+    entities of the new addresses and the merged entities into CSV
+    files.
     """
     if sort_input:
         sort(input_path, 'rel_output_address.csv')
-    sort(input_path, 'rel_input.csv', '-k 2 -t ,')
-    entities.calculate_input_addresses(input_path)
-    sort(input_path, 'input_addresses.csv')
-    entities.compute_entities(input_path)
+    entities.update_entities(state_path, input_path)
@@ -5,8 +5,12 @@ An API for traversing the Bitcoin blockchain
 
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from bitcoingraph.model import Block, Transaction
-from bitcoingraph.bitcoind import BitcoindException
+from bitcoingraph.bitcoind import BitcoindException, RPC_INVALID_PARAMETER, RPC_TYPE_ERROR
+from bitcoingraph.cache import LRUCache
 
 __author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
 __copyright__ = 'Copyright 2015, Bernhard Haslhofer'
@@ -32,15 +36,85 @@ class Blockchain:
     Bitcoin block chain.
     """
 
-    def __init__(self, bitcoin_proxy):
+    def __init__(self, bitcoin_proxy, resolve_prevouts=False, prevout_batch_size=500,
+                 cache_entries=None, cache_size=None):
         """
         Creates a block chain object.
 
+        If resolve_prevouts is set, the spent outputs of all inputs are
+        resolved when a block is retrieved, either with ``getblock``
+        verbosity 3 (if supported by the node) or with batched
+        ``getrawtransaction`` requests of at most prevout_batch_size
+        transactions.
+
+        If cache_entries or cache_size is set, retrieved transactions and
+        blocks are kept in an LRU cache limited to that number of objects
+        or that approximate number of bytes. The cache is also filled with
+        the transactions of each retrieved block.
+
         :param BitcoinProxy bitcoin_proxy: reference to Bitcoin proxy
+        :param bool resolve_prevouts: resolve spent outputs of blocks
+        :param int prevout_batch_size: transactions per batch request
+        :param int cache_entries: maximum number of cached objects
+        :param int cache_size: maximum approximate size of cached objects
         :return: block chain object
         :rtype: Blockchain
         """
         self._bitcoin_proxy = bitcoin_proxy
+        self._resolve_prevouts = resolve_prevouts
+        self._prevout_batch_size = prevout_batch_size
+        self._prevout_verbosity_supported = None
+        if cache_entries is None and cache_size is None:
+            self._cache = None
+        else:
+            self._cache = LRUCache(cache_entries, cache_size, _approximate_size)
+
+    def cache_statistics(self):
+        """
+        Returns hits, misses, evictions, entries and approximate size of
+        the object cache, or None if caching is disabled.
+
+        :rtype: dict
+        """
+        return None if self._cache is None else self._cache.statistics()
+
+    def _cache_block(self, block):
+        if self._cache is None:
+            return
+        for tx in block.transactions:
+            if tx.is_loaded():
+                self._cache.put(('tx', tx.txid), tx)
+        # blocks at the tip are not cached, since their successor is not known yet
+        if block.has_next_block():
+            self._cache.put(('block', block.hash), block)
+
+    def _get_cached(self, kind, key):
+        return None if self._cache is None else self._cache.get((kind, key))
+
+    def _get_raw_blocks(self, block_hashes):
+        if self._resolve_prevouts and self._prevout_verbosity_supported is not False:
+            try:
+                raw_blocks_data = self._bitcoin_proxy.getblocks(block_hashes, 3)
+                self._prevout_verbosity_supported = True
+                return raw_blocks_data
+            except BitcoindException as exc:
+                # only nodes rejecting the verbosity itself fall back to
+                # verbosity 2, other errors (e.g. during warm-up) are raised
+                if self._prevout_verbosity_supported or \
+                        exc.code not in (RPC_INVALID_PARAMETER, RPC_TYPE_ERROR):
+                    raise
+                self._prevout_verbosity_supported = False
+        # verbosity 2 includes the transactions, which would otherwise be
+        # retrieved one by one
+        return self._bitcoin_proxy.getblocks(block_hashes, 2)
+
+    def _create_blocks(self, raw_blocks_data):
+        blocks = [Block(self, json_data=raw_block_data) for raw_block_data in raw_blocks_data]
+        if self._resolve_prevouts:
+            self.resolve_prevouts(blocks)
+        for block in blocks:
+            self._cache_block(block)
+        return blocks
 
     def get_block_by_hash(self, block_hash):
         """
@@ -52,9 +126,16 @@ class Blockchain:
         :raises BlockchainException: if block cannot be retrieved
         """
         # Returns block by hash
+        block = self._get_cached('block', block_hash)
+        if block is not None:
+            return block
         try:
+            if self._resolve_prevouts:
+                return self._create_blocks(self._get_raw_blocks([block_hash]))[0]
             raw_block_data = self._bitcoin_proxy.getblock(block_hash)
-            return Block(self, json_data=raw_block_data)
+            block = Block(self, json_data=raw_block_data)
+            self._cache_block(block)
+            return block
         except BitcoindException as exc:
             raise BlockchainException('Cannot retrieve block {}'.format(block_hash), exc)
 
@@ -75,15 +156,34 @@ class Blockchain:
             raise BlockchainException(
                 'Cannot retrieve block with height {}'.format(block_height), exc)
 
-    def get_blocks_in_range(self, start_height=0, end_height=0):
+    def get_blocks_in_range(self, start_height=0, end_height=0, batch_size=None,
+                            lookahead=None):
         """
         Generates blocks in a given range.
 
+        If a batch size is given, the blocks are retrieved in windows of
+        that size, each costing one batched ``getblockhash`` and one
+        batched ``getblock`` request.
+
+        If a lookahead is given, upcoming blocks are fetched and parsed
+        by worker threads while the current block is being consumed.
+        Blocks are still generated in height order and at most
+        ``lookahead`` blocks are held in advance, so batches are limited
+        to ``lookahead`` blocks.
+
         :param int start_height: first block height in range
         :param int end_height: last block height in range
+        :param int batch_size: number of blocks retrieved per batch request
+        :param int lookahead: number of blocks prefetched in background
         :yield: the requested blocks
         :rtype: Block
         """
+        if lookahead is not None:
+            yield from self._prefetch_blocks(start_height, end_height, batch_size, lookahead)
+            return
+        if batch_size is not None:
+            yield from self._get_blocks_in_batches(start_height, end_height, batch_size)
+            return
         block = self.get_block_by_height(start_height)
         while block.height <= end_height:
             yield block
@@ -92,6 +192,91 @@ class Blockchain:
             else:
                 break
 
+    def _windows(self, start_height, end_height, batch_size):
+        if batch_size < 1:
+            raise ValueError('batch size must be positive')
+        end_height = min(end_height, self.get_max_block_height())
+        for window_start in range(start_height, end_height + 1, batch_size):
+            yield window_start, min(window_start + batch_size - 1, end_height)
+
+    def _get_blocks_in_batches(self, start_height, end_height, batch_size):
+        for window in self._windows(start_height, end_height, batch_size):
+            yield from self.get_blocks_in_window(*window)
+
+    def _prefetch_blocks(self, start_height, end_height, batch_size, lookahead):
+        if lookahead < 1:
+            raise ValueError('lookahead must be positive')
+        # windows larger than the lookahead would hold more blocks in advance
+        window_size = 1 if batch_size is None else min(batch_size, lookahead)
+        max_pending = max(1, lookahead // window_size)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_pending) as executor:
+            try:
+                for window in self._windows(start_height, end_height, window_size):
+                    if len(pending) == max_pending:
+                        yield from pending.popleft().result()
+                    pending.append(executor.submit(self._fetch_window, *window))
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _fetch_window(self, start_height, end_height):
+        blocks = self.get_blocks_in_window(start_height, end_height)
+        for block in blocks:
+            for tx in block.transactions:
+                tx.outputs
+        return blocks
+
+    def get_blocks_in_window(self, start_height, end_height):
+        """
+        Returns all blocks in a given range, including their
+        transactions, using two batch requests.
+
+        :param int start_height: first block height in range
+        :param int end_height: last block height in range
+        :return: the requested blocks
+        :rtype: Block list
+        :raises BlockchainException: if blocks cannot be retrieved
+        """
+        try:
+            block_hashes = self._bitcoin_proxy.getblockhashes(
+                list(range(start_height, end_height + 1)))
+            return self._create_blocks(self._get_raw_blocks(block_hashes))
+        except BitcoindException as exc:
+            raise BlockchainException('Cannot retrieve blocks with heights {} to {}'.format(
+                start_height, end_height), exc)
+
+    def resolve_prevouts(self, blocks):
+        """
+        Sets the spent outputs of all inputs in the given blocks.
+
+        Transactions of the blocks themselves are used where possible,
+        all others are retrieved with batch requests.
+
+        :param blocks: list of blocks
+        :raises BlockchainException: if transactions cannot be retrieved
+        """
+        transactions = [tx for block in blocks for tx in block.transactions]
+        unloaded = [tx for tx in transactions if not tx.is_loaded()]
+        for tx, loaded_tx in zip(unloaded, self._get_transactions_in_batches(
+                [tx.txid for tx in unloaded])):
+            tx._load(loaded_tx)
+
+        inputs = [input for tx in transactions for input in tx.inputs
+                  if not input.is_resolved()]
+        known = {tx.txid: tx for tx in transactions}
+        missing = list({input.output_reference['txid'] for input in inputs} - known.keys())
+        known.update(zip(missing, self._get_transactions_in_batches(missing)))
+        for input in inputs:
+            reference = input.output_reference
+            input.output = known[reference['txid']].outputs[reference['vout']]
+
+    def _get_transactions_in_batches(self, tx_ids):
+        for start in range(0, len(tx_ids), self._prevout_batch_size):
+            yield from self.get_transactions(tx_ids[start:start + self._prevout_batch_size])
+
     def get_transaction(self, tx_id):
         """
         Returns a transaction by given transaction id.
@@ -100,11 +285,17 @@ class Blockchain:
         :return: the requested transaction
         :rtype: Transaction
         """
+        tx = self._get_cached('tx', tx_id)
+        if tx is not None:
+            return tx
         try:
             raw_tx_data = self._bitcoin_proxy.getrawtransaction(tx_id)
-            return Transaction(self, json_data=raw_tx_data)
+            tx = Transaction(self, json_data=raw_tx_data)
         except BitcoindException as exc:
             raise BlockchainException('Cannot retrieve transaction with id {}'.format(tx_id), exc)
+        if self._cache is not None:
+            self._cache.put(('tx', tx_id), tx)
+        return tx
 
     def get_transactions(self, tx_ids):
         """
@@ -114,11 +305,17 @@ class Blockchain:
         :return: list of transaction objects
         :rtype: Transaction list
         """
+        txs = [self._get_cached('tx', tx_id) for tx_id in tx_ids]
+        missing = [tx_id for tx_id, tx in zip(tx_ids, txs) if tx is None]
+        if not missing:
+            return txs
         try:
-            txs = []
-            raw_txs_data = self._bitcoin_proxy.getrawtransactions(tx_ids)
-            for raw_tx_data in raw_txs_data:
-                txs.append(Transaction(raw_tx_data, self))
+            raw_txs_data = iter(self._bitcoin_proxy.getrawtransactions(missing))
+            for index, tx in enumerate(txs):
+                if tx is None:
+                    txs[index] = Transaction(self, json_data=next(raw_txs_data))
+                    if self._cache is not None:
+                        self._cache.put(('tx', txs[index].txid), txs[index])
             return txs
         except BitcoindException as exc:
             raise BlockchainException('Cannot retrieve transactions {}'.format(tx_ids), exc)
@@ -136,3 +333,15 @@ class Blockchain:
         except BitcoindException as exc:
             raise BlockchainException("Error when retrieving maximum\
                 block height", exc)
+
+
+def _approximate_size(obj):
+    """
+    Returns a rough estimate of the memory used by a cached transaction
+    or block in bytes.
+    """
+    if isinstance(obj, Transaction):
+        if not obj.is_loaded():
+            return 200
+        return 400 + 300 * (len(obj.inputs) + len(obj.outputs))
+    return 400 + sum(_approximate_size(tx) for tx in obj.transactions)
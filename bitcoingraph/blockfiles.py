@@ -0,0 +1,236 @@
+"""
+blockfiles
+
+Direct access to the block files (blocks/blk*.dat) of Bitcoin Core.
+
+"""
+
+import mmap
+import os
+import re
+
+from bitcoingraph.bitcoind import BitcoindException
+from bitcoingraph.cache import LRUCache
+from bitcoingraph.serialization import deserialize_block, sha256d, to_hex_hash
+
+__author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
+__copyright__ = 'Copyright 2015, Bernhard Haslhofer'
+__license__ = "MIT"
+
+
+MAINNET_MAGIC = bytes.fromhex('f9beb4d9')
+
+_BLOCK_FILE_PATTERN = re.compile(r'^blk(\d{5})\.dat$')
+
+
+class BlockFileProxy:
+    """
+    Drop-in replacement for BitcoinProxy which reads blocks from the block
+    files of a (stopped) Bitcoin Core node instead of requesting them via
+    JSON-RPC.
+
+    The block files are indexed with buffered reads, and blocks are read
+    from memory maps of the recently used files, since a memory map keeps
+    a file descriptor open and mainnet has thousands of block files.
+
+    Bitcoin Core stores blocks in the order of arrival, which can differ
+    from the chain order and includes stale blocks. The main chain is
+    therefore reconstructed from the previous-block references of all
+    stored headers: it is the longest chain starting from the first
+    block (the genesis block, unless only a part of the chain is
+    available, in which case its height can be given by
+    ``base_height``).
+
+    Transactions cannot be looked up by id, since there is no transaction
+    index.
+    """
+
+    def __init__(self, blocks_dir, base_height=0, magic=MAINNET_MAGIC, index=None,
+                 max_open_files=64):
+        """
+        Creates a proxy and indexes the block files.
+
+        :param str blocks_dir: path of the blocks directory of Bitcoin Core
+        :param int base_height: height of the first block in the files
+        :param bytes magic: network message start bytes
+        :param index: index returned by ``index_range``, which is used
+            instead of indexing the block files
+        :param int max_open_files: maximum number of memory-mapped files
+        :return: block file proxy object
+        :rtype: BlockFileProxy
+        """
+        self._blocks_dir = blocks_dir
+        self._base_height = base_height
+        self._magic = magic
+        self._max_open_files = max_open_files
+        self._files = LRUCache(max_open_files)
+        self._xor_key = self._read_xor_key()
+        self._positions = {}
+        self._heights = {}
+        self._main_chain = []
+        if index is None:
+            self._index()
+        else:
+            self._base_height, self._positions, self._main_chain = index
+            self._heights = {bytes.fromhex(block_hash)[::-1]: self._base_height + number
+                             for number, block_hash in enumerate(self._main_chain)}
+
+    def index_range(self, start_height, end_height):
+        """
+        Returns the part of the index covering the main chain blocks in
+        a height range, so that a proxy for these blocks can be created
+        (e.g. in another process) without indexing the block files again.
+        The successor of the last block is included as well, so that
+        the blocks reference their next block.
+
+        :param int start_height: first block height
+        :param int end_height: last block height
+        :return: index for the ``index`` parameter of the constructor
+        """
+        first = max(start_height - self._base_height, 0)
+        main_chain = self._main_chain[first:end_height - self._base_height + 2]
+        positions = {}
+        for block_hash in main_chain:
+            key = bytes.fromhex(block_hash)[::-1]
+            positions[key] = self._positions[key]
+        return self._base_height + first, positions, main_chain
+
+    def _read_xor_key(self):
+        path = os.path.join(self._blocks_dir, 'xor.dat')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                key = f.read()
+            if any(key):
+                return key
+        return None
+
+    def _file_numbers(self):
+        try:
+            names = os.listdir(self._blocks_dir)
+        except OSError as exc:
+            raise BitcoindException('Cannot read block files: {}'.format(exc))
+        return sorted(int(match.group(1)) for match in map(_BLOCK_FILE_PATTERN.match, names)
+                      if match)
+
+    def _path(self, file_number):
+        return os.path.join(self._blocks_dir, 'blk{:05d}.dat'.format(file_number))
+
+    def _file(self, file_number):
+        block_file = self._files.get(file_number)
+        if block_file is None:
+            # evicted maps are closed when the last block read from them is released
+            with open(self._path(file_number), 'rb') as f:
+                block_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._files.put(file_number, block_file)
+        return block_file
+
+    def _read(self, file_number, offset, size):
+        return self._deobfuscate(memoryview(self._file(file_number))[offset:offset + size],
+                                 offset)
+
+    def _deobfuscate(self, data, offset):
+        if self._xor_key is None:
+            return data
+        size = len(data)
+        key_length = len(self._xor_key)
+        start = offset % key_length
+        key_stream = (self._xor_key * ((start + size) // key_length + 1))[start:start + size]
+        return (int.from_bytes(data, 'little') ^
+                int.from_bytes(key_stream, 'little')).to_bytes(size, 'little')
+
+    def _index(self):
+        previous = {}
+        for file_number in self._file_numbers():
+            with open(self._path(file_number), 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                offset = 0
+                while offset + 88 <= file_size:
+                    f.seek(offset)
+                    data = bytes(self._deobfuscate(f.read(88), offset))
+                    if data[:4] != self._magic:
+                        break
+                    size = int.from_bytes(data[4:8], 'little')
+                    if offset + 8 + size > file_size:
+                        break
+                    header = data[8:]
+                    block_hash = sha256d(header)
+                    self._positions[block_hash] = (file_number, offset + 8, size)
+                    previous[block_hash] = header[4:36]
+                    offset += 8 + size
+
+        heights = self._heights
+        for block_hash in previous:
+            path = []
+            current = block_hash
+            while current not in heights and current in previous:
+                path.append(current)
+                current = previous[current]
+            height = heights.get(current, self._base_height - 1)
+            for h in reversed(path):
+                height += 1
+                heights[h] = height
+        if not heights:
+            return
+        tip = max(heights, key=heights.get)
+        chain = []
+        current = tip
+        while current in previous:
+            chain.append(current)
+            current = previous[current]
+        chain.reverse()
+        self._main_chain = [to_hex_hash(block_hash) for block_hash in chain]
+
+    def close(self):
+        self._files = LRUCache(self._max_open_files)
+
+    def getblock(self, block_hash, verbosity=None):
+        """
+        Returns the block with the given hash.
+
+        The verbosity is ignored, since spent outputs are not available.
+
+        :param str block_hash: the block hash
+        :return: block in the format of ``getblock`` with transactions
+        :rtype: dict
+        """
+        key = bytes.fromhex(block_hash)[::-1]
+        if key not in self._positions:
+            raise BitcoindException('Unknown block {}'.format(block_hash))
+        block = deserialize_block(self._read(*self._positions[key]))
+        height = self._heights[key]
+        block['height'] = height
+        if self._is_in_main_chain(block_hash, height):
+            block['confirmations'] = self.getblockcount() - height + 1
+            if height < self.getblockcount():
+                block['nextblockhash'] = self.getblockhash(height + 1)
+        else:
+            block['confirmations'] = -1
+        return block
+
+    def _is_in_main_chain(self, block_hash, height):
+        index = height - self._base_height
+        return 0 <= index < len(self._main_chain) and self._main_chain[index] == block_hash
+
+    def getblocks(self, block_hashes, verbosity=None):
+        return [self.getblock(block_hash) for block_hash in block_hashes]
+
+    def getblockcount(self):
+        return self._base_height + len(self._main_chain) - 1
+
+    def getblockhash(self, height):
+        index = height - self._base_height
+        if not 0 <= index < len(self._main_chain):
+            raise BitcoindException('Block height out of range: {}'.format(height))
+        return self._main_chain[index]
+
+    def getblockhashes(self, heights):
+        return [self.getblockhash(height) for height in heights]
+
+    def getinfo(self):
+        return {'blocks': self.getblockcount(), 'blocks_dir': self._blocks_dir}
+
+    def getrawtransaction(self, tx_id, verbose=1):
+        raise BitcoindException('Transactions cannot be looked up in block files')
+
+    def getrawtransactions(self, tx_ids, verbose=1):
+        raise BitcoindException('Transactions cannot be looked up in block files')
@@ -0,0 +1,338 @@
+"""
+cache
+
+A persistent block and transaction cache for the Bitcoin proxies and an
+in-memory LRU cache for block chain objects.
+
+"""
+
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+import zlib
+
+__author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
+__copyright__ = 'Copyright 2015, Bernhard Haslhofer'
+__license__ = "MIT"
+
+
+class BlockCache:
+    """
+    On-disk cache of blocks and transactions.
+
+    Payloads are stored zlib-compressed and keyed by their hash in an
+    SQLite database, together with an index from block heights to hashes.
+    If the total size of the stored payloads exceeds the size limit, the
+    least recently used payloads are evicted. The height index is small
+    and kept, since the hash of a block at a given height does not change
+    once it is deeply confirmed.
+    """
+
+    def __init__(self, path, max_size=1024 ** 3, read_only=False):
+        """
+        Opens or creates a cache.
+
+        A read-only cache opens an existing database without modifying
+        it, neither by inserts nor by access times, so that several
+        processes can read it at the same time.
+
+        :param str path: directory of the cache database
+        :param int max_size: maximum size of the compressed payloads in bytes
+        :param bool read_only: only read from an existing cache
+        :return: block cache object
+        :rtype: BlockCache
+        """
+        self.max_size = max_size
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = 0
+        self._clock = 0
+        self._pending_writes = 0
+        database_path = os.path.join(path, 'cache.db')
+        if read_only:
+            self._connection = sqlite3.connect(
+                'file:{}?mode=ro'.format(pathname2url(os.path.abspath(database_path))),
+                uri=True, check_same_thread=False)
+            return
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS payloads (
+                key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_access INTEGER);
+            CREATE INDEX IF NOT EXISTS payloads_last_access ON payloads (last_access);
+            CREATE TABLE IF NOT EXISTS heights (height INTEGER PRIMARY KEY, hash TEXT);''')
+        size, last_access = self._connection.execute(
+            'SELECT coalesce(sum(size), 0), coalesce(max(last_access), 0) '
+            'FROM payloads').fetchone()
+        self._size = size
+        self._clock = last_access
+
+    def hit_rate(self):
+        """
+        Returns the fraction of lookups which were answered by the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @staticmethod
+    def _block_key(block_hash, verbosity):
+        if verbosity is None:
+            return 'block:' + block_hash
+        return 'block{}:{}'.format(verbosity, block_hash)
+
+    def get_block(self, block_hash, verbosity=None):
+        return self._get(self._block_key(block_hash, verbosity))
+
+    def put_block(self, block, verbosity=None):
+        if self.read_only:
+            return
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO heights VALUES (?, ?)',
+                                     (block['height'], block['hash']))
+            self._put(self._block_key(block['hash'], verbosity), block)
+
+    def get_block_hash(self, height):
+        with self._lock:
+            row = self._connection.execute('SELECT hash FROM heights WHERE height = ?',
+                                           (height,)).fetchone()
+            self._count(row is not None)
+        return row[0] if row else None
+
+    def get_transaction(self, tx_id):
+        return self._get('tx:' + tx_id)
+
+    def put_transaction(self, tx):
+        if self.read_only:
+            return
+        with self._lock:
+            self._put('tx:' + tx['txid'], tx)
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _tick(self):
+        # access times are committed lazily, payloads on each insert
+        self._clock += 1
+        self._pending_writes += 1
+        if self._pending_writes >= 1000:
+            self._connection.commit()
+            self._pending_writes = 0
+        return self._clock
+
+    def _get(self, key):
+        with self._lock:
+            row = self._connection.execute('SELECT data FROM payloads WHERE key = ?',
+                                           (key,)).fetchone()
+            self._count(row is not None)
+            if row is None:
+                return None
+            if not self.read_only:
+                self._connection.execute('UPDATE payloads SET last_access = ? WHERE key = ?',
+                                         (self._tick(), key))
+        return json.loads(zlib.decompress(row[0]).decode())
+
+    def _put(self, key, value):
+        data = zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+        row = self._connection.execute('SELECT size FROM payloads WHERE key = ?',
+                                       (key,)).fetchone()
+        if row is not None:
+            self._size -= row[0]
+        self._connection.execute('INSERT OR REPLACE INTO payloads VALUES (?, ?, ?, ?)',
+                                 (key, data, len(data), self._tick()))
+        self._size += len(data)
+        if self._size > self.max_size:
+            self._evict()
+        self._connection.commit()
+        self._pending_writes = 0
+
+    def _evict(self):
+        rows = self._connection.execute(
+            'SELECT key, size FROM payloads ORDER BY last_access')
+        evicted = []
+        for key, size in rows:
+            if self._size <= self.max_size:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany('DELETE FROM payloads WHERE key = ?', evicted)
+
+    def commit(self):
+        """
+        Writes pending access times, so that the database is not locked.
+        """
+        with self._lock:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+class CachedBitcoinProxy:
+    """
+    Wraps a Bitcoin proxy and answers block and transaction requests from
+    a BlockCache where possible.
+
+    Only blocks and transactions with at least ``min_confirmations``
+    confirmations are stored, because their content (including the
+    reference to the next block) does not change anymore.
+    """
+
+    def __init__(self, bitcoin_proxy, cache, min_confirmations=6):
+        """
+        Creates a caching proxy.
+
+        :param BitcoinProxy bitcoin_proxy: proxy used on cache misses
+        :param BlockCache cache: the cache
+        :param int min_confirmations: confirmations required for caching
+        :return: caching proxy object
+        :rtype: CachedBitcoinProxy
+        """
+        self._bitcoin_proxy = bitcoin_proxy
+        self.cache = cache
+        self.min_confirmations = min_confirmations
+
+    def __getattr__(self, name):
+        return getattr(self._bitcoin_proxy, name)
+
+    def _is_final(self, data):
+        return data.get('confirmations', 0) >= self.min_confirmations
+
+    def _put_block(self, block, verbosity):
+        if self._is_final(block) and 'nextblockhash' in block:
+            self.cache.put_block(block, verbosity)
+
+    def getblock(self, block_hash, verbosity=None):
+        block = self.cache.get_block(block_hash, verbosity)
+        if block is None:
+            block = self._bitcoin_proxy.getblock(block_hash, verbosity)
+            self._put_block(block, verbosity)
+        return block
+
+    def getblocks(self, block_hashes, verbosity=None):
+        blocks = [self.cache.get_block(block_hash, verbosity) for block_hash in block_hashes]
+        missing = [block_hash for block_hash, block in zip(block_hashes, blocks)
+                   if block is None]
+        if missing:
+            fetched = iter(self._bitcoin_proxy.getblocks(missing, verbosity))
+            for index, block in enumerate(blocks):
+                if block is None:
+                    blocks[index] = next(fetched)
+                    self._put_block(blocks[index], verbosity)
+        return blocks
+
+    def getblockhash(self, height):
+        block_hash = self.cache.get_block_hash(height)
+        if block_hash is None:
+            block_hash = self._bitcoin_proxy.getblockhash(height)
+        return block_hash
+
+    def getblockhashes(self, heights):
+        block_hashes = [self.cache.get_block_hash(height) for height in heights]
+        missing = [height for height, block_hash in zip(heights, block_hashes)
+                   if block_hash is None]
+        if missing:
+            fetched = dict(zip(missing, self._bitcoin_proxy.getblockhashes(missing)))
+            block_hashes = [fetched.get(height, block_hash)
+                            for height, block_hash in zip(heights, block_hashes)]
+        return block_hashes
+
+    def getrawtransaction(self, tx_id, verbose=1):
+        if not verbose:
+            return self._bitcoin_proxy.getrawtransaction(tx_id, verbose)
+        tx = self.cache.get_transaction(tx_id)
+        if tx is None:
+            tx = self._bitcoin_proxy.getrawtransaction(tx_id, verbose)
+            if self._is_final(tx):
+                self.cache.put_transaction(tx)
+        return tx
+
+    def getrawtransactions(self, tx_ids, verbose=1):
+        if not verbose:
+            return self._bitcoin_proxy.getrawtransactions(tx_ids, verbose)
+        txs = [self.cache.get_transaction(tx_id) for tx_id in tx_ids]
+        missing = [tx_id for tx_id, tx in zip(tx_ids, txs) if tx is None]
+        if missing:
+            fetched = iter(self._bitcoin_proxy.getrawtransactions(missing, verbose))
+            for index, tx in enumerate(txs):
+                if tx is None:
+                    txs[index] = next(fetched)
+                    if self._is_final(txs[index]):
+                        self.cache.put_transaction(txs[index])
+        return txs
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache which evicts the least recently used
+    entries if the number of entries or their approximate total size
+    exceeds the given limits.
+    """
+
+    def __init__(self, max_entries=None, max_size=None, sizeof=None):
+        """
+        Creates an LRU cache.
+
+        :param int max_entries: maximum number of entries (or None)
+        :param int max_size: maximum approximate size in bytes (or None)
+        :param sizeof: function returning the approximate size of a value
+        :return: LRU cache object
+        :rtype: LRUCache
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._sizeof = sizeof or (lambda value: 1)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self._entries and (
+                    (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                    (self.max_size is not None and self.size > self.max_size)):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def statistics(self):
+        """
+        Returns hit, miss and eviction counts and the current usage.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'size': self.size}
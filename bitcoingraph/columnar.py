@@ -0,0 +1,182 @@
+"""
+columnar
+
+Export of blockchain data into typed, row-grouped Parquet files.
+
+"""
+
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from bitcoingraph.writer import OutputAddressStore, deduplication_set
+
+__author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
+__copyright__ = 'Copyright 2015, Bernhard Haslhofer'
+__license__ = "MIT"
+
+
+COIN = 100000000
+
+# column names and types of the exported tables, hashes are 32-byte binary values
+TABLES = {
+    'blocks': [('hash', 'hash'), ('height', 'int32'), ('timestamp', 'int64')],
+    'transactions': [('txid', 'hash'), ('coinbase', 'bool_')],
+    'outputs': [('txid', 'hash'), ('n', 'int32'), ('value', 'int64'), ('type', 'string')],
+    'addresses': [('address', 'string')],
+    'rel_block_tx': [('hash', 'hash'), ('txid', 'hash')],
+    'rel_tx_output': [('txid', 'hash'), ('n', 'int32')],
+    'rel_input': [('txid', 'hash'), ('output_txid', 'hash'), ('output_n', 'int32')],
+    'rel_output_address': [('txid', 'hash'), ('n', 'int32'), ('address', 'string')],
+    'input_addresses': [('txid', 'hash'), ('address', 'string')],
+}
+
+
+def to_satoshi(value):
+    """
+    Converts a BTC value to satoshis.
+
+    :param float value: value in BTC
+    :rtype: int
+    """
+    return int(round(value * COIN))
+
+
+def _arrow_type(name):
+    if name == 'hash':
+        return pyarrow.binary(32)
+    return getattr(pyarrow, name)()
+
+
+class _Table:
+    """
+    Column buffers of one table, which are written as a row group when
+    they reach row_group_size rows.
+    """
+
+    def __init__(self, path, columns, row_group_size, compression):
+        self._schema = pyarrow.schema([(name, _arrow_type(type_name))
+                                       for name, type_name in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema,
+                                                     compression=compression)
+        self._row_group_size = row_group_size
+        self._columns = [[] for _ in columns]
+
+    def append(self, *row):
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        if len(self._columns[0]) >= self._row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._columns[0]:
+            self._writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, field.type)
+                 for column, field in zip(self._columns, self._schema)],
+                schema=self._schema))
+            self._columns = [[] for _ in self._columns]
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+class ParquetDumpWriter:
+    """
+    Writer with the interface of ``CSVDumpWriter``, which writes one
+    Parquet file per table.
+
+    Hashes and transaction ids are stored as 32-byte binary values in
+    the byte order of their hex representation, values as satoshis.
+    Outputs are identified by transaction id and index instead of the
+    concatenated txid_n string.
+    """
+
+    def __init__(self, output_path, input_addresses=False, deduplicate=False,
+                 deduplication_memory=1 << 28, compression=None,
+                 row_group_size=1 << 17, deduplication_keys=None):
+        """
+        Creates a writer for Parquet files.
+
+        :param str output_path: directory of the Parquet files
+        :param bool input_addresses: also write input_addresses.parquet
+        :param bool deduplicate: write each address and transaction once
+        :param int deduplication_memory: memory used for the deduplication
+        :param str compression: Parquet codec (default snappy)
+        :param int row_group_size: rows per row group
+        :param int deduplication_keys: keys each deduplication Bloom filter is sized for
+        """
+        if pyarrow is None:
+            raise ValueError('Parquet export requires the pyarrow package')
+        self._output_path = output_path
+        self._deduplicate = deduplicate
+        self._deduplication_memory = deduplication_memory
+        self._deduplication_keys = deduplication_keys
+        self._compression = compression or 'snappy'
+        self._row_group_size = row_group_size
+
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+        self._output_addresses = OutputAddressStore(
+            os.path.join(output_path, '.output_addresses')) if input_addresses else None
+
+    def _digest_set(self, name):
+        return deduplication_set(os.path.join(self._output_path, name),
+                                 self._deduplication_memory, self._deduplication_keys)
+
+    def __enter__(self):
+        if self._deduplicate:
+            self._addresses = self._digest_set('.addresses_seen')
+            self._transactions = self._digest_set('.transactions_seen')
+        names = [name for name in TABLES
+                 if name != 'input_addresses' or self._output_addresses is not None]
+        self._tables = {name: _Table(os.path.join(self._output_path, name + '.parquet'),
+                                     TABLES[name], self._row_group_size, self._compression)
+                        for name in names}
+        return self
+
+    def __exit__(self, type, value, traceback):
+        for table in self._tables.values():
+            table.close()
+        if self._output_addresses is not None:
+            self._output_addresses.close()
+        if self._deduplicate:
+            self._addresses.close()
+            self._transactions.close()
+
+    def write(self, block):
+        tables = self._tables
+        block_hash = bytes.fromhex(block.hash)
+        tables['blocks'].append(block_hash, block.height, block.timestamp)
+        for tx in block.transactions:
+            txid = bytes.fromhex(tx.txid)
+            is_new = not self._deduplicate or self._transactions.add(tx.txid)
+            if is_new:
+                tables['transactions'].append(txid, tx.is_coinbase())
+            tables['rel_block_tx'].append(block_hash, txid)
+            if not tx.is_coinbase():
+                for input in tx.inputs:
+                    reference = input.output_reference
+                    tables['rel_input'].append(txid, bytes.fromhex(reference['txid']),
+                                               reference['vout'])
+                    if self._output_addresses is not None:
+                        address = self._output_addresses.spend(reference['txid'],
+                                                               reference['vout'])
+                        if address is not None:
+                            tables['input_addresses'].append(txid, address)
+            for output in tx.outputs:
+                if self._output_addresses is not None:
+                    self._output_addresses.add(tx.txid, output.index, output.addresses)
+                if not is_new:
+                    continue
+                tables['outputs'].append(txid, output.index, to_satoshi(output.value),
+                                         output.type)
+                tables['rel_tx_output'].append(txid, output.index)
+                for address in output.addresses:
+                    if not self._deduplicate or self._addresses.add(address):
+                        tables['addresses'].append(address)
+                    tables['rel_output_address'].append(txid, output.index, address)
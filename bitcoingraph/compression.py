@@ -0,0 +1,174 @@
+"""
+compression
+
+Compressed output and input of exported CSV files.
+
+"""
+
+import gzip
+import queue
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
+__copyright__ = 'Copyright 2015, Bernhard Haslhofer'
+__license__ = "MIT"
+
+
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# queued to finish the current gzip member or zstd frame
+_FLUSH = object()
+
+
+def _compressor(compression):
+    if compression == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError('Unknown compression: {}'.format(compression))
+
+
+def compression_of(path):
+    """
+    Returns the compression of a file according to its suffix or None.
+    """
+    for compression, suffix in SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def open_reader(path):
+    """
+    Opens a (possibly compressed) file for reading binary data.
+    """
+    compression = compression_of(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                          read_across_frames=True,
+                                                          closefd=True)
+    return open(path, 'rb')
+
+
+class CompressedWriter:
+    """
+    Text file replacement which compresses the written data on a
+    background thread.
+
+    The data is buffered and passed on in chunks through a bounded
+    queue. Appending creates a new gzip member or zstd frame, which
+    decompressors read as a continuation of the file.
+    """
+
+    def __init__(self, path, compression, mode='a', chunk_size=1 << 20, max_chunks=8):
+        """
+        Opens a compressed file.
+
+        :param str path: path of the file
+        :param str compression: 'gzip' or 'zstd'
+        :param str mode: 'a' for appending or 'w' for overwriting
+        :param int chunk_size: characters passed on per chunk
+        :param int max_chunks: chunks queued before writing blocks
+        """
+        self.name = path
+        self._compression = compression
+        self._compressor = _compressor(compression)
+        self._file = open(path, mode + 'b')
+        self._chunk_size = chunk_size
+        self._buffer = []
+        self._buffered = 0
+        self._queue = queue.Queue(max_chunks)
+        self._error = None
+        self._thread = threading.Thread(target=self._compress, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _compress(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                self._queue.task_done()
+                break
+            if self._error is None:
+                try:
+                    if data is _FLUSH:
+                        self._file.write(self._compressor.flush())
+                        self._file.flush()
+                        self._compressor = _compressor(self._compression)
+                    else:
+                        self._file.write(self._compressor.compress(data))
+                except Exception as exc:
+                    # keep draining the queue, so that writers do not block
+                    self._error = exc
+            self._queue.task_done()
+        if self._error is None:
+            try:
+                self._file.write(self._compressor.flush())
+            except Exception as exc:
+                self._error = exc
+
+    def _pass_on(self):
+        if self._error is not None:
+            raise self._error
+        if self._buffer:
+            self._queue.put(''.join(self._buffer).encode())
+            self._buffer = []
+            self._buffered = 0
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self._chunk_size:
+            self._pass_on()
+        return len(text)
+
+    def write_bytes(self, data):
+        """
+        Writes encoded data, bypassing the text buffer.
+        """
+        self._pass_on()
+        self._queue.put(bytes(data))
+
+    def flush(self):
+        """
+        Finishes the current gzip member or zstd frame and waits until
+        all data is written to the file. The file then ends at a member
+        or frame boundary, where it may be truncated and appended to.
+        """
+        self._pass_on()
+        self._queue.put(_FLUSH)
+        self._queue.join()
+        if self._error is not None:
+            raise self._error
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self._pass_on()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self._file.close()
+        if self._error is not None:
+            raise self._error
@@ -1,111 +1,648 @@
+from array import array
 import bisect
 import csv
+import hashlib
+import json
+import mmap
+from multiprocessing import Pool
 import os
 
 
-class Address:
+def _map_file(path, size, keep=False):
+    """
+    Creates a file of the given size (or resizes it, if keep is set)
+    and returns a writable memory map of it (or an empty buffer, since
+    empty files cannot be mapped).
+    """
+    with open(path, 'r+b' if keep and os.path.exists(path) else 'w+b') as f:
+        f.truncate(size)
+        if size == 0:
+            return bytearray()
+        return mmap.mmap(f.fileno(), size)
 
-    counter = 0
 
-    def __init__(self, address, assign_number=False):
-        self.address = address
-        self.representative = None
-        self.height = 0
-        if assign_number:
-            self.number = Address.counter
-            Address.counter += 1
+class AddressTable:
+    """
+    Sorted addresses stored as fixed-width, zero-padded byte strings
+    in a single buffer. The index of an address is its number.
+    """
 
-    def get_representative(self):
-        r = self
-        while r.representative is not None:
-            r = r.representative
-        return r
+    def __init__(self, data, width):
+        self.data = data
+        self.width = width
 
-    def set_representative(self, address):
-        self.representative = address
-        if self.height >= address.height:
-            address.height = self.height + 1
+    @classmethod
+    def from_file(cls, path, table_path=None):
+        """
+        Reads a file with one address per line (in the first column),
+        sorted in byte order.
 
-    def __lt__(self, other):
-        return self.address < other.address
+        If a table path is given, the table is stored in a memory-mapped
+        file at that path instead of main memory.
+        """
+        count = 0
+        width = 1
+        with open(path, 'rb') as address_file:
+            for line in address_file:
+                count += 1
+                width = max(width, len(line.strip().partition(b',')[0]))
+        if table_path is None:
+            data = bytearray(count * width)
+        else:
+            data = _map_file(table_path, count * width)
+        with open(path, 'rb') as address_file:
+            offset = 0
+            for line in address_file:
+                line = line.strip().partition(b',')[0]
+                data[offset:offset + len(line)] = line
+                offset += width
+        return cls(data, width)
 
-    def __eq__(self, other):
-        return self.address == other.address
+    @classmethod
+    def open(cls, path, width):
+        """
+        Opens a table stored with ``from_file`` read-only.
+        """
+        with open(path, 'rb') as f:
+            if os.path.getsize(path) == 0:
+                return cls(bytearray(), width)
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), width)
 
-    def __hash__(self):
-        return hash(self.address)
+    def __len__(self):
+        return len(self.data) // self.width
+
+    def __getitem__(self, index):
+        offset = index * self.width
+        return self.data[offset:offset + self.width]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def address(self, index):
+        return bytes(self[index]).rstrip(b'\0').decode()
+
+    def index(self, address_string):
+        key = address_string.encode().ljust(self.width, b'\0')
+        index = bisect.bisect_left(self, key)
+        if index == len(self) or self[index] != key:
+            raise KeyError(address_string)
+        return index
+
+
+class AddressIndex:
+    """
+    Consecutive numbering of the addresses in several address tables,
+    which are searched one after the other.
+    """
+
+    def __init__(self, tables):
+        self.tables = []
+        self.offsets = []
+        self._size = 0
+        for table in tables:
+            self.append(table)
+
+    def append(self, table):
+        self.tables.append(table)
+        self.offsets.append(self._size)
+        self._size += len(table)
+
+    def close(self):
+        for table in self.tables:
+            table.close()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, address_string):
+        try:
+            self.index(address_string)
+            return True
+        except KeyError:
+            return False
+
+    def address(self, index):
+        segment = bisect.bisect_right(self.offsets, index) - 1
+        return self.tables[segment].address(index - self.offsets[segment])
+
+    def index(self, address_string):
+        for offset, table in zip(self.offsets, self.tables):
+            try:
+                return offset + table.index(address_string)
+            except KeyError:
+                pass
+        raise KeyError(address_string)
+
+
+class UnionFind:
+    """
+    Disjoint sets over the numbers 0 to size - 1, with union by rank
+    and path compression.
+
+    Each set is identified by its smallest number, which is tracked at
+    the roots. Unlike the roots themselves, these identifiers do not
+    depend on the order in which sets are merged.
+
+    If a path is given, the parent and rank arrays are stored in
+    memory-mapped files with that path prefix instead of main memory.
+    With resume, existing files are extended to the new size, keeping
+    the sets of the numbers they already contain.
+    """
+
+    def __init__(self, size, path=None, resume=False):
+        typecode = 'I' if size <= 0xffffffff else 'Q'
+        self._maps = []
+        if path is None:
+            self.parent = array(typecode, range(size))
+            self.minimum = array(typecode, range(size))
+            self.rank = array('B', bytes(size))
+            return
+        initialized = 0
+        if resume and os.path.exists(path + '.rank'):
+            initialized = os.path.getsize(path + '.rank')
+            if initialized:
+                itemsize = os.path.getsize(path + '.parent') // initialized
+                typecode = {4: 'I', 8: 'Q'}[itemsize]
+            if size > 0xffffffff and typecode == 'I':
+                raise ValueError('union-find state cannot grow beyond 2^32 numbers')
+        self.parent = self._map_array(path + '.parent', typecode, size, resume)
+        self.minimum = self._map_array(path + '.minimum', typecode, size, resume)
+        for start in range(initialized, size, 1 << 20):
+            end = min(start + (1 << 20), size)
+            self.parent[start:end] = self.minimum[start:end] = array(typecode, range(start, end))
+        self.rank = self._map_array(path + '.rank', 'B', size, resume)
+
+    def _map_array(self, path, typecode, size, keep=False):
+        data = _map_file(path, size * array(typecode).itemsize, keep)
+        self._maps.append(data)
+        return memoryview(data).cast(typecode)
+
+    def close(self):
+        if self._maps:
+            self.parent.release()
+            self.minimum.release()
+            self.rank.release()
+            for data in self._maps:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+            self._maps = []
+
+    def find(self, i):
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def entity(self, i):
+        """
+        Returns the identifier (smallest number) of the set containing i.
+        """
+        return self.minimum[self.find(i)]
+
+    def group(self, indices):
+        """
+        Merges the sets of all given numbers. The root with the highest
+        rank (and the lowest number among those) becomes the root of the
+        merged set.
+
+        :return: the identifiers of the sets merged into another set
+        :rtype: set
+        """
+        roots = {self.find(i) for i in indices}
+        if len(roots) < 2:
+            return set()
+        rank = self.rank
+        minimum = self.minimum
+        root = min(roots, key=lambda r: (-rank[r], r))
+        minima = {minimum[r] for r in roots}
+        roots.remove(root)
+        increment = False
+        for other in roots:
+            self.parent[other] = root
+            increment = increment or rank[other] == rank[root]
+        if increment:
+            rank[root] += 1
+        minimum[root] = min(minima)
+        minima.remove(minimum[root])
+        return minima
 
 
 class AddressList:
 
-    def __init__(self):
-        self.addresses = []
+    def __init__(self, address_table, union_find_path=None):
+        self.address_table = address_table
+        self.union_find = UnionFind(len(address_table), union_find_path)
 
-    def add(self, address_string):
-        self.addresses.append(Address(address_string, True))
+    def close(self):
+        self.union_find.close()
+        self.address_table.close()
 
     def group(self, address_strings):
         if len(address_strings) >= 2:
-            addresses = list(map(self.search, address_strings))
-            representatives = {address.get_representative() for address in addresses}
-            highest_representative = None
-            for representative in representatives:
-                if (highest_representative is None or
-                        representative.height > highest_representative.height):
-                    highest_representative = representative
-            representatives.remove(highest_representative)
-            for representative in representatives:
-                representative.set_representative(highest_representative)
-
-    def search(self, address_string):
-        index = bisect.bisect_left(self.addresses, Address(address_string))
-        return self.addresses[index]
+            self.union_find.group(map(self.address_table.index, address_strings))
 
     def export(self, path):
+        entity = self.union_find.entity
         with open(os.path.join(path, 'entities.csv'), 'w') as entity_csv_file, \
                 open(os.path.join(path, 'rel_address_entity.csv'), 'w') as entity_rel_csv_file:
             entity_writer = csv.writer(entity_csv_file)
             entity_rel_writer = csv.writer(entity_rel_csv_file)
             entity_writer.writerow(['id:ID(Entity)'])
             entity_rel_writer.writerow([':START_ID(Address)', ':END_ID(Entity)'])
-            for address in self.addresses:
-                representative = address.get_representative()
-                if address == representative:
-                    entity_writer.writerow([representative.number])
-                entity_rel_writer.writerow([address.address, representative.number])
+            for index in range(len(self.address_table)):
+                representative = entity(index)
+                if index == representative:
+                    entity_writer.writerow([representative])
+                entity_rel_writer.writerow([self.address_table.address(index), representative])
 
     def print(self):
-        for address in self.addresses:
-            print(address.address, address.get_representative().address)
+        entity = self.union_find.entity
+        for index in range(len(self.address_table)):
+            print(self.address_table.address(index), self.address_table.address(entity(index)))
+
+
+def _read_lines(input_file, chunk_size):
+    while True:
+        lines = input_file.readlines(chunk_size)
+        if not lines:
+            break
+        yield from lines
+
+
+def _chunk_boundaries(path, count):
+    """
+    Splits a file of rows grouped by their first column into at most
+    count byte ranges, such that no group is split.
+    """
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for number in range(1, count):
+            offset = max(size * number // count, boundaries[-1])
+            if offset >= size:
+                break
+            f.seek(offset)
+            if offset > 0:
+                f.readline()
+            key = f.readline().partition(b',')[0]
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line or line.partition(b',')[0] != key:
+                    break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _cluster_chunk(task):
+    """
+    Clusters the input addresses in a byte range of input_addresses.csv
+    with a local union-find and returns the forest as pairs of address
+    and root numbers.
+    """
+    input_file_path, start, end, table_path, width = task
+    table = AddressTable.open(table_path, width)
+    parent = {}
+
+    def find(i):
+        root = i
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(i, i) != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def group(input_addresses):
+        if len(input_addresses) >= 2:
+            roots = {find(table.index(address)) for address in input_addresses}
+            root = min(roots)
+            for other in roots:
+                if other != root:
+                    parent[other] = root
+
+    try:
+        with open(input_file_path, 'rb') as input_file:
+            input_file.seek(start)
+            input_addresses = set()
+            transaction = None
+            while input_file.tell() < end:
+                entries = input_file.readline().decode().strip().split(',')
+                if transaction != entries[0]:
+                    group(input_addresses)
+                    input_addresses = set()
+                    transaction = entries[0]
+                input_addresses.add(entries[1])
+            group(input_addresses)
+    finally:
+        table.close()
+    forest = array('Q')
+    for i in parent:
+        root = find(i)
+        if root != i:
+            forest.append(i)
+            forest.append(root)
+    return forest.tobytes()
 
 
-def compute_entities(input_path):
-    address_list = AddressList()
+def _group_in_parallel(address_list, input_file_path, table_path, workers):
+    tasks = [(input_file_path, start, end, table_path, address_list.address_table.width)
+             for start, end in _chunk_boundaries(input_file_path, workers * 4)]
+    union_find = address_list.union_find
+    with Pool(workers) as pool:
+        for number, data in enumerate(pool.imap_unordered(_cluster_chunk, tasks), 1):
+            forest = array('Q')
+            forest.frombytes(data)
+            for position in range(0, len(forest), 2):
+                union_find.group(forest[position:position + 2])
+            print('processed chunks: {} of {}'.format(number, len(tasks)))
+
+
+def compute_entities(input_path, memory_limit=None, state_path=None, workers=None):
+    """
+    Groups the addresses in addresses.csv which are used as inputs of
+    the same transaction in input_addresses.csv and writes the entities
+    to entities.csv and rel_address_entity.csv.
+
+    If a memory limit (in bytes) is given, the address table and the
+    union-find arrays are kept in memory-mapped files in the input path,
+    which are removed afterwards, and the inputs are read in chunks of a
+    fraction of that limit. The operating system then pages the arrays
+    in and out as needed.
+
+    If a state path is given, the address table and the union-find arrays
+    are kept there as memory-mapped files, so that the entities can later
+    be updated with ``update_entities``.
+
+    With several workers, input_addresses.csv is split into chunks which
+    do not split transactions. The chunks are clustered by worker
+    processes and the resulting partial forests are merged into the
+    union-find arrays. Since entities are identified by their smallest
+    address number, the output is the same as for a serial run.
+
+    :param str input_path: path of the exported CSV files
+    :param int memory_limit: approximate memory limit in bytes
+    :param str state_path: directory for the entity state
+    :param int workers: number of worker processes
+    """
+    parallel = workers is not None and workers > 1
+    scratch_files = []
+    table_path = union_find_path = None
+    chunk_size = 1 << 24 if memory_limit is None else max(memory_limit // 4, 1 << 16)
+    scratch_prefix = os.path.join(input_path, 'entities')
+    if state_path is not None:
+        if not os.path.exists(state_path):
+            os.makedirs(state_path)
+        table_path = os.path.join(state_path, 'addresses.0')
+        union_find_path = os.path.join(state_path, 'union_find')
+    else:
+        if memory_limit is not None or parallel:
+            # worker processes map the address table from a file
+            table_path = scratch_prefix + '.addresses'
+            scratch_files.append(table_path)
+        if memory_limit is not None:
+            union_find_path = scratch_prefix
+            scratch_files += [scratch_prefix + extension
+                              for extension in ['.parent', '.minimum', '.rank']]
     print('reading addresses')
-    with open(os.path.join(input_path, 'addresses.csv'), 'r') as address_file:
-        for line in address_file:
-            line = line.strip()
-            address_list.add(line)
-    print('reading inputs')
-    input_counter = 0
-    with open(os.path.join(input_path, 'input_addresses.csv'), 'r') as input_file:
-        input_addresses = set()
-        transaction = None
-        for line in input_file:
-            entries = line.strip().split(',')
-            address = entries[1]
-            if transaction is None or transaction == entries[0]:
-                input_addresses.add(address)
-            else:
+    address_list = AddressList(
+        AddressTable.from_file(os.path.join(input_path, 'addresses.csv'), table_path),
+        union_find_path)
+    try:
+        print('reading inputs')
+        input_file_path = os.path.join(input_path, 'input_addresses.csv')
+        if parallel:
+            _group_in_parallel(address_list, input_file_path, table_path, workers)
+        else:
+            input_counter = 0
+            with open(input_file_path, 'r') as input_file:
+                input_addresses = set()
+                transaction = None
+                for line in _read_lines(input_file, chunk_size):
+                    entries = line.strip().split(',')
+                    address = entries[1]
+                    if transaction is None or transaction == entries[0]:
+                        input_addresses.add(address)
+                    else:
+                        address_list.group(input_addresses)
+                        input_addresses = {address}
+                    transaction = entries[0]
+                    input_counter += 1
+                    if input_counter % (1000 * 1000) == 0:
+                        print('processed inputs:', input_counter)
                 address_list.group(input_addresses)
-                input_addresses = {address}
-            transaction = entries[0]
-            input_counter += 1
-            if input_counter % (1000 * 1000) == 0:
-                print('processed inputs:', input_counter)
-        address_list.group(input_addresses)
-    print('write to file')
-    address_list.export(input_path)
+        print('write to file')
+        address_list.export(input_path)
+        if state_path is not None:
+            table = address_list.address_table
+            _write_state_manifest(state_path, {
+                'segments': [{'count': len(table), 'width': table.width}],
+                'exports': [os.path.abspath(input_path)]})
+    finally:
+        address_list.close()
+        for scratch_file in scratch_files:
+            os.remove(scratch_file)
+
+
+_STATE_MANIFEST = 'state.json'
+
+
+def _write_state_manifest(state_path, manifest):
+    path = os.path.join(state_path, _STATE_MANIFEST)
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class SortedCSVFile:
+    """
+    Binary search on a CSV file whose lines are sorted in byte order,
+    such as a deduplicated rel_output_address.csv.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        self._file.close()
+
+    def _line_from(self, offset):
+        """
+        Returns the first line starting at or after the given offset.
+        """
+        if offset == 0:
+            self._file.seek(0)
+        else:
+            self._file.seek(offset - 1)
+            self._file.readline()
+        return self._file.readline()
+
+    def find(self, key):
+        """
+        Returns the remainders of all lines whose first column is key.
+
+        :param str key: value of the first column
+        :rtype: list
+        """
+        prefix = key.encode() + b','
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            line = self._line_from(middle)
+            if line and line < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        values = []
+        line = self._line_from(low)
+        while line.startswith(prefix):
+            values.append(line[len(prefix):].rstrip(b'\r\n').decode())
+            line = self._file.readline()
+        return values
+
+
+def is_sorted(path):
+    """
+    Checks whether the lines of a file are sorted in byte order.
+
+    :param str path: path of the file
+    :rtype: bool
+    """
+    with open(path, 'rb') as f:
+        previous = b''
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if line < previous:
+                return False
+            previous = line
+    return True
+
+
+def _input_address_groups(input_file, output_address_files):
+    """
+    Generates the sets of input addresses of the transactions in
+    rel_input.csv, whose rows are grouped by transaction. Inputs spending
+    outputs with no or several addresses are skipped.
+    """
+    transaction = None
+    input_addresses = set()
+    for line in input_file:
+        line = line.strip()
+        if not line:
+            continue
+        txid, output_ref = line.split(',')
+        if txid != transaction:
+            if input_addresses:
+                yield input_addresses
+            transaction = txid
+            input_addresses = set()
+        for output_address_file in output_address_files:
+            addresses = output_address_file.find(output_ref)
+            if addresses:
+                if len(addresses) == 1:
+                    input_addresses.add(addresses[0])
+                break
+    if input_addresses:
+        yield input_addresses
+
+
+def update_entities(state_path, input_path):
+    """
+    Updates the entity state created by ``compute_entities`` with an
+    export of further blocks and writes only the changes to the input
+    path:
+
+    * entities.csv: new entities
+    * rel_address_entity.csv: entities of the new addresses
+    * entity_merges.csv: existing entities merged into other entities
+
+    The files addresses.csv, rel_input.csv and rel_output_address.csv of
+    the new export are read. Spent outputs are looked up by binary search
+    in the (sorted) rel_output_address.csv files of all exports applied
+    so far, so that the cost depends on the size of the new export only.
+    The state is modified in place.
+
+    :param str state_path: directory of the entity state
+    :param str input_path: path of the new export
+    :raises ValueError: if rel_output_address.csv of the new export is not sorted
+    """
+    if not is_sorted(os.path.join(input_path, 'rel_output_address.csv')):
+        raise ValueError('rel_output_address.csv of {} is not sorted'.format(input_path))
+    with open(os.path.join(state_path, _STATE_MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+    segments = manifest['segments']
+    address_index = AddressIndex(
+        AddressTable.open(os.path.join(state_path, 'addresses.{}'.format(number)),
+                          segment['width'])
+        for number, segment in enumerate(segments))
+    old_size = len(address_index)
+    exports = manifest['exports'] + [os.path.abspath(input_path)]
+    output_address_files = []
+    union_find = None
+    try:
+        print('reading addresses')
+        new_addresses_path = os.path.join(state_path, 'addresses.new.csv')
+        with open(os.path.join(input_path, 'addresses.csv')) as address_file, \
+                open(new_addresses_path, 'w') as new_address_file:
+            for line in address_file:
+                address = line.strip().partition(',')[0]
+                if address and address not in address_index:
+                    new_address_file.write(address + '\n')
+        table = AddressTable.from_file(
+            new_addresses_path, os.path.join(state_path, 'addresses.{}'.format(len(segments))))
+        os.remove(new_addresses_path)
+        address_index.append(table)
+        union_find = UnionFind(len(address_index), os.path.join(state_path, 'union_find'),
+                               resume=True)
+
+        print('reading inputs')
+        output_address_files = [SortedCSVFile(os.path.join(path, 'rel_output_address.csv'))
+                                for path in reversed(exports)]
+        merged = set()
+        with open(os.path.join(input_path, 'rel_input.csv')) as input_file:
+            for input_addresses in _input_address_groups(input_file, output_address_files):
+                if len(input_addresses) >= 2:
+                    merged_entities = union_find.group(map(address_index.index, input_addresses))
+                    merged.update(entity for entity in merged_entities if entity < old_size)
+
+        print('write to file')
+        _export_entity_changes(input_path, address_index, union_find, old_size, merged)
+        segments.append({'count': len(table), 'width': table.width})
+        manifest['exports'] = exports
+        _write_state_manifest(state_path, manifest)
+    finally:
+        for output_address_file in output_address_files:
+            output_address_file.close()
+        if union_find is not None:
+            union_find.close()
+        address_index.close()
+
+
+def _export_entity_changes(path, address_index, union_find, old_size, merged):
+    entity = union_find.entity
+    with open(os.path.join(path, 'entities.csv'), 'w') as entity_csv_file, \
+            open(os.path.join(path, 'rel_address_entity.csv'), 'w') as entity_rel_csv_file, \
+            open(os.path.join(path, 'entity_merges.csv'), 'w') as merge_csv_file:
+        entity_writer = csv.writer(entity_csv_file)
+        entity_rel_writer = csv.writer(entity_rel_csv_file)
+        merge_writer = csv.writer(merge_csv_file)
+        entity_writer.writerow(['id:ID(Entity)'])
+        entity_rel_writer.writerow([':START_ID(Address)', ':END_ID(Entity)'])
+        merge_writer.writerow(['entity', 'merged_into'])
+        for index in range(old_size, len(address_index)):
+            representative = entity(index)
+            if index == representative:
+                entity_writer.writerow([representative])
+            entity_rel_writer.writerow([address_index.address(index), representative])
+        for merged_entity in sorted(merged):
+            merge_writer.writerow([merged_entity, entity(merged_entity)])
 
 
 def open_csv(input_path, base_name, mode):
@@ -149,3 +686,151 @@ def calculate_input_addresses(input_path):
 
             if match_address is not None:
                 input_address_writer.writerow([txid, match_address])
+
+
+def _output_digest(output_ref):
+    return int.from_bytes(hashlib.blake2b(output_ref, digest_size=8).digest(), 'little')
+
+
+class OutputAddressIndex:
+    """
+    On-disk hash table from output references (txid_n) to their rows in
+    rel_output_address.csv, which need not be sorted.
+
+    The table is stored in a memory-mapped file and uses open addressing
+    with linear probing. Each slot holds an 8-byte digest of the output
+    reference and the offset of the row (plus one, so that zero marks an
+    empty slot). Digest matches are verified by reading the row. Outputs
+    with more than one address are marked as ambiguous.
+    """
+
+    _AMBIGUOUS = 1 << 63
+
+    def __init__(self, csv_path, index_path):
+        """
+        Builds the index in one pass over the CSV file.
+
+        :param str csv_path: path of rel_output_address.csv
+        :param str index_path: path of the index file
+        """
+        self._index_path = index_path
+        self._csv_file = open(csv_path, 'rb')
+        csv_size = os.fstat(self._csv_file.fileno()).st_size
+        self._rows = bytearray() if csv_size == 0 else mmap.mmap(
+            self._csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = None
+        self._slots = None
+        self._count = 0
+        capacity = 1024
+        while capacity < csv_size // 32:
+            capacity *= 2
+        self._map(capacity)
+        offset = 0
+        for line in self._csv_file:
+            output_ref, _, address = line.rstrip(b'\r\n').partition(b',')
+            if output_ref:
+                self._insert(output_ref, address, offset)
+            offset += len(line)
+
+    def _map(self, capacity):
+        self._release()
+        self._data = _map_file(self._index_path, capacity * 16)
+        self._slots = memoryview(self._data).cast('Q')
+        self._mask = capacity - 1
+
+    def _release(self):
+        if self._slots is not None:
+            self._slots.release()
+            self._data.close()
+
+    def close(self):
+        self._release()
+        self._slots = None
+        if isinstance(self._rows, mmap.mmap):
+            self._rows.close()
+        self._csv_file.close()
+
+    def _row(self, value):
+        offset = (value & ~self._AMBIGUOUS) - 1
+        end = self._rows.find(b'\n', offset)
+        row = self._rows[offset:] if end < 0 else self._rows[offset:end]
+        output_ref, _, address = row.rstrip(b'\r').partition(b',')
+        return output_ref, address
+
+    def _insert(self, output_ref, address, offset):
+        slots = self._slots
+        digest = _output_digest(output_ref)
+        slot = digest & self._mask
+        while slots[2 * slot + 1]:
+            if slots[2 * slot] == digest:
+                other_output_ref, other_address = self._row(slots[2 * slot + 1])
+                if other_output_ref == output_ref:
+                    if other_address != address:
+                        slots[2 * slot + 1] |= self._AMBIGUOUS
+                    return
+            slot = (slot + 1) & self._mask
+        slots[2 * slot] = digest
+        slots[2 * slot + 1] = offset + 1
+        self._count += 1
+        if self._count * 10 > (self._mask + 1) * 7:
+            self._grow()
+
+    def _grow(self):
+        entries = [(self._slots[2 * slot], self._slots[2 * slot + 1])
+                   for slot in range(self._mask + 1) if self._slots[2 * slot + 1]]
+        self._map((self._mask + 1) * 2)
+        slots = self._slots
+        for digest, value in entries:
+            slot = digest & self._mask
+            while slots[2 * slot + 1]:
+                slot = (slot + 1) & self._mask
+            slots[2 * slot] = digest
+            slots[2 * slot + 1] = value
+
+    def get(self, output_ref):
+        """
+        Returns the address of an output or None if the output is not
+        known or has several addresses.
+
+        :param str output_ref: output reference (txid_n)
+        :rtype: str
+        """
+        output_ref = output_ref.encode()
+        slots = self._slots
+        digest = _output_digest(output_ref)
+        slot = digest & self._mask
+        while slots[2 * slot + 1]:
+            value = slots[2 * slot + 1]
+            if slots[2 * slot] == digest:
+                other_output_ref, address = self._row(value)
+                if other_output_ref == output_ref:
+                    return None if value & self._AMBIGUOUS else address.decode()
+            slot = (slot + 1) & self._mask
+        return None
+
+
+def resolve_input_addresses(input_path):
+    """
+    Writes the addresses of the spent outputs of rel_input.csv to
+    input_addresses.csv like ``calculate_input_addresses``, but with an
+    on-disk hash index of rel_output_address.csv instead of a merge join.
+    Neither file needs to be sorted, and the rows of input_addresses.csv
+    keep the order of rel_input.csv, which is grouped by transaction.
+
+    :param str input_path: path of the exported CSV files
+    """
+    print('indexing output addresses')
+    index_path = os.path.join(input_path, 'rel_output_address.index')
+    index = OutputAddressIndex(os.path.join(input_path, 'rel_output_address.csv'), index_path)
+    try:
+        print('calculating input addresses')
+        with open_csv(input_path, 'rel_input', 'r') as input_file, \
+                open_csv(input_path, 'input_addresses', 'w') as input_addresses_file:
+            input_address_writer = csv.writer(input_addresses_file)
+            for txid, output_ref in csv.reader(input_file):
+                address = index.get(output_ref)
+                if address is not None:
+                    input_address_writer.writerow([txid, address])
+    finally:
+        index.close()
+        os.remove(index_path)
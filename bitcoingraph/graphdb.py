@@ -1,4 +1,10 @@
 
+import base64
+import binascii
+import csv
+import itertools
+import os
+
 from bitcoingraph.neo4j import Neo4jController
 from bitcoingraph.helper import to_time, to_json
 
@@ -7,6 +13,56 @@ def round_value(bitcoin_value):
     return round(bitcoin_value, 8)
 
 
+# conversion of the rows of exported CSV files into typed values
+_BULK_CONVERSIONS = [
+    ('transactions', lambda row: [row[0], row[1] == 'True']),
+    ('outputs', lambda row: [row[0], int(row[1]), float(row[2]), row[3]]),
+    ('addresses', lambda row: row),
+    ('rel_tx_output', lambda row: row),
+    ('rel_input', lambda row: row),
+    ('rel_output_address', lambda row: row)]
+
+
+def encode_cursor(timestamp, txid):
+    """
+    Returns an opaque cursor for the transactions of an address after
+    the given transaction.
+    """
+    return base64.urlsafe_b64encode('{}:{}'.format(timestamp, txid).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns the timestamp and txid of a cursor created by encode_cursor.
+    """
+    try:
+        timestamp, txid = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return int(timestamp), txid
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('invalid cursor: {}'.format(cursor))
+
+
+def _read_rows(path, name):
+    with open(os.path.join(path, name + '.csv')) as f:
+        yield from csv.reader(f)
+
+
+def _batches(rows, batch_size, weight=None):
+    """Group rows into lists with a total weight (by default the number
+    of rows) of about batch_size."""
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        total += 1 if weight is None else weight(row)
+        if total >= batch_size:
+            yield batch
+            batch = []
+            total = 0
+    if batch:
+        yield batch
+
+
 class GraphController:
 
     rows_per_page_default = 20
@@ -16,14 +72,23 @@ class GraphController:
 
     def get_address_info(self, address, date_from=None, date_to=None,
                          rows_per_page=rows_per_page_default):
-        result = self.graph_db.address_stats_query(address).single_row()
+        statements = [self.graph_db.address_stats_statement(address),
+                      self.graph_db.entity_statement(address)]
+        if date_from is not None or date_to is not None:
+            statements.append(self.graph_db.address_count_statement(address, date_from, date_to))
+        results = self.graph_db.query_batch(statements)
+        result = results[0].single_row()
+        if result is None or result['num_transactions'] is None:
+            # addresses created before the aggregates were maintained
+            result = self.graph_db.query(
+                *self.graph_db.address_stats_scan_statement(address)).single_row()
         if result['num_transactions'] == 0:
             return {'transactions': 0}
         if date_from is None and date_to is None:
             count = result['num_transactions']
         else:
-            count = self.graph_db.address_count_query(address, date_from, date_to).single_result()
-        entity = self.graph_db.entity_query(address).single_result()
+            count = results[2].single_result()
+        entity = results[1].single_result()
         return {'transactions': result['num_transactions'],
                 'first': to_time(result['first'], True),
                 'last': to_time(result['last'], True),
@@ -37,13 +102,35 @@ class GraphController:
         return self.graph_db.get_unspent_bitcoins(address)
 
     def get_address(self, address, page, date_from=None, date_to=None,
-                    rows_per_page=rows_per_page_default):
+                    rows_per_page=rows_per_page_default, cursor=None):
+        """
+        Returns an address with a page of its transactions.
+
+        Pages are selected by a cursor, which is returned as next_cursor
+        of the previous page (None on the last page), or else by their
+        number. With a cursor (and on the first page), every page costs
+        about the same, whereas numbered pages skip all previous rows.
+        """
         if rows_per_page is None:
-            query = self.graph_db.address_query(address, date_from, date_to)
+            statement = (self.graph_db.address_statement,
+                         self.graph_db.as_address_query_parameter(address, date_from, date_to))
+        elif cursor is not None or page == 0:
+            if cursor is not None:
+                cursor = decode_cursor(cursor)
+            # one more row tells whether there is a next page
+            statement = self.graph_db.keyset_address_statement(
+                address, date_from, date_to, rows_per_page + 1, cursor)
         else:
-            query = self.graph_db.paginated_address_query(address, date_from, date_to,
-                                                          page * rows_per_page, rows_per_page)
-        return Address(address, self.get_identities(address), query.get())
+            statement = self.graph_db.paginated_address_statement(
+                address, date_from, date_to, page * rows_per_page, rows_per_page + 1)
+        query, identities = self.graph_db.query_batch(
+            [statement, self.graph_db.identity_statement(address)])
+        outputs = query.get()
+        next_cursor = None
+        if rows_per_page is not None and len(outputs) > rows_per_page:
+            outputs = outputs[:rows_per_page]
+            next_cursor = encode_cursor(outputs[-1]['timestamp'], outputs[-1]['txid'])
+        return Address(address, identities.single_result(), outputs, next_cursor)
 
     def incoming_addresses(self, address, date_from, date_to):
         return self.graph_db.incoming_addresses(address, date_from, date_to)
@@ -64,9 +151,11 @@ class GraphController:
         return identities
 
     def get_entity(self, id, max_addresses=rows_per_page_default):
-        count = self.graph_db.get_number_of_addresses_for_entity(id)
-        result = self.graph_db.entity_address_query(id, max_addresses)
-        entity = {'id': id, 'addresses': result.get(), 'number_of_addresses': count}
+        count, result = self.graph_db.query_batch([
+            self.graph_db.number_of_addresses_for_entity_statement(id),
+            self.graph_db.entity_address_statement(id, max_addresses)])
+        entity = {'id': id, 'addresses': result.get(),
+                  'number_of_addresses': count.single_result()}
         return entity
 
     def search_address_by_identity_name(self, name):
@@ -86,29 +175,66 @@ class GraphController:
         return self.graph_db.get_max_block_height()
 
     def add_block(self, block):
-        print('add block', block.height)
-        with self.graph_db.transaction() as db_transaction:
-            block_node_id = db_transaction.add_block(block)
-            for index, tx in enumerate(block.transactions):
-                print('add transaction {} of {} (txid: {})'.format(
-                    index + 1, len(block.transactions), tx.txid))
-                tx_node_id = db_transaction.add_transaction(block_node_id, tx)
-                if not tx.is_coinbase():
-                    for input in tx.inputs:
-                        db_transaction.add_input(tx_node_id, input.output_reference)
-                for output in tx.outputs:
-                    output_node_id = db_transaction.add_output(tx_node_id, output)
-                    for address in output.addresses:
-                        db_transaction.add_address(output_node_id, address)
-        print('create entities for block (node id: {})'.format(block_node_id))
-        self.graph_db.create_entities(block_node_id)
+        self.commit_block(self.prepare_block(block))
+        self.create_entities([tx.txid for tx in block.transactions])
+
+    def prepare_block(self, block):
+        """
+        Converts a block into the parameters for commit_block.
+        """
+        return self.graph_db.block_ingest_parameters(block)
+
+    def commit_block(self, parameters):
+        """
+        Adds a prepared block and returns the id of its node.
+        """
+        return self.graph_db.commit_block(parameters)
+
+    def create_entities(self, txids):
+        """
+        Clusters the input addresses of committed transactions into
+        entities, in the given order.
+
+        :param list txids: transaction ids
+        """
+        self.graph_db.create_entities(txids)
+
+    def load_export(self, path, batch_size=10000):
+        """
+        Loads CSV files exported by ``CSVDumpWriter`` (with string ids
+        and without compression) in batches of rows and creates the
+        entities of the loaded blocks.
+
+        The blocks are loaded last, together with their transactions,
+        and the entities are created after each batch of blocks, so
+        that the maximum block height in the database only covers
+        completely loaded blocks. The entities of a batch are created
+        by a single request with a statement per transaction.
+
+        :param str path: export directory
+        :param int batch_size: rows per request
+        """
+        self.graph_db.create_indexes()
+        for name, convert in _BULK_CONVERSIONS:
+            for rows in _batches(map(convert, _read_rows(path, name)), batch_size):
+                self.graph_db.bulk_load(name, rows)
+        transactions = itertools.groupby(_read_rows(path, 'rel_block_tx'),
+                                         key=lambda row: row[0])
+        blocks = ([block_hash, int(height), int(timestamp), [row[1] for row in rows]]
+                  for (block_hash, height, timestamp), (_, rows)
+                  in zip(_read_rows(path, 'blocks'), transactions))
+        for rows in _batches(blocks, batch_size, lambda block: len(block[3])):
+            print('load blocks', rows[0][1], 'to', rows[-1][1])
+            self.graph_db.bulk_load('blocks', rows)
+            self.create_entities([txid for row in rows for txid in row[3]])
 
 
 class Address:
 
-    def __init__(self, address, identities, outputs):
+    def __init__(self, address, identities, outputs, next_cursor=None):
         self.address = address
         self.identities = identities
+        self.next_cursor = next_cursor
         self.outputs = [{'txid': o['txid'], 'value': round_value(o['value']),
                          'timestamp': to_time(o['timestamp'])}
                         for o in outputs]
@@ -2,8 +2,12 @@
 import datetime
 import json
 import os
+import shutil
 import subprocess
 import sys
+import threading
+
+from bitcoingraph.compression import CompressedWriter, compression_of, open_reader
 
 
 def to_time(numeric_string, as_date=False):
@@ -30,11 +34,56 @@ def to_json(raw_data):
                       indent=4, separators=(',', ': '))
 
 
-def sort(path, filename, args=''):
+def sort(path, filename, args='', buffer_size='50%'):
+    """
+    Sorts a file with the sort command. The sorted file replaces the
+    original only when it is complete, so an interrupted sort leaves
+    the original file intact.
+    """
+    if compression_of(filename) is not None:
+        _sort_compressed(path, filename, args, buffer_size)
+        return
     if sys.platform == 'darwin':
-        s = 'LC_ALL=C gsort -S 50% --parallel=4 {0} {1} -o {1}'
+        s = 'LC_ALL=C gsort -S {2} --parallel=4 {0} {1} -o {1}.sorted'
     else:
-        s = 'LC_ALL=C sort -S 50% --parallel=4 {0} {1} -o {1}'
-    status = subprocess.call(s.format(args, os.path.join(path, filename)), shell=True)
+        s = 'LC_ALL=C sort -S {2} --parallel=4 {0} {1} -o {1}.sorted'
+    file_path = os.path.join(path, filename)
+    status = subprocess.call(s.format(args, file_path, buffer_size), shell=True)
     if status != 0:
+        if os.path.exists(file_path + '.sorted'):
+            os.remove(file_path + '.sorted')
+        raise Exception('unable to sort file: {}'.format(filename))
+    os.replace(file_path + '.sorted', file_path)
+
+
+def _sort_compressed(path, filename, args, buffer_size):
+    """
+    Sorts a compressed file by piping its decompressed content through
+    sort and compressing the output into a new file.
+    """
+    if sys.platform == 'darwin':
+        s = 'LC_ALL=C gsort -S {1} --parallel=4 {0}'
+    else:
+        s = 'LC_ALL=C sort -S {1} --parallel=4 {0}'
+    file_path = os.path.join(path, filename)
+    process = subprocess.Popen(s.format(args, buffer_size), shell=True,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            with open_reader(file_path) as reader:
+                shutil.copyfileobj(reader, process.stdin)
+        finally:
+            process.stdin.close()
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    compression = compression_of(filename)
+    with CompressedWriter(file_path + '.sorted', compression, 'w') as writer:
+        for data in iter(lambda: process.stdout.read(1 << 20), b''):
+            writer.write_bytes(data)
+    feeder.join()
+    if process.wait() != 0:
+        os.remove(file_path + '.sorted')
         raise Exception('unable to sort file: {}'.format(filename))
+    os.replace(file_path + '.sorted', file_path)
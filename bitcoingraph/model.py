@@ -128,8 +128,12 @@ class Transaction:
             self._load()
         return self.__outputs
 
-    def _load(self):
-        transaction = self._blockchain.get_transaction(self.txid)
+    def is_loaded(self):
+        return self.__inputs is not None
+
+    def _load(self, transaction=None):
+        if transaction is None:
+            transaction = self._blockchain.get_transaction(self.txid)
         self.__inputs = transaction.inputs
         self.__outputs = transaction.outputs
 
@@ -189,7 +193,12 @@ class Input:
         self._blockchain = blockchain
         self.output_reference = output_reference
         self.is_coinbase = is_coinbase
-        self.__output = None
+        if output_reference is not None and 'prevout' in output_reference:
+            transaction = Transaction(blockchain, txid=output_reference['txid'])
+            self.__output = Output(transaction, output_reference['vout'],
+                                   output_reference['prevout'])
+        else:
+            self.__output = None
 
     @property
     def output(self):
@@ -199,6 +208,13 @@ class Input:
             self._load()
         return self.__output
 
+    @output.setter
+    def output(self, output):
+        self.__output = output
+
+    def is_resolved(self):
+        return self.is_coinbase or self.__output is not None
+
     def _load(self):
         transaction = self._blockchain.get_transaction(self.output_reference['txid'])
         self.__output = transaction.outputs[self.output_reference['vout']]
@@ -213,5 +229,7 @@ class Output:
         self.type = json_data['scriptPubKey']['type']
         if 'addresses' in json_data['scriptPubKey']:
             self.addresses = json_data['scriptPubKey']['addresses']
+        elif 'address' in json_data['scriptPubKey']:
+            self.addresses = [json_data['scriptPubKey']['address']]
         else:
             self.addresses = []
@@ -33,11 +33,15 @@ class Neo4jController:
         }
         self._session = requests.Session()
 
-    address_match = lb_join(
+    address_edges_match = lb_join(
         'MATCH (a:Address {address: {address}})<-[:USES]-(o),',
-        '  (o)-[r:INPUT|OUTPUT]-(t)<-[:CONTAINS]-(b)',
+        '  (o)-[r:INPUT|OUTPUT]-(t)<-[:CONTAINS]-(b)')
+    address_value = lb_join(
         'WITH a, t, b,',
         'CASE type(r) WHEN "OUTPUT" THEN sum(o.value) ELSE -sum(o.value) END AS value')
+    address_match = lb_join(
+        address_edges_match,
+        address_value)
     reduced_address_match = lb_join(
         address_match,
         'WITH a, t, b, sum(value) AS value')
@@ -47,16 +51,37 @@ class Neo4jController:
     address_statement = lb_join(
         address_period_match,
         'RETURN t.txid as txid, value, b.timestamp as timestamp',
-        'ORDER BY b.timestamp desc')
+        # the same order as keyset_address_statement, so that numbered pages are stable
+        'ORDER BY b.timestamp desc, t.txid desc')
+
+    def address_stats_statement(self, address):
+        s = lb_join(
+            'MATCH (a:Address {address: {address}})',
+            'RETURN a.tx_count as num_transactions, '
+            'a.first_timestamp as first, a.last_timestamp as last')
+        return s, {'address': address}
 
     def address_stats_query(self, address):
+        return self.query(*self.address_stats_statement(address))
+
+    def address_stats_scan_statement(self, address):
         s = lb_join(
             self.reduced_address_match,
             'RETURN count(*) as num_transactions, '
             'min(b.timestamp) as first, max(b.timestamp) as last')
-        return self.query(s, {'address': address})
+        return s, {'address': address}
+
+    def _address_property(self, address, name):
+        s = lb_join(
+            'MATCH (a:Address {address: {address}})',
+            'RETURN a.' + name)
+        return self.query(s, {'address': address}).single_result()
 
     def get_received_bitcoins(self, address):
+        received = self._address_property(address, 'total_received')
+        if received is not None:
+            return received
+        # addresses created before the aggregates were maintained
         s = lb_join(
             self.reduced_address_match,
             'WHERE value > 0',
@@ -64,30 +89,68 @@ class Neo4jController:
         return self.query(s, {'address': address}).single_result()
 
     def get_unspent_bitcoins(self, address):
+        unspent = self._address_property(address, 'unspent')
+        if unspent is not None:
+            return unspent
         s = lb_join(
             'MATCH (a:Address {address: {address}})<-[:USES]-(o)',
             'WHERE NOT (o)-[:INPUT]->()',
             'RETURN sum(o.value)')
         return self.query(s, {'address': address}).single_result()
 
-    def address_count_query(self, address, date_from, date_to):
+    def address_count_statement(self, address, date_from, date_to):
         s = lb_join(
             self.address_period_match,
             'RETURN count(*)')
-        return self.query(s, self.as_address_query_parameter(address, date_from, date_to))
+        return s, self.as_address_query_parameter(address, date_from, date_to)
+
+    def address_count_query(self, address, date_from, date_to):
+        return self.query(*self.address_count_statement(address, date_from, date_to))
 
     def address_query(self, address, date_from, date_to):
         return self.query(self.address_statement,
                           self.as_address_query_parameter(address, date_from, date_to))
 
-    def paginated_address_query(self, address, date_from, date_to, skip, limit):
+    def paginated_address_statement(self, address, date_from, date_to, skip, limit):
         s = lb_join(
             self.address_statement,
             'SKIP {skip} LIMIT {limit}')
         p = self.as_address_query_parameter(address, date_from, date_to)
         p['skip'] = skip
         p['limit'] = limit
-        return self.query(s, p)
+        return s, p
+
+    def keyset_address_statement(self, address, date_from, date_to, limit, cursor=None):
+        """
+        Returns the statement for a page of the transactions of an
+        address, ordered by timestamp and txid (descending), which start
+        after a cursor, given as pair of timestamp and txid of the last
+        transaction on the previous page.
+
+        The cursor is applied before aggregating the values, so that
+        later pages do not cost more than the first.
+        """
+        s = lb_join(
+            self.address_edges_match,
+            'WHERE b.timestamp > {from} AND b.timestamp < {to}',
+            '  AND (b.timestamp < {before_timestamp}',
+            '    OR b.timestamp = {before_timestamp} AND t.txid < {before_txid})',
+            self.address_value,
+            'WITH a, t, b, sum(value) AS value',
+            'RETURN t.txid as txid, value, b.timestamp as timestamp',
+            'ORDER BY b.timestamp desc, t.txid desc',
+            'LIMIT {limit}')
+        p = self.as_address_query_parameter(address, date_from, date_to)
+        if cursor is None:
+            p['before_timestamp'], p['before_txid'] = p['to'], ''
+        else:
+            p['before_timestamp'], p['before_txid'] = cursor
+        p['limit'] = limit
+        return s, p
+
+    def paginated_address_query(self, address, date_from, date_to, skip, limit):
+        return self.query(*self.paginated_address_statement(address, date_from, date_to,
+                                                            skip, limit))
 
     def incoming_addresses(self, address, date_from, date_to):
         return self._related_addresses(address, date_from, date_to, '<-[:OUTPUT]-(t)<-[:INPUT]-')
@@ -122,20 +185,26 @@ class Neo4jController:
         p['address2'] = address2
         return self.query(s, p).get()
 
-    def entity_query(self, address):
+    def entity_statement(self, address):
         s = lb_join(
             'MATCH (a:Address {address: {address}})-[:BELONGS_TO]->(e)',
             'RETURN {id: id(e)}')
-        return self.query(s, {'address': address})
+        return s, {'address': address}
 
-    def get_number_of_addresses_for_entity(self, id):
+    def entity_query(self, address):
+        return self.query(*self.entity_statement(address))
+
+    def number_of_addresses_for_entity_statement(self, id):
         s = lb_join(
             'MATCH (e:Entity)',
             'WHERE id(e) = {id}',
             'RETURN size((e)<-[:BELONGS_TO]-())')
-        return self.query(s, {'id': id}).single_result()
+        return s, {'id': id}
 
-    def entity_address_query(self, id, limit):
+    def get_number_of_addresses_for_entity(self, id):
+        return self.query(*self.number_of_addresses_for_entity_statement(id)).single_result()
+
+    def entity_address_statement(self, id, limit):
         s = lb_join(
             'MATCH (e:Entity)<-[:BELONGS_TO]-(a)',
             'WHERE id(e) = {id}',
@@ -144,13 +213,19 @@ class Neo4jController:
             'ORDER BY length(is) desc',
             'LIMIT {limit}',
             'RETURN a.address as address, is as identities')
-        return self.query(s, {'id': id, 'limit': limit})
+        return s, {'id': id, 'limit': limit}
 
-    def identity_query(self, address):
+    def entity_address_query(self, id, limit):
+        return self.query(*self.entity_address_statement(id, limit))
+
+    def identity_statement(self, address):
         s = lb_join(
             'MATCH (a:Address {address: {address}})-[:HAS]->(i)',
             'RETURN collect({id: id(i), name: i.name, link: i.link, source: i.source})')
-        return self.query(s, {'address': address})
+        return s, {'address': address}
+
+    def identity_query(self, address):
+        return self.query(*self.identity_statement(address))
 
     def reverse_identity_query(self, name):
         s = lb_join(
@@ -215,69 +290,194 @@ class Neo4jController:
             'RETURN max(b.height)')
         return self.query(s).single_result()
 
-    def add_block(self, block):
-        s = lb_join(
-            'CREATE (b:Block {hash: {hash}, height: {height}, timestamp: {timestamp}})',
-            'RETURN id(b)')
-        p = {'hash': block.hash, 'height': block.height, 'timestamp': block.timestamp}
-        return self.query(s, p).single_result()
-
-    def add_transaction(self, block_node_id, tx):
-        s = lb_join(
-            'MATCH (b) WHERE id(b) = {id}',
-            'CREATE (b)-[:CONTAINS]->(t:Transaction {txid: {txid}, coinbase: {coinbase}})',
-            'RETURN id(t)')
-        p = {'id': block_node_id, 'txid': tx.txid, 'coinbase': tx.is_coinbase()}
-        return self.query(s, p).single_result()
+    # updates the summary properties of the addresses used by the transactions of block b
+    address_aggregate_update = lb_join(
+        'OPTIONAL MATCH (b)-[:CONTAINS]->(t)-[r:INPUT|OUTPUT]-(o)-[:USES]->(a)',
+        'WHERE a.tx_count IS NOT NULL',
+        'WITH b, t, a, sum(CASE type(r) WHEN "OUTPUT" THEN o.value ELSE -o.value END) AS value',
+        'WITH b, a, count(t) AS transactions, sum(value) AS balance,',
+        '  sum(CASE WHEN value > 0 THEN value ELSE 0 END) AS received',
+        'SET a.tx_count = a.tx_count + transactions,',
+        '  a.first_timestamp = CASE WHEN a.first_timestamp < b.timestamp',
+        '    THEN a.first_timestamp ELSE b.timestamp END,',
+        '  a.last_timestamp = CASE WHEN a.last_timestamp > b.timestamp',
+        '    THEN a.last_timestamp ELSE b.timestamp END,',
+        '  a.total_received = a.total_received + received,',
+        '  a.unspent = a.unspent + balance',
+        'WITH DISTINCT b')
+
+    block_ingest_statement = lb_join(
+        'CREATE (b:Block {hash: {hash}, height: {height}, timestamp: {timestamp}})',
+        'WITH b',
+        'UNWIND {transactions} AS tx',
+        'CREATE (b)-[:CONTAINS]->(t:Transaction {txid: tx.txid, coinbase: tx.coinbase})',
+        'FOREACH (output IN tx.outputs |',
+        '  CREATE (t)-[:OUTPUT]->(o:Output {txid_n: output.txid_n, n: output.n,',
+        '    value: output.value, type: output.type})',
+        '  FOREACH (address IN output.addresses |',
+        '    MERGE (a:Address {address: address})',
+        '    ON CREATE SET a.tx_count = 0, a.total_received = 0.0, a.unspent = 0.0',
+        '    CREATE (o)-[:USES]->(a)))',
+        'WITH b, t, tx',
+        'OPTIONAL MATCH (o:Output) WHERE o.txid_n IN tx.inputs',
+        'FOREACH (spent IN CASE WHEN o IS NULL THEN [] ELSE [o] END |',
+        '  CREATE (spent)-[:INPUT]->(t))',
+        'WITH b, count(*) AS rows',
+        address_aggregate_update,
+        'RETURN id(b)')
 
-    def add_input(self, tx_node_id, output_reference):
-        s = lb_join(
-            'MATCH (o:Output {txid_n: {txid_n}}), (t)',
-            'WHERE id(t) = {id}',
-            'CREATE (o)-[:INPUT]->(t)')
-        p = {'txid_n': '{}_{}'.format(output_reference['txid'], output_reference['vout']),
-             'id': tx_node_id}
-        return self.query(s, p).single_result()
-
-    def add_output(self, tx_node_id, output):
-        s = lb_join(
-            'MATCH (t) WHERE id(t) = {id}',
-            'CREATE (t)-[:OUTPUT]->'
-            '(o:Output {txid_n: {txid_n}, n: {n}, value: {value}, type: {type}})',
-            'RETURN id(o)')
-        p = {'id': tx_node_id, 'txid_n': '{}_{}'.format(output.transaction.txid, output.index),
-             'n': output.index, 'value': output.value, 'type': output.type}
-        return self.query(s, p).single_result()
-
-    def add_address(self, output_node_id, address):
-        s = lb_join(
-            'MATCH (o) WHERE id(o) = {id}',
-            'MERGE (a:Address {address: {address}})',
-            'CREATE (o)-[:USES]->(a)',
-            'RETURN id(a)')
-        return self.query(s, {'id': output_node_id, 'address': address}).single_result()
-
-    def create_entity(self, transaction_node_id):
-        url = self.url_base + 'ext/Entity/node/{}/createEntity'.format(transaction_node_id)
-        self._session.post(url, auth=(self.user, self.password))
-
-    def create_entities(self, block_node_id):
-        url = self.url_base + 'ext/Entity/node/{}/createEntities'.format(block_node_id)
-        self._session.post(url, auth=(self.user, self.password))
+    @staticmethod
+    def block_ingest_parameters(block):
+        """
+        Returns the parameters of the block ingest statement for a block.
+        """
+        transactions = []
+        for tx in block.transactions:
+            if tx.is_coinbase():
+                inputs = []
+            else:
+                inputs = ['{}_{}'.format(input.output_reference['txid'],
+                                         input.output_reference['vout'])
+                          for input in tx.inputs]
+            outputs = [{'txid_n': '{}_{}'.format(tx.txid, output.index), 'n': output.index,
+                        'value': output.value, 'type': output.type,
+                        'addresses': output.addresses}
+                       for output in tx.outputs]
+            transactions.append({'txid': tx.txid, 'coinbase': tx.is_coinbase(),
+                                 'inputs': inputs, 'outputs': outputs})
+        return {'hash': block.hash, 'height': block.height, 'timestamp': block.timestamp,
+                'transactions': transactions}
+
+    def commit_block(self, parameters):
+        """
+        Adds a block given by its ingest parameters in a single request
+        and returns the id of the block node.
+        """
+        return self.query(self.block_ingest_statement, parameters).single_result()
+
+    def ingest_block(self, block):
+        """
+        Adds a block with its transactions, outputs, addresses and inputs
+        in a single request and returns the id of the block node.
+        """
+        return self.commit_block(self.block_ingest_parameters(block))
+
+    index_statements = [
+        'CREATE INDEX ON :Block(hash)',
+        'CREATE INDEX ON :Transaction(txid)',
+        'CREATE CONSTRAINT ON (o:Output) ASSERT o.txid_n IS UNIQUE',
+        'CREATE CONSTRAINT ON (a:Address) ASSERT a.address IS UNIQUE']
+
+    # nodes and relationships are merged, so that an interrupted load can be repeated
+    bulk_statements = {
+        'transactions': lb_join(
+            'UNWIND {rows} AS row',
+            'MERGE (t:Transaction {txid: row[0]})',
+            'SET t.coinbase = row[1]'),
+        'outputs': lb_join(
+            'UNWIND {rows} AS row',
+            'MERGE (o:Output {txid_n: row[0]})',
+            'SET o.n = row[1], o.value = row[2], o.type = row[3]'),
+        'addresses': lb_join(
+            'UNWIND {rows} AS row',
+            'MERGE (a:Address {address: row[0]})',
+            'ON CREATE SET a.tx_count = 0, a.total_received = 0.0, a.unspent = 0.0'),
+        'rel_tx_output': lb_join(
+            'UNWIND {rows} AS row',
+            'MATCH (t:Transaction {txid: row[0]}), (o:Output {txid_n: row[1]})',
+            'MERGE (t)-[:OUTPUT]->(o)'),
+        'rel_input': lb_join(
+            'UNWIND {rows} AS row',
+            'MATCH (t:Transaction {txid: row[0]}), (o:Output {txid_n: row[1]})',
+            'MERGE (o)-[:INPUT]->(t)'),
+        'rel_output_address': lb_join(
+            'UNWIND {rows} AS row',
+            'MATCH (o:Output {txid_n: row[0]}), (a:Address {address: row[1]})',
+            'MERGE (o)-[:USES]->(a)'),
+        'blocks': lb_join(
+            'UNWIND {rows} AS row',
+            'MERGE (b:Block {hash: row[0]})',
+            'SET b.height = row[1], b.timestamp = row[2]',
+            'WITH b, row',
+            'UNWIND row[3] AS txid',
+            'MATCH (t:Transaction {txid: txid})',
+            'MERGE (b)-[:CONTAINS]->(t)',
+            'WITH DISTINCT b',
+            address_aggregate_update,
+            'RETURN b.height AS height, id(b) AS id')}
+
+    # the input addresses of a transaction join one entity, into which the entities they
+    # belonged to before are merged
+    transaction_entity_statement = lb_join(
+        'MATCH (:Transaction {txid: {txid}})<-[:INPUT]-(:Output)-[:USES]->(a:Address)',
+        'WITH collect(DISTINCT a) AS addresses',
+        'UNWIND addresses AS a',
+        'OPTIONAL MATCH (a)-[:BELONGS_TO]->(e:Entity)',
+        'WITH addresses, collect(DISTINCT e) AS entities',
+        'FOREACH (_ IN CASE WHEN size(entities) = 0 THEN [1] ELSE [] END |',
+        '  CREATE (n:Entity)',
+        '  FOREACH (a IN addresses | CREATE (a)-[:BELONGS_TO]->(n)))',
+        'WITH addresses, entities WHERE size(entities) > 0',
+        'WITH addresses, head(entities) AS entity, tail(entities) AS others',
+        'UNWIND CASE WHEN size(others) = 0 THEN [null] ELSE others END AS other',
+        'OPTIONAL MATCH (member)-[r:BELONGS_TO]->(other)',
+        'FOREACH (_ IN CASE WHEN r IS NULL THEN [] ELSE [1] END |',
+        '  MERGE (member)-[:BELONGS_TO]->(entity) DELETE r)',
+        'WITH DISTINCT addresses, entity, others',
+        'FOREACH (other IN others | DELETE other)',
+        'WITH addresses, entity',
+        'UNWIND addresses AS a',
+        'MERGE (a)-[:BELONGS_TO]->(entity)')
+
+    def create_indexes(self):
+        """
+        Creates the indexes and constraints used by bulk loads, unless
+        they exist.
+        """
+        for statement in self.index_statements:
+            self.query(statement)
+
+    def bulk_load(self, table, rows):
+        """
+        Loads a batch of rows of an exported CSV file in one request.
+
+        :param str table: name of the CSV file without extension
+        :param list rows: rows as lists of typed values
+        """
+        return self.query(self.bulk_statements[table], {'rows': rows})
+
+    def create_entities(self, txids):
+        """
+        Creates the entities of the given transactions in order, with
+        one statement per transaction in a single request.
+
+        :param list txids: transaction ids
+        """
+        self.query_batch([(self.transaction_entity_statement, {'txid': txid})
+                          for txid in txids])
 
     def query(self, statement, parameters=None):
-        #print(statement, '||', parameters)
-        statement_json = {'statement': statement}
-        if parameters is not None:
-            statement_json['parameters'] = parameters
-        payload = {'statements': [statement_json]}
+        return self.query_batch([(statement, parameters)])[0]
+
+    def query_batch(self, statements):
+        """
+        Executes several statements in one request and returns a
+        QueryResult per statement.
+
+        :param list statements: pairs of statement and parameters (or None)
+        """
+        payload = {'statements': []}
+        for statement, parameters in statements:
+            statement_json = {'statement': statement}
+            if parameters is not None:
+                statement_json['parameters'] = parameters
+            payload['statements'].append(statement_json)
         r = self._session.post(self.url, auth=(self.user, self.password),
                                headers=self.headers, json=payload)
         result = r.json()
         if result['errors']:
             raise Neo4jException(result['errors'][0]['message'])
-        #print(result)
-        return QueryResult(result)
+        return [QueryResult(result, index) for index in range(len(statements))]
 
     @staticmethod
     def as_address_query_parameter(address, date_from=None, date_to=None):
@@ -294,39 +494,21 @@ class Neo4jController:
             timestamp_to = d.timestamp()
         return {'address': address, 'from': timestamp_from, 'to': timestamp_to}
 
-    def transaction(self):
-        return DBTransaction(self.host, self.port, self.user, self.password)
-
-
-class DBTransaction(Neo4jController):
-
-    def __enter__(self):
-        transaction_begin_url = self.url_base + 'transaction'
-        r = self._session.post(transaction_begin_url, auth=(self.user, self.password),
-                               headers=self.headers)
-        self.url = r.headers['Location']
-        return self
-
-    def __exit__(self, type, value, traceback):
-        transaction_commit_url = self.url + '/commit'
-        r = self._session.post(transaction_commit_url, auth=(self.user, self.password),
-                               headers=self.headers)
-        self._session.close()
-
 
 class QueryResult:
 
-    def __init__(self, raw_data):
+    def __init__(self, raw_data, index=0):
         self._raw_data = raw_data
+        self._index = index
 
     def data(self):
-        if self._raw_data['results']:
-            return self._raw_data['results'][0]['data']
+        if len(self._raw_data['results']) > self._index:
+            return self._raw_data['results'][self._index]['data']
         else:
             return []
 
     def columns(self):
-        return self._raw_data['results'][0]['columns']
+        return self._raw_data['results'][self._index]['columns']
 
     def get(self):
         return [dict(zip(self.columns(), r['row'])) for r in self.data()]
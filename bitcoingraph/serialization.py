@@ -0,0 +1,465 @@
+"""
+serialization
+
+Deserialization of blocks and transactions in Bitcoin's binary wire format
+into the JSON structures returned by Bitcoin Core's JSON-RPC interface.
+
+"""
+
+import binascii
+import hashlib
+import struct
+
+__author__ = 'Bernhard Haslhofer (bernhard.haslhofer@ait.ac.at)'
+__copyright__ = 'Copyright 2015, Bernhard Haslhofer'
+__license__ = "MIT"
+
+
+P2PKH_VERSION = b'\x00'
+P2SH_VERSION = b'\x05'
+BECH32_HRP = 'bc'
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_1 = 0x51
+OP_16 = 0x60
+OP_RETURN = 0x6a
+OP_DUP = 0x76
+OP_EQUAL = 0x87
+OP_EQUALVERIFY = 0x88
+OP_HASH160 = 0xa9
+OP_CHECKSIG = 0xac
+OP_CHECKMULTISIG = 0xae
+
+NULL_HASH = bytes(32)
+COIN = 100000000
+
+_unpack_uint32 = struct.Struct('<I').unpack_from
+_unpack_uint64 = struct.Struct('<Q').unpack_from
+
+
+class DeserializationException(Exception):
+    """
+    Exception raised when binary block data is malformed.
+    """
+    pass
+
+
+def sha256d(*parts):
+    """
+    Returns the double SHA-256 digest of the concatenated parts.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+    return hashlib.sha256(h.digest()).digest()
+
+
+# message word selection, rotation amounts and constants of the left and
+# right lines of RIPEMD-160
+_RMD_R = [
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+    3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+    1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+    4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13]
+_RMD_R2 = [
+    5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+    6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+    15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+    8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+    12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11]
+_RMD_S = [
+    11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+    7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+    11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+    11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+    9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6]
+_RMD_S2 = [
+    8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+    9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+    9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+    15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+    8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11]
+_RMD_K = [0x00000000, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e]
+_RMD_K2 = [0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0x00000000]
+
+
+def _rmd_f(j, x, y, z):
+    if j == 0:
+        return x ^ y ^ z
+    if j == 1:
+        return (x & y) | (~x & z)
+    if j == 2:
+        return (x | ~y) ^ z
+    if j == 3:
+        return (x & z) | (y & ~z)
+    return x ^ (y | ~z)
+
+
+def _rmd_rotate(x, n):
+    return ((x << n) | (x >> (32 - n))) & 0xffffffff
+
+
+def _ripemd160(data):
+    """
+    Returns the RIPEMD-160 digest of data, for OpenSSL builds that do
+    not provide the algorithm to hashlib.
+    """
+    data = bytes(data)
+    message = data + b'\x80' + bytes((55 - len(data)) % 64) + struct.pack('<Q', 8 * len(data))
+    state = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0]
+    for offset in range(0, len(message), 64):
+        x = struct.unpack_from('<16I', message, offset)
+        a, b, c, d, e = state
+        a2, b2, c2, d2, e2 = state
+        for i in range(80):
+            j = i // 16
+            t = _rmd_rotate((a + _rmd_f(j, b, c, d) + x[_RMD_R[i]] + _RMD_K[j]) & 0xffffffff,
+                            _RMD_S[i])
+            a, b, c, d, e = e, (t + e) & 0xffffffff, b, _rmd_rotate(c, 10), d
+            t = _rmd_rotate((a2 + _rmd_f(4 - j, b2, c2, d2) + x[_RMD_R2[i]] + _RMD_K2[j])
+                            & 0xffffffff, _RMD_S2[i])
+            a2, b2, c2, d2, e2 = e2, (t + e2) & 0xffffffff, b2, _rmd_rotate(c2, 10), d2
+        state = [(state[1] + c + d2) & 0xffffffff, (state[2] + d + e2) & 0xffffffff,
+                 (state[3] + e + a2) & 0xffffffff, (state[4] + a + b2) & 0xffffffff,
+                 (state[0] + b + c2) & 0xffffffff]
+    return struct.pack('<5I', *state)
+
+
+def _hashlib_ripemd160(data):
+    return hashlib.new('ripemd160', data).digest()
+
+
+try:
+    _hashlib_ripemd160(b'')
+    ripemd160 = _hashlib_ripemd160
+except ValueError:
+    ripemd160 = _ripemd160
+
+
+def hash160(data):
+    return ripemd160(hashlib.sha256(data).digest())
+
+
+def to_hex(data):
+    """
+    Returns the hexadecimal notation of bytes.
+    """
+    return binascii.hexlify(data).decode()
+
+
+def to_hex_hash(data):
+    """
+    Returns a hash in the byte-reversed hexadecimal notation of Bitcoin Core.
+    """
+    return to_hex(bytes(data)[::-1])
+
+
+_BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def base58check(version, payload):
+    data = version + bytes(payload)
+    data += sha256d(data)[:4]
+    number = int.from_bytes(data, 'big')
+    encoded = ''
+    while number > 0:
+        number, remainder = divmod(number, 58)
+        encoded = _BASE58_ALPHABET[remainder] + encoded
+    leading_zeros = len(data) - len(data.lstrip(b'\x00'))
+    return '1' * leading_zeros + encoded
+
+
+_BECH32_ALPHABET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_BECH32_CONSTANT = 1
+_BECH32M_CONSTANT = 0x2bc830a3
+
+
+def _bech32_polymod(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            checksum ^= generator[i] if ((top >> i) & 1) else 0
+    return checksum
+
+
+def _convert_bits(data, from_bits, to_bits):
+    accumulator = 0
+    bits = 0
+    result = []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((accumulator >> bits) & max_value)
+    if bits:
+        result.append((accumulator << (to_bits - bits)) & max_value)
+    return result
+
+
+def segwit_address(witness_version, program, hrp=BECH32_HRP):
+    """
+    Returns the bech32 (version 0) or bech32m (version 1+) address of
+    a witness program.
+    """
+    data = [witness_version] + _convert_bits(program, 8, 5)
+    constant = _BECH32_CONSTANT if witness_version == 0 else _BECH32M_CONSTANT
+    expanded_hrp = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(expanded_hrp + data + [0] * 6) ^ constant
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + '1' + ''.join(_BECH32_ALPHABET[d] for d in data + checksum)
+
+
+def _pubkey_size(script, offset):
+    """
+    Returns the expected size of a public key starting at offset
+    (as determined by its header byte), or 0 if the header is invalid.
+    """
+    header = script[offset]
+    if header in (2, 3):
+        return 33
+    elif header in (4, 6, 7):
+        return 65
+    return 0
+
+
+def _script_ops(script):
+    """
+    Generates (opcode, pushed data) pairs and raises
+    DeserializationException on truncated pushes.
+    """
+    offset = 0
+    length = len(script)
+    while offset < length:
+        opcode = script[offset]
+        offset += 1
+        size = 0
+        if opcode < OP_PUSHDATA1:
+            size = opcode
+        elif opcode == OP_PUSHDATA1:
+            if offset + 1 > length:
+                raise DeserializationException('truncated push')
+            size = script[offset]
+            offset += 1
+        elif opcode == OP_PUSHDATA2:
+            if offset + 2 > length:
+                raise DeserializationException('truncated push')
+            size = script[offset] | script[offset + 1] << 8
+            offset += 2
+        elif opcode == OP_PUSHDATA4:
+            if offset + 4 > length:
+                raise DeserializationException('truncated push')
+            size = _unpack_uint32(script, offset)[0]
+            offset += 4
+        if offset + size > length:
+            raise DeserializationException('truncated push')
+        yield opcode, script[offset:offset + size]
+        offset += size
+
+
+def _match_multisig(script):
+    """
+    Returns the list of public keys of a bare multisig script or None.
+    """
+    length = len(script)
+    if (length < 3 or script[-1] != OP_CHECKMULTISIG or
+            not OP_1 <= script[0] <= OP_16 or not OP_1 <= script[-2] <= OP_16):
+        return None
+    required = script[0] - OP_1 + 1
+    total = script[-2] - OP_1 + 1
+    pubkeys = []
+    offset = 1
+    while offset < length - 2:
+        size = script[offset]
+        if size not in (33, 65) or offset + 1 + size > length - 2:
+            return None
+        if _pubkey_size(script, offset + 1) != size:
+            return None
+        pubkeys.append(script[offset + 1:offset + 1 + size])
+        offset += 1 + size
+    if len(pubkeys) != total or required > total:
+        return None
+    return pubkeys
+
+
+def _is_push_only(script):
+    try:
+        return all(opcode <= OP_16 for opcode, _ in _script_ops(script))
+    except DeserializationException:
+        return False
+
+
+def classify_script(script):
+    """
+    Returns the output type and the addresses of a locking script
+    using the type names of Bitcoin Core.
+
+    :param script: locking script (bytes or memoryview)
+    :return: type and list of addresses
+    :rtype: tuple
+    """
+    length = len(script)
+    if (length == 25 and script[0] == OP_DUP and script[1] == OP_HASH160 and
+            script[2] == 20 and script[23] == OP_EQUALVERIFY and script[24] == OP_CHECKSIG):
+        return 'pubkeyhash', [base58check(P2PKH_VERSION, script[3:23])]
+    if length == 23 and script[0] == OP_HASH160 and script[1] == 20 and script[22] == OP_EQUAL:
+        return 'scripthash', [base58check(P2SH_VERSION, script[2:22])]
+    if (length in (35, 67) and script[0] == length - 2 and script[-1] == OP_CHECKSIG and
+            _pubkey_size(script, 1) == length - 2):
+        return 'pubkey', [base58check(P2PKH_VERSION, hash160(script[1:-1]))]
+    if (4 <= length <= 42 and (script[0] == OP_0 or OP_1 <= script[0] <= OP_16) and
+            script[1] == length - 2):
+        witness_version = 0 if script[0] == OP_0 else script[0] - OP_1 + 1
+        program = script[2:]
+        if witness_version == 0:
+            if length == 22:
+                output_type = 'witness_v0_keyhash'
+            elif length == 34:
+                output_type = 'witness_v0_scripthash'
+            else:
+                return 'nonstandard', []
+        elif witness_version == 1 and length == 34:
+            output_type = 'witness_v1_taproot'
+        else:
+            output_type = 'witness_unknown'
+        return output_type, [segwit_address(witness_version, program)]
+    if length >= 1 and script[0] == OP_RETURN and _is_push_only(script[1:]):
+        return 'nulldata', []
+    pubkeys = _match_multisig(script)
+    if pubkeys is not None:
+        return 'multisig', [base58check(P2PKH_VERSION, hash160(pubkey)) for pubkey in pubkeys]
+    return 'nonstandard', []
+
+
+class _Reader:
+    """
+    Sequential reader over a memoryview which avoids copying data.
+    """
+
+    def __init__(self, data, offset=0):
+        self.view = memoryview(data)
+        self.offset = offset
+
+    def read(self, size):
+        end = self.offset + size
+        if end > len(self.view):
+            raise DeserializationException('unexpected end of data')
+        chunk = self.view[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def uint32(self):
+        return _unpack_uint32(self.read(4))[0]
+
+    def uint64(self):
+        return _unpack_uint64(self.read(8))[0]
+
+    def varint(self):
+        first = self.read(1)[0]
+        if first < 0xfd:
+            return first
+        elif first == 0xfd:
+            return int.from_bytes(self.read(2), 'little')
+        elif first == 0xfe:
+            return int.from_bytes(self.read(4), 'little')
+        else:
+            return int.from_bytes(self.read(8), 'little')
+
+
+def _read_transaction(reader):
+    view = reader.view
+    start = reader.offset
+    reader.read(4)
+    marker = reader.offset
+    segwit = marker + 1 < len(view) and view[marker] == 0 and view[marker + 1] != 0
+    if segwit:
+        reader.read(2)
+    body_start = reader.offset
+
+    inputs = []
+    for _ in range(reader.varint()):
+        prev_hash = reader.read(32)
+        prev_index = reader.uint32()
+        script_sig = reader.read(reader.varint())
+        sequence = reader.uint32()
+        if prev_hash == NULL_HASH and prev_index == 0xffffffff:
+            inputs.append({'coinbase': to_hex(script_sig), 'sequence': sequence})
+        else:
+            inputs.append({'txid': to_hex_hash(prev_hash), 'vout': prev_index,
+                           'sequence': sequence})
+
+    outputs = []
+    for index in range(reader.varint()):
+        value = reader.uint64()
+        script = reader.read(reader.varint())
+        output_type, addresses = classify_script(script)
+        script_pub_key = {'type': output_type}
+        if addresses:
+            script_pub_key['addresses'] = addresses
+        outputs.append({'value': value / COIN, 'n': index, 'scriptPubKey': script_pub_key})
+    body_end = reader.offset
+
+    if segwit:
+        for _ in inputs:
+            for _ in range(reader.varint()):
+                reader.read(reader.varint())
+    locktime_start = reader.offset
+    reader.read(4)
+
+    if segwit:
+        txid = sha256d(view[start:start + 4], view[body_start:body_end],
+                       view[locktime_start:locktime_start + 4])
+    else:
+        txid = sha256d(view[start:reader.offset])
+    return {'txid': to_hex_hash(txid), 'version': _unpack_uint32(view, start)[0],
+            'locktime': _unpack_uint32(view, locktime_start)[0],
+            'vin': inputs, 'vout': outputs}
+
+
+def deserialize_transaction(data):
+    """
+    Deserializes a transaction in binary wire format.
+
+    :param data: serialized transaction (bytes or memoryview)
+    :return: transaction in the format of ``getrawtransaction``
+    :rtype: dict
+    """
+    reader = _Reader(data)
+    return _read_transaction(reader)
+
+
+def deserialize_block(data):
+    """
+    Deserializes a block in binary wire format.
+
+    The result has the structure of ``getblock`` responses with complete
+    transactions, but lacks the fields that depend on the position in the
+    block chain (``height``, ``confirmations`` and ``nextblockhash``).
+
+    :param data: serialized block (bytes or memoryview)
+    :return: block in the format of ``getblock``
+    :rtype: dict
+    :raises DeserializationException: if the data is malformed
+    """
+    reader = _Reader(data)
+    header = reader.read(80)
+    version, = _unpack_uint32(header, 0)
+    time, bits, nonce = struct.unpack_from('<III', header, 68)
+    block = {'hash': to_hex_hash(sha256d(header)),
+             'version': version,
+             'merkleroot': to_hex_hash(header[36:68]),
+             'time': time,
+             'nonce': nonce,
+             'bits': '{:08x}'.format(bits)}
+    if header[4:36] != NULL_HASH:
+        block['previousblockhash'] = to_hex_hash(header[4:36])
+    block['tx'] = [_read_transaction(reader) for _ in range(reader.varint())]
+    return block
@@ -1,37 +1,581 @@
+import bisect
 import csv
+import hashlib
+import heapq
+import io
+import json
+import math
+import mmap
 import os
+import shutil
+
+from bitcoingraph.compression import CompressedWriter, SUFFIXES, open_reader
+
+
+CHECKPOINT_MANIFEST = 'checkpoint.json'
+
+
+def read_checkpoint(output_path):
+    """
+    Returns the checkpoint manifest of an export directory or None.
+
+    The manifest contains the last completely written block height and
+    the size of each data file at that point.
+
+    :param str output_path: export directory
+    :rtype: dict
+    """
+    path = os.path.join(output_path, CHECKPOINT_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(output_path, checkpoint):
+    """
+    Replaces the checkpoint manifest of an export directory atomically.
+
+    :param str output_path: export directory
+    :param dict checkpoint: manifest content
+    """
+    path = os.path.join(output_path, CHECKPOINT_MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+_BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_BECH32_ALPHABET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_BASE58_DIGITS = {c: digit for digit, c in enumerate(_BASE58_ALPHABET)}
+_BECH32_DIGITS = {c: digit for digit, c in enumerate(_BECH32_ALPHABET)}
+
+
+class _MappedHashTable:
+    """
+    Hash table with linear probing in fixed-width slots, which is
+    memory-mapped from a file (if a path is given) or from anonymous
+    memory, so that the operating system can page it out. A slot holds
+    a key of _KEY_SIZE bytes and a value, whose first byte is not zero,
+    as empty slots are zeroed.
+    """
+
+    _KEY_SIZE = 16
+    _SLOT_SIZE = 32
+
+    def __init__(self, path=None, capacity=1 << 16):
+        """
+        Creates an empty table.
+
+        :param str path: file of the hash table, which is removed on close
+        :param int capacity: initial number of slots (a power of two)
+        """
+        self._path = path
+        self._count = 0
+        self._data = self._map(capacity, path)
+        self._mask = capacity - 1
+
+    def __len__(self):
+        return self._count
+
+    @classmethod
+    def _map(cls, capacity, path):
+        size = capacity * cls._SLOT_SIZE
+        if path is None:
+            return mmap.mmap(-1, size)
+        with open(path, 'w+b') as f:
+            f.truncate(size)
+            return mmap.mmap(f.fileno(), size)
+
+    def close(self):
+        self._data.close()
+        if self._path is not None:
+            os.remove(self._path)
+
+    def _home(self, key):
+        # outputs of the same transaction do not share their home slot
+        return (int.from_bytes(key[:8], 'little') ^
+                int.from_bytes(key[12:16], 'little') * 0x9e3779b97f4a7c15) & self._mask
+
+    def _find(self, key):
+        """
+        Returns the slot of a key or of the empty slot ending its probe sequence.
+        """
+        data = self._data
+        slot = self._home(key)
+        while data[slot * self._SLOT_SIZE + self._KEY_SIZE]:
+            offset = slot * self._SLOT_SIZE
+            if data[offset:offset + self._KEY_SIZE] == key:
+                break
+            slot = (slot + 1) & self._mask
+        return slot
+
+    def _get(self, key):
+        """
+        Returns the slot of a key and its value, or None as value if the
+        key is not contained.
+        """
+        slot = self._find(key)
+        offset = slot * self._SLOT_SIZE + self._KEY_SIZE
+        if not self._data[offset]:
+            return slot, None
+        return slot, self._data[offset:offset + self._SLOT_SIZE - self._KEY_SIZE]
+
+    def _put(self, key, value):
+        offset = self._find(key) * self._SLOT_SIZE
+        if not self._data[offset + self._KEY_SIZE]:
+            self._count += 1
+        self._data[offset:offset + self._SLOT_SIZE] = key + value
+        if self._count * 10 > (self._mask + 1) * 7:
+            self._grow()
+
+    def _set_value(self, slot, value):
+        offset = slot * self._SLOT_SIZE + self._KEY_SIZE
+        self._data[offset:offset + len(value)] = value
+
+    def _grow(self):
+        old_data = self._data
+        capacity = (self._mask + 1) * 2
+        path = None if self._path is None else self._path + '.grow'
+        self._data = self._map(capacity, path)
+        self._mask = capacity - 1
+        for offset in range(0, len(old_data), self._SLOT_SIZE):
+            if old_data[offset + self._KEY_SIZE]:
+                entry = old_data[offset:offset + self._SLOT_SIZE]
+                new_offset = self._find(entry[:self._KEY_SIZE]) * self._SLOT_SIZE
+                self._data[new_offset:new_offset + self._SLOT_SIZE] = entry
+        old_data.close()
+        if path is not None:
+            os.replace(path, self._path)
+
+    def _remove(self, slot):
+        data = self._data
+        self._count -= 1
+        # shift later entries of the probe sequence back into the gap
+        gap = slot
+        while True:
+            slot = (slot + 1) & self._mask
+            offset = slot * self._SLOT_SIZE
+            if not data[offset + self._KEY_SIZE]:
+                break
+            home = self._home(data[offset:offset + self._KEY_SIZE])
+            if (slot - home) & self._mask >= (slot - gap) & self._mask:
+                gap_offset = gap * self._SLOT_SIZE
+                data[gap_offset:gap_offset + self._SLOT_SIZE] = \
+                    data[offset:offset + self._SLOT_SIZE]
+                gap = slot
+        gap_offset = gap * self._SLOT_SIZE
+        data[gap_offset:gap_offset + self._SLOT_SIZE] = bytes(self._SLOT_SIZE)
+
+
+class OutputAddressStore(_MappedHashTable):
+    """
+    Addresses of the unspent outputs seen so far which have exactly one
+    address. Entries are removed when the outputs are spent.
+
+    Each 56-byte slot of the memory-mapped hash table holds the output
+    reference (a 12-byte digest of the transaction id and the output
+    index) and the packed address: base58 and bech32 addresses are
+    stored as numbers in their alphabets, others as raw strings. The few
+    addresses which do not fit into a slot are kept in a dictionary.
+    """
+
+    _SLOT_SIZE = 56
+    _RAW, _BASE58, _BECH32, _OVERFLOW = 1, 2, 3, 4
+
+    def __init__(self, path=None, capacity=1 << 16):
+        """
+        Creates an empty store.
+
+        :param str path: file of the hash table, which is removed on close
+        :param int capacity: initial number of slots (a power of two)
+        """
+        super().__init__(path, capacity)
+        self._overflow = {}
+
+    @staticmethod
+    def _key(txid, index):
+        return hashlib.blake2b(bytes.fromhex(txid), digest_size=12).digest() + \
+            index.to_bytes(4, 'little')
+
+    def _pack(self, address):
+        width = self._SLOT_SIZE - self._KEY_SIZE - 2
+        if address and all(c in _BASE58_DIGITS for c in address):
+            ones = len(address) - len(address.lstrip('1'))
+            value = 0
+            for c in address[ones:]:
+                value = value * 58 + _BASE58_DIGITS[c]
+            kind, length = self._BASE58, ones
+        elif address.startswith('bc1') and all(c in _BECH32_DIGITS for c in address[3:]):
+            value = 0
+            for c in address[3:]:
+                value = value << 5 | _BECH32_DIGITS[c]
+            kind, length = self._BECH32, len(address) - 3
+        else:
+            raw = address.encode()
+            if len(raw) > width:
+                return None
+            return bytes([self._RAW, len(raw)]) + raw.ljust(width, b'\0')
+        if value.bit_length() > 8 * width or length > 255:
+            return None
+        return bytes([kind, length]) + value.to_bytes(width, 'big')
+
+    def _unpack(self, packed):
+        kind, length = packed[0], packed[1]
+        if kind == self._RAW:
+            return packed[2:2 + length].decode()
+        value = int.from_bytes(packed[2:], 'big')
+        digits = []
+        if kind == self._BASE58:
+            while value:
+                value, digit = divmod(value, 58)
+                digits.append(_BASE58_ALPHABET[digit])
+            return '1' * length + ''.join(reversed(digits))
+        for _ in range(length):
+            digits.append(_BECH32_ALPHABET[value & 31])
+            value >>= 5
+        return 'bc1' + ''.join(reversed(digits))
+
+    def add(self, txid, index, addresses):
+        if len(addresses) != 1:
+            return
+        key = self._key(txid, index)
+        packed = self._pack(addresses[0])
+        if packed is None:
+            self._overflow[key] = addresses[0]
+            packed = bytes([self._OVERFLOW]).ljust(self._SLOT_SIZE - self._KEY_SIZE, b'\0')
+        self._put(key, packed)
+
+    def spend(self, txid, index):
+        """
+        Removes an output and returns its address, or None if it is not
+        known or does not have exactly one address.
+        """
+        key = self._key(txid, index)
+        slot, packed = self._get(key)
+        if packed is None:
+            return None
+        address = self._overflow.pop(key) if packed[0] == self._OVERFLOW \
+            else self._unpack(packed)
+        self._remove(slot)
+        return address
+
+
+class OutputIdStore(_MappedHashTable):
+    """
+    Integer ids of the outputs of transactions with unspent outputs.
+
+    The outputs of a transaction get consecutive ids, so only the id of
+    its first output and the number of its unspent outputs are stored
+    in a slot of the memory-mapped hash table, under a 16-byte digest of
+    the transaction id. Entries are removed when all spendable outputs
+    of a transaction are spent.
+    """
+
+    _SLOT_SIZE = 32
+
+    @staticmethod
+    def _key(txid):
+        return hashlib.blake2b(bytes.fromhex(txid), digest_size=16).digest()
+
+    def add(self, txid, first_id, number_of_outputs):
+        """
+        Adds a transaction.
+
+        :param str txid: transaction id
+        :param int first_id: id of the first output
+        :param int number_of_outputs: number of spendable outputs
+        """
+        if number_of_outputs > 0:
+            self._put(self._key(txid), b'\1' + first_id.to_bytes(8, 'little') +
+                      number_of_outputs.to_bytes(7, 'little'))
+
+    def spend(self, txid, index):
+        """
+        Returns the id of a spent output, or None if its transaction is
+        not known.
+        """
+        slot, entry = self._get(self._key(txid))
+        if entry is None:
+            return None
+        count = int.from_bytes(entry[9:], 'little')
+        if count == 1:
+            self._remove(slot)
+        else:
+            self._set_value(slot, b'\1' + entry[1:9] + (count - 1).to_bytes(7, 'little'))
+        return int.from_bytes(entry[1:9], 'little') + index
+
+
+class _SortedRun:
+    """
+    Sorted 16-byte digests in a memory-mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self._data) // 16
+
+    def __getitem__(self, index):
+        return self._data[index * 16:index * 16 + 16]
+
+    def __contains__(self, digest):
+        index = bisect.bisect_left(self, digest)
+        return index < len(self) and self[index] == digest
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self._data.close()
+
+
+class DigestSet:
+    """
+    Set of strings, represented by 16-byte digests.
+
+    A Bloom filter answers most lookups of new keys. Only if it reports a
+    possible match, the exact digests are searched, which are kept in
+    memory up to max_entries and then spilled to sorted run files in the
+    spill directory. Run files are merged if there are more than
+    max_runs of them.
+
+    The Bloom filter is sized for a false positive rate of 1% at
+    expected_keys keys (about 1.2 bytes per key). Beyond that, the rate
+    grows quickly and most lookups of new keys search the run files,
+    which still gives correct results, but slows down adding keys.
+    """
+
+    def __init__(self, spill_path, max_entries=1 << 22, expected_keys=1 << 24, max_runs=8):
+        """
+        Creates an empty set.
+
+        :param str spill_path: directory for the run files
+        :param int max_entries: number of digests kept in memory
+        :param int expected_keys: number of keys the Bloom filter is sized for
+        :param int max_runs: number of run files before merging
+        """
+        self._spill_path = spill_path
+        self._max_entries = max_entries
+        self._max_runs = max_runs
+        expected_keys = max(expected_keys, 1)
+        bloom_bytes = math.ceil(-expected_keys * math.log(0.01) / math.log(2) ** 2 / 8)
+        self._bloom = bytearray(bloom_bytes)
+        self._bloom_bits = bloom_bytes * 8
+        self._bloom_hashes = max(round(self._bloom_bits / expected_keys * math.log(2)), 1)
+        self._digests = set()
+        self._runs = []
+        self._run_counter = 0
+
+    def _bloom_positions(self, digest):
+        # double hashing with the two halves of the digest
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + number * second) % self._bloom_bits
+                for number in range(self._bloom_hashes)]
+
+    def add(self, key):
+        """
+        Adds a key and returns whether it was not contained before.
+
+        :param str key: the key
+        :rtype: bool
+        """
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        positions = self._bloom_positions(digest)
+        bloom = self._bloom
+        if all(bloom[position >> 3] & (1 << (position & 7)) for position in positions):
+            if digest in self._digests or any(digest in run for run in self._runs):
+                return False
+        else:
+            for position in positions:
+                bloom[position >> 3] |= 1 << (position & 7)
+        self._digests.add(digest)
+        if len(self._digests) >= self._max_entries:
+            self._spill()
+        return True
+
+    def _write_run(self, digests):
+        if not os.path.exists(self._spill_path):
+            os.makedirs(self._spill_path)
+        path = os.path.join(self._spill_path, 'run_{}'.format(self._run_counter))
+        self._run_counter += 1
+        with open(path, 'wb') as f:
+            for digest in digests:
+                f.write(digest)
+        return _SortedRun(path)
+
+    def _spill(self):
+        self._runs.append(self._write_run(sorted(self._digests)))
+        self._digests = set()
+        if len(self._runs) > self._max_runs:
+            runs = self._runs
+            self._runs = [self._write_run(heapq.merge(*runs))]
+            for run in runs:
+                run.close()
+                os.remove(run.path)
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._digests = set()
+        if os.path.exists(self._spill_path):
+            shutil.rmtree(self._spill_path)
+
+
+def deduplication_set(path, memory, expected_keys=None):
+    """
+    Returns a DigestSet for one of the two digest sets of a writer.
+
+    Each set gets half of the memory, of which three quarters hold
+    digests (about 100 bytes each). Unless expected_keys is given, the
+    Bloom filter is sized for as many keys as fit into the remaining
+    quarter at 1.25 bytes per key.
+
+    :param str path: directory for the run files
+    :param int memory: memory used by both sets in bytes
+    :param int expected_keys: number of keys the Bloom filter is sized for
+    :rtype: DigestSet
+    """
+    memory //= 2
+    if expected_keys is None:
+        expected_keys = memory // 4 * 8 // 10
+    return DigestSet(path, max(memory * 3 // 4 // 100, 1), expected_keys)
 
 
 class CSVDumpWriter:
 
-    def __init__(self, output_path, plain_header=False, separate_header=True):
+    def __init__(self, output_path, plain_header=False, separate_header=True,
+                 input_addresses=False, deduplicate=False, deduplication_memory=1 << 28,
+                 compression=None, resume=None, integer_ids=False, deduplication_keys=None):
+        """
+        Creates a writer for CSV files in the format of the Neo4j import tool.
+
+        If input_addresses is set, the addresses of spent outputs are
+        tracked while writing and input_addresses.csv (transaction id and
+        input address) is written as well, which is otherwise computed by
+        ``entities.calculate_input_addresses``. This requires the blocks to
+        be written in chain order from the genesis block on, since inputs
+        spending outputs of earlier blocks cannot be resolved.
+
+        If deduplicate is set, each address and each transaction (with
+        its outputs) is written only once, using digest sets which use
+        about deduplication_memory bytes of main memory and spill to
+        disk beyond that. Their Bloom filters are sized for
+        deduplication_keys keys each (by default, an eighth of the memory
+        at 1.25 bytes per key, about 100,000 keys per megabyte). With more
+        keys, most lookups have to search the spilled digests, so for a
+        whole chain, deduplication_keys should be about the number of
+        addresses.
+
+        If compression ('gzip' or 'zstd') is given, the data files are
+        compressed on background threads and get the suffix .gz or .zst.
+        Separate header files are not compressed.
+
+        If resume is given (a manifest written by ``checkpoint``), the
+        data files are truncated to the sizes recorded in it and the
+        headers are not written again. The deduplication state is
+        rebuilt from the truncated files, whereas the input addresses
+        cannot be resumed.
+
+        If integer_ids is set, transactions and outputs are identified by
+        consecutive integers in the import files instead of transaction
+        ids and txid_n strings, which remain node properties. Inputs are
+        mapped to the ids of the spent outputs, so like input_addresses,
+        this requires the blocks to be written in chain order from the
+        genesis block on. Transactions are then not deduplicated, a
+        transaction id occurring twice (as the two duplicate coinbase
+        transactions) results in two transaction nodes. The headers
+        declare the integer id spaces with ``{id-type:long}``, which
+        requires ``neo4j-admin database import`` of Neo4j 5.
+        """
         self._output_path = output_path
         self._plain_header = plain_header
         self._separate_header = separate_header
+        self._output_addresses = None
+        self._deduplicate = deduplicate
+        self._deduplication_memory = deduplication_memory
+        self._deduplication_keys = deduplication_keys
+        self._compression = compression
+        self._resume = resume
+        self._output_ids = None
+        self._transaction_count = 0
+        self._output_count = 0
 
         if not os.path.exists(output_path):
             os.makedirs(output_path)
 
+        if resume is not None:
+            if input_addresses or integer_ids:
+                raise ValueError('input addresses and integer ids cannot be resumed')
+            for filename, size in resume['offsets'].items():
+                with open(os.path.join(output_path, filename), 'r+b') as f:
+                    f.truncate(size)
+            return
+
+        if input_addresses:
+            self._output_addresses = OutputAddressStore(
+                os.path.join(output_path, '.output_addresses'))
+        if integer_ids:
+            self._output_ids = OutputIdStore(os.path.join(output_path, '.output_ids'))
         self._write_header('blocks', ['hash:ID(Block)', 'height:int', 'timestamp:int'])
-        self._write_header('transactions', ['txid:ID(Transaction)', 'coinbase:boolean'])
-        self._write_header('outputs', ['txid_n:ID(Output)', 'n:int', 'value:double', 'type'])
         self._write_header('addresses', ['address:ID(Address)'])
-        self._write_header('rel_block_tx', ['hash:START_ID(Block)', 'txid:END_ID(Transaction)'])
-        self._write_header('rel_tx_output',
-                           ['txid:START_ID(Transaction)', 'txid_n:END_ID(Output)'])
-        self._write_header('rel_input', ['txid:END_ID(Transaction)', 'txid_n:START_ID(Output)'])
-        self._write_header('rel_output_address',
-                           ['txid_n:START_ID(Output)', 'address:END_ID(Address)'])
+        if integer_ids:
+            # the ids are not stored as properties
+            self._write_header('transactions',
+                               [':ID(Transaction){id-type:long}', 'txid', 'coinbase:boolean'])
+            self._write_header('outputs', [':ID(Output){id-type:long}', 'txid_n', 'n:int',
+                                           'value:double', 'type'])
+            self._write_header('rel_block_tx', ['hash:START_ID(Block)', ':END_ID(Transaction)'])
+            self._write_header('rel_tx_output', [':START_ID(Transaction)', ':END_ID(Output)'])
+            self._write_header('rel_input', [':END_ID(Transaction)', ':START_ID(Output)'])
+            self._write_header('rel_output_address',
+                               [':START_ID(Output)', 'address:END_ID(Address)'])
+        else:
+            self._write_header('transactions', ['txid:ID(Transaction)', 'coinbase:boolean'])
+            self._write_header('outputs',
+                               ['txid_n:ID(Output)', 'n:int', 'value:double', 'type'])
+            self._write_header('rel_block_tx',
+                               ['hash:START_ID(Block)', 'txid:END_ID(Transaction)'])
+            self._write_header('rel_tx_output',
+                               ['txid:START_ID(Transaction)', 'txid_n:END_ID(Output)'])
+            self._write_header('rel_input',
+                               ['txid:END_ID(Transaction)', 'txid_n:START_ID(Output)'])
+            self._write_header('rel_output_address',
+                               ['txid_n:START_ID(Output)', 'address:END_ID(Address)'])
+
+    def _digest_set(self, name):
+        if os.path.exists(os.path.join(self._output_path, name)):
+            # left behind by an interrupted export
+            shutil.rmtree(os.path.join(self._output_path, name))
+        return deduplication_set(os.path.join(self._output_path, name),
+                                 self._deduplication_memory, self._deduplication_keys)
 
     def __enter__(self):
-        self._blocks_file = open(self._get_path('blocks'), 'a')
-        self._transactions_file = open(self._get_path('transactions'), 'a')
-        self._outputs_file = open(self._get_path('outputs'), 'a')
-        self._addresses_file = open(self._get_path('addresses'), 'a')
-        self._rel_block_tx_file = open(self._get_path('rel_block_tx'), 'a')
-        self._rel_tx_output_file = open(self._get_path('rel_tx_output'), 'a')
-        self._rel_input_file = open(self._get_path('rel_input'), 'a')
-        self._rel_output_address_file = open(self._get_path('rel_output_address'), 'a')
+        if self._deduplicate:
+            self._addresses = self._digest_set('.addresses_seen')
+            self._transactions = self._digest_set('.transactions_seen')
+            if self._resume is not None:
+                self._restore_digests(self._addresses, 'addresses')
+                self._restore_digests(self._transactions, 'transactions')
+        self._blocks_file = self._open('blocks')
+        self._transactions_file = self._open('transactions')
+        self._outputs_file = self._open('outputs')
+        self._addresses_file = self._open('addresses')
+        self._rel_block_tx_file = self._open('rel_block_tx')
+        self._rel_tx_output_file = self._open('rel_tx_output')
+        self._rel_input_file = self._open('rel_input')
+        self._rel_output_address_file = self._open('rel_output_address')
+        if self._output_addresses is not None:
+            self._input_addresses_file = self._open('input_addresses')
+            self._input_address_writer = csv.writer(self._input_addresses_file)
 
         self._block_writer = csv.writer(self._blocks_file)
         self._transaction_writer = csv.writer(self._transactions_file)
@@ -41,6 +585,11 @@ class CSVDumpWriter:
         self._rel_tx_output_writer = csv.writer(self._rel_tx_output_file)
         self._rel_input_writer = csv.writer(self._rel_input_file)
         self._rel_output_address_writer = csv.writer(self._rel_output_address_file)
+        self._files = [self._blocks_file, self._transactions_file, self._outputs_file,
+                       self._addresses_file, self._rel_block_tx_file, self._rel_tx_output_file,
+                       self._rel_input_file, self._rel_output_address_file]
+        if self._output_addresses is not None:
+            self._files.append(self._input_addresses_file)
         return self
 
     def __exit__(self, type, value, traceback):
@@ -52,11 +601,51 @@ class CSVDumpWriter:
         self._rel_tx_output_file.close()
         self._rel_input_file.close()
         self._rel_output_address_file.close()
+        if self._output_addresses is not None:
+            self._input_addresses_file.close()
+            self._output_addresses.close()
+        if self._output_ids is not None:
+            self._output_ids.close()
+        if self._deduplicate:
+            self._addresses.close()
+            self._transactions.close()
+
+    def _restore_digests(self, digest_set, filename):
+        with io.TextIOWrapper(open_reader(self._data_path(filename))) as f:
+            for row in csv.reader(f):
+                digest_set.add(row[0])
+
+    def _data_path(self, filename):
+        return self._get_path(filename) + SUFFIXES.get(self._compression, '')
+
+    def _open(self, filename, mode='a'):
+        if self._compression is None:
+            return open(self._data_path(filename), mode)
+        return CompressedWriter(self._data_path(filename), self._compression, mode)
+
+    def checkpoint(self, height, **properties):
+        """
+        Writes all data to disk and records the given block height (up
+        to which all blocks are written) together with the data file
+        sizes in the checkpoint manifest.
+
+        :param int height: last completely written block height
+        :param properties: further entries of the manifest
+        """
+        for f in self._files:
+            f.flush()
+            os.fsync(f.fileno())
+        offsets = {os.path.basename(f.name): os.path.getsize(f.name) for f in self._files}
+        checkpoint = dict(properties, height=height, offsets=offsets)
+        write_checkpoint(self._output_path, checkpoint)
+        return checkpoint
 
     def _write_header(self, filename, row):
         if self._separate_header:
-            filename += '_header'
-        with open(self._get_path(filename), 'w') as f:
+            header_file = open(self._get_path(filename + '_header'), 'w')
+        else:
+            header_file = self._open(filename, 'w')
+        with header_file as f:
             writer = csv.writer(f)
             if self._plain_header:
                 header = [entry.partition(':')[0] for entry in row]
@@ -71,19 +660,71 @@ class CSVDumpWriter:
         def a_b(a, b):
             return '{}_{}'.format(a, b)
 
+        if self._output_ids is not None:
+            self._write_with_integer_ids(block)
+            return
+
         self._block_writer.writerow([block.hash, block.height, block.timestamp])
         for tx in block.transactions:
-            self._transaction_writer.writerow([tx.txid, tx.is_coinbase()])
+            is_new = not self._deduplicate or self._transactions.add(tx.txid)
+            if is_new:
+                self._transaction_writer.writerow([tx.txid, tx.is_coinbase()])
             self._rel_block_tx_writer.writerow([block.hash, tx.txid])
             if not tx.is_coinbase():
                 for input in tx.inputs:
                     self._rel_input_writer.writerow(
                         [tx.txid,
                          a_b(input.output_reference['txid'], input.output_reference['vout'])])
+                    if self._output_addresses is not None:
+                        address = self._output_addresses.spend(
+                            input.output_reference['txid'], input.output_reference['vout'])
+                        if address is not None:
+                            self._input_address_writer.writerow([tx.txid, address])
             for output in tx.outputs:
+                if self._output_addresses is not None:
+                    self._output_addresses.add(tx.txid, output.index, output.addresses)
+                if not is_new:
+                    continue
                 self._output_writer.writerow([a_b(tx.txid, output.index), output.index,
                                               output.value, output.type])
                 self._rel_tx_output_writer.writerow([tx.txid, a_b(tx.txid, output.index)])
                 for address in output.addresses:
-                    self._address_writer.writerow([address])
+                    if not self._deduplicate or self._addresses.add(address):
+                        self._address_writer.writerow([address])
                     self._rel_output_address_writer.writerow([a_b(tx.txid, output.index), address])
+
+    def _write_with_integer_ids(self, block):
+        self._block_writer.writerow([block.hash, block.height, block.timestamp])
+        for tx in block.transactions:
+            tx_id = self._transaction_count
+            self._transaction_count += 1
+            self._transaction_writer.writerow([tx_id, tx.txid, tx.is_coinbase()])
+            self._rel_block_tx_writer.writerow([block.hash, tx_id])
+            if not tx.is_coinbase():
+                for input in tx.inputs:
+                    reference = input.output_reference
+                    output_id = self._output_ids.spend(reference['txid'], reference['vout'])
+                    # outputs of blocks before the export cannot be referenced
+                    if output_id is not None:
+                        self._rel_input_writer.writerow([tx_id, output_id])
+                    if self._output_addresses is not None:
+                        address = self._output_addresses.spend(reference['txid'],
+                                                               reference['vout'])
+                        if address is not None:
+                            self._input_address_writer.writerow([tx.txid, address])
+            first_output_id = self._output_count
+            self._output_count += len(tx.outputs)
+            # unspendable outputs would keep the transaction in the store forever
+            self._output_ids.add(tx.txid, first_output_id,
+                                 sum(output.type != 'nulldata' for output in tx.outputs))
+            for output in tx.outputs:
+                if self._output_addresses is not None:
+                    self._output_addresses.add(tx.txid, output.index, output.addresses)
+                output_id = first_output_id + output.index
+                self._output_writer.writerow([output_id, '{}_{}'.format(tx.txid, output.index),
+                                              output.index, output.value, output.type])
+                self._rel_tx_output_writer.writerow([tx_id, output_id])
+                for address in output.addresses:
+                    if not self._deduplicate or self._addresses.add(address):
+                        self._address_writer.writerow([address])
+                    self._rel_output_address_writer.writerow([output_id, address])
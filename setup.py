@@ -51,6 +51,7 @@ setup(
     packages=['bitcoingraph'],
     scripts=['scripts/bcgraph-export',
              'scripts/bcgraph-compute-entities',
+             'scripts/bcgraph-update-entities',
              'scripts/bcgraph-synchronize'],
     platforms='any',
     install_requires=['requests>=2.5.0'],
@@ -71,6 +72,7 @@ setup(
     cmdclass={'test': PyTest},
     extras_require={
         'testing': ['pytest'],
+        'parquet': ['pyarrow'],
     },
 
     # Legal info
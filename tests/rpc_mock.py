@@ -3,6 +3,7 @@ from bitcoingraph.bitcoind import BitcoinProxy, BitcoindException
 from pathlib import Path
 
 import json
+import struct
 
 
 TEST_DATA_PATH = "tests/data"
@@ -15,6 +16,8 @@ class BitcoinProxyMock(BitcoinProxy):
         self.heights = {}
         self.blocks = {}
         self.txs = {}
+        self.batch_requests = 0
+        self.transaction_requests = 0
         self.load_testdata()
 
     # Load test data into local dicts
@@ -36,13 +39,35 @@ class BitcoinProxyMock(BitcoinProxy):
                     raw_block = json.load(jf)
                     self.txs[tx_hash] = raw_block
 
+    def getrawblock(self, block_hash):
+        """
+        Serializes a block from the block and transaction test data.
+        """
+        raw_block = self.blocks[block_hash]
+        header = struct.pack('<I', raw_block['version'])
+        header += bytes.fromhex(raw_block['previousblockhash'])[::-1]
+        header += bytes.fromhex(raw_block['merkleroot'])[::-1]
+        header += struct.pack('<III', raw_block['time'], int(raw_block['bits'], 16),
+                              raw_block['nonce'])
+        txs = b''.join(bytes.fromhex(self.txs[tx_id]['hex']) for tx_id in raw_block['tx'])
+        return header + bytes([len(raw_block['tx'])]) + txs
+
     # Override production proxy methods
 
-    def getblock(self, block_hash):
+    def getblock(self, block_hash, verbosity=None):
         if block_hash not in self.blocks:
             raise BitcoindException("Unknown block", block_hash)
-        else:
+        elif verbosity is None or verbosity < 2:
             return self.blocks[block_hash]
+        else:
+            # the transactions of some blocks are not part of the test data
+            block = dict(self.blocks[block_hash])
+            block['tx'] = [self.txs.get(tx_id, tx_id) for tx_id in block['tx']]
+            return block
+
+    def getblocks(self, block_hashes, verbosity=None):
+        self.batch_requests += 1
+        return [self.getblock(block_hash, verbosity) for block_hash in block_hashes]
 
     def getblockcount(self):
         return max(self.heights.keys())
@@ -53,10 +78,15 @@ class BitcoinProxyMock(BitcoinProxy):
         else:
             return self.heights[block_height]
 
+    def getblockhashes(self, heights):
+        self.batch_requests += 1
+        return [self.getblockhash(height) for height in heights]
+
     def getinfo(self):
         print("No info")
 
     def getrawtransaction(self, tx_id, verbose=1):
+        self.transaction_requests += 1
         if tx_id not in self.txs:
             raise BitcoindException("Unknown transaction", tx_id)
         else:
@@ -0,0 +1,92 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph.aggregates import compute_address_aggregates
+from bitcoingraph.bitcoingraph import compute_entities
+from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.entities import AddressTable
+from bitcoingraph.model import Block
+from bitcoingraph.writer import CSVDumpWriter
+
+
+def output(value, addresses):
+    return {'value': value, 'scriptPubKey': {'type': 'pubkeyhash', 'addresses': addresses}}
+
+
+def tx(txid, inputs, outputs):
+    return {'txid': txid, 'vin': [{'txid': input_txid, 'vout': vout}
+                                  for input_txid, vout in inputs] or [{'coinbase': ''}],
+            'vout': [output(value, addresses) for value, addresses in outputs]}
+
+
+def write_blocks(path, blocks):
+    blockchain = Blockchain(BitcoinProxyMock())
+    with CSVDumpWriter(path) as writer:
+        for block in blocks:
+            writer.write(Block(blockchain, json_data=block))
+
+
+class TestAddressAggregates(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        blocks = [
+            {'hash': 'b1', 'height': 1, 'time': 100, 'tx': [
+                tx('a1', [], [(50.0, ['1A'])])]},
+            {'hash': 'b2', 'height': 2, 'time': 200, 'tx': [
+                tx('a2', [], [(50.0, ['1B'])]),
+                tx('a3', [('a1', 0)], [(30.0, ['1B']), (20.0, ['1A'])])]},
+            {'hash': 'b3', 'height': 3, 'time': 150, 'tx': [
+                tx('a4', [], [(50.0, ['1C', '1D'])]),
+                tx('a5', [('a3', 0), ('a2', 0)], [(80.0, ['1C'])])]}]
+        write_blocks(self.path, blocks)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_csv(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return list(csv.reader(f))
+
+    def test_aggregates(self):
+        compute_address_aggregates(self.path)
+        self.assertEqual(self.read_csv('addresses.csv'), [
+            ['1A', '2', '100', '200', '50.0', '20.0'],
+            ['1B', '3', '150', '200', '80.0', '0.0'],
+            ['1C', '2', '150', '150', '130.0', '130.0'],
+            ['1D', '1', '150', '150', '50.0', '50.0']])
+        self.assertEqual(self.read_csv('addresses_header.csv'), [
+            ['address:ID(Address)', 'tx_count:int', 'first_timestamp:int',
+             'last_timestamp:int', 'total_received:double', 'unspent:double']])
+        self.assertEqual(sorted(os.listdir(self.path)), sorted(
+            name + suffix for name in ['blocks', 'transactions', 'outputs', 'addresses',
+                                       'rel_block_tx', 'rel_tx_output', 'rel_input',
+                                       'rel_output_address']
+            for suffix in ['.csv', '_header.csv']))
+
+    def test_address_table(self):
+        compute_address_aggregates(self.path, plain_header=True)
+        table = AddressTable.from_file(os.path.join(self.path, 'addresses.csv'))
+        self.assertEqual([table.address(i) for i in range(len(table))],
+                         ['1A', '1B', '1C', '1D'])
+
+    def test_entities(self):
+        shutil.rmtree(self.path)
+        blocks = [
+            {'hash': 'b1', 'height': 1, 'time': 100, 'tx': [
+                tx('c1', [], [(10.0, ['1A']), (10.0, ['1C']), (10.0, ['1B'])])]},
+            {'hash': 'b2', 'height': 2, 'time': 200, 'tx': [
+                tx('c2', [], [(50.0, ['1D'])]),
+                tx('aa', [('c1', 0), ('c1', 2)], [(20.0, ['1E'])]),
+                tx('ab', [('c1', 1)], [(10.0, ['1F'])])]}]
+        write_blocks(self.path, blocks)
+        compute_address_aggregates(self.path)
+        compute_entities(self.path, hash_index=True)
+        entities = dict(self.read_csv('rel_address_entity.csv')[1:])
+        self.assertEqual(entities['1A'], entities['1B'])
+        self.assertNotEqual(entities['1A'], entities['1C'])
@@ -0,0 +1,79 @@
+import binascii
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph.bitcoind import BitcoinProxy, BitcoindException
+
+BH2 = "000000000003ba27aa200b1cecaad478d2b00432346c3f1f3986da1afd33e506"
+
+
+class JSONRPCInterfaceMock:
+
+    def __init__(self, results):
+        self.results = results
+        self.requests = []
+
+    def batch(self, calls):
+        self.requests.append(calls)
+        return [{'id': call['id'], 'result': self.results[call['params'][0]], 'error': None}
+                for call in reversed(calls)]
+
+
+class TestBitcoinProxyBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.bitcoin_proxy = BitcoinProxy('localhost', 8332)
+        self.rpc = JSONRPCInterfaceMock({1: 'hash1', 2: 'hash2', 3: 'hash3'})
+        self.bitcoin_proxy._jsonrpc_proxy = self.rpc
+
+    def test_single_request(self):
+        self.bitcoin_proxy.getblockhashes([1, 2, 3])
+        self.assertEqual(len(self.rpc.requests), 1)
+        self.assertEqual([call['method'] for call in self.rpc.requests[0]],
+                         ['getblockhash'] * 3)
+
+    def test_result_order(self):
+        self.assertEqual(self.bitcoin_proxy.getblockhashes([3, 1, 2]),
+                         ['hash3', 'hash1', 'hash2'])
+
+    def test_empty(self):
+        self.assertEqual(self.bitcoin_proxy.getblockhashes([]), [])
+        self.assertEqual(len(self.rpc.requests), 0)
+
+    def test_error(self):
+        self.rpc.batch = lambda calls: [{'id': 0, 'result': None,
+                                         'error': {'code': -8, 'message': 'out of range'}}]
+        with self.assertRaises(BitcoindException) as cm:
+            self.bitcoin_proxy.getblockhashes([4])
+        self.assertEqual(cm.exception.code, -8)
+
+
+class BinaryJSONRPCInterfaceMock:
+
+    def __init__(self):
+        self.data = BitcoinProxyMock()
+
+    def call(self, method, *params):
+        if method == 'getblock':
+            self.verbosity = params[1]
+            return binascii.hexlify(self.data.getrawblock(params[0])).decode()
+        elif method == 'getblockheader':
+            block = self.data.getblock(params[0])
+            return {key: block[key] for key in ['hash', 'height', 'nextblockhash']}
+
+
+class TestBitcoinProxyBinary(unittest.TestCase):
+
+    def setUp(self):
+        self.bitcoin_proxy = BitcoinProxy('localhost', 8332, method='RPC_BINARY')
+        self.rpc = BinaryJSONRPCInterfaceMock()
+        self.bitcoin_proxy._jsonrpc_proxy = self.rpc
+
+    def test_getblock(self):
+        block = self.bitcoin_proxy.getblock(BH2)
+        expected = self.rpc.data.getblock(BH2)
+        self.assertEqual(self.rpc.verbosity, 0)
+        for key in ['hash', 'height', 'time', 'previousblockhash', 'nextblockhash']:
+            self.assertEqual(block[key], expected[key])
+        self.assertEqual([tx['txid'] for tx in block['tx']], expected['tx'])
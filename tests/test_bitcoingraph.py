@@ -0,0 +1,239 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+from tests.test_blockfiles import BH1, BH1_HEIGHT, BH2, block_record
+
+import bitcoingraph.bitcoingraph
+from bitcoingraph.bitcoingraph import BitcoinGraph, BitcoingraphException
+from bitcoingraph.compression import open_reader
+from bitcoingraph.helper import sort
+from bitcoingraph.writer import CSVDumpWriter, read_checkpoint, write_checkpoint
+
+
+class TestBitcoinGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.blocks_dir = tempfile.mkdtemp()
+        data = BitcoinProxyMock()
+        with open(os.path.join(self.blocks_dir, 'blk00000.dat'), 'wb') as f:
+            f.write(block_record(data.getrawblock(BH1)) + block_record(data.getrawblock(BH2)))
+
+    def tearDown(self):
+        shutil.rmtree(self.blocks_dir)
+
+    def bitcoin_graph(self, **config):
+        config.setdefault('base_height', BH1_HEIGHT)
+        config.update(blocks_dir=self.blocks_dir)
+        return BitcoinGraph(blockchain=config)
+
+    def test_export(self):
+        output_path = os.path.join(self.blocks_dir, 'export')
+        bcgraph = self.bitcoin_graph()
+        bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path, separate_header=False)
+        with open(os.path.join(output_path, 'blocks.csv')) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_export_workers(self):
+        bcgraph = self.bitcoin_graph()
+        outputs = []
+        for workers in [None, 2]:
+            output_path = os.path.join(self.blocks_dir, 'export_{}'.format(workers))
+            bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path, workers=workers)
+            files = {}
+            for filename in os.listdir(output_path):
+                with open(os.path.join(output_path, filename)) as f:
+                    files[filename] = f.read()
+            outputs.append(files)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(len(outputs[1]), 16)
+
+    def test_export_workers_cached(self):
+        cache_path = os.path.join(self.blocks_dir, 'cache')
+        bcgraph = self.bitcoin_graph(cache_path=cache_path)
+        bcgraph.blockchain.get_block_by_height(BH1_HEIGHT)
+        output_path = os.path.join(self.blocks_dir, 'export')
+        bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path, workers=2)
+        with open(os.path.join(output_path, 'blocks.csv')) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_export_writer_deduplication(self):
+        bcgraph = self.bitcoin_graph()
+        outputs = []
+        for deduplicate in [False, True]:
+            output_path = os.path.join(self.blocks_dir, 'export_{}'.format(deduplicate))
+            bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path,
+                           deduplicate_in_writer=deduplicate)
+            files = {}
+            for filename in os.listdir(output_path):
+                with open(os.path.join(output_path, filename)) as f:
+                    files[filename] = sorted(f)
+            outputs.append(files)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_export_compressed(self):
+        bcgraph = self.bitcoin_graph()
+        outputs = []
+        for compression, workers in [(None, None), ('gzip', None), ('gzip', 2)]:
+            output_path = os.path.join(self.blocks_dir,
+                                       'export_{}_{}'.format(compression, workers))
+            bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path, workers=workers,
+                           compression=compression)
+            files = {}
+            for filename in os.listdir(output_path):
+                with open_reader(os.path.join(output_path, filename)) as f:
+                    files[filename.replace('.gz', '')] = f.read()
+            outputs.append(files)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertIn('addresses.csv.gz',
+                      os.listdir(os.path.join(self.blocks_dir, 'export_gzip_None')))
+
+    def test_export_integer_ids(self):
+        sorted_files = []
+
+        def record_sort(path, filename, *options):
+            sorted_files.append(filename)
+            sort(path, filename, *options)
+
+        bcgraph = self.bitcoin_graph(base_height=0)
+        output_path = os.path.join(self.blocks_dir, 'export')
+        bitcoingraph.bitcoingraph.sort = record_sort
+        try:
+            bcgraph.export(0, 1, output_path, integer_ids=True)
+        finally:
+            bitcoingraph.bitcoingraph.sort = sort
+        self.assertEqual(sorted_files, ['addresses.csv'])
+        with open(os.path.join(output_path, 'transactions.csv')) as f:
+            self.assertEqual([line.split(',')[0] for line in f], ['0', '1', '2', '3', '4'])
+
+    def test_export_resume(self):
+        bcgraph = self.bitcoin_graph()
+        for compression, deduplicate in [(None, False), ('gzip', True)]:
+            outputs = []
+            for resume in [False, True]:
+                output_path = os.path.join(self.blocks_dir, 'export_{}_{}_{}'.format(
+                    compression, deduplicate, resume))
+                if resume:
+                    # interrupted after a checkpoint at the first block
+                    with CSVDumpWriter(output_path, deduplicate=deduplicate,
+                                       compression=compression) as writer:
+                        writer.checkpoint(BH1_HEIGHT - 1, start=BH1_HEIGHT, end=BH1_HEIGHT + 1)
+                        writer.write(bcgraph.blockchain.get_block_by_height(BH1_HEIGHT))
+                        writer.checkpoint(BH1_HEIGHT, start=BH1_HEIGHT, end=BH1_HEIGHT + 1)
+                        writer.write(bcgraph.blockchain.get_block_by_height(BH1_HEIGHT + 1))
+                bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path,
+                               deduplicate_in_writer=deduplicate, compression=compression,
+                               resume=resume)
+                files = {}
+                for filename in os.listdir(output_path):
+                    with open_reader(os.path.join(output_path, filename)) as f:
+                        files[filename] = f.read()
+                outputs.append(files)
+            self.assertEqual(outputs[0], outputs[1])
+
+    def test_export_resume_other_range(self):
+        bcgraph = self.bitcoin_graph()
+        output_path = os.path.join(self.blocks_dir, 'export')
+        with CSVDumpWriter(output_path) as writer:
+            writer.checkpoint(BH1_HEIGHT - 1, start=BH1_HEIGHT, end=BH1_HEIGHT + 1)
+        with self.assertRaises(ValueError):
+            bcgraph.export(BH1_HEIGHT, BH1_HEIGHT, output_path, resume=True)
+
+    def test_export_resume_while_sorting(self):
+        bcgraph = self.bitcoin_graph()
+        outputs = []
+        for interrupted in [False, True]:
+            output_path = os.path.join(self.blocks_dir, 'export_{}'.format(interrupted))
+            if interrupted:
+                with CSVDumpWriter(output_path) as writer:
+                    for height in [BH1_HEIGHT, BH1_HEIGHT + 1]:
+                        writer.write(bcgraph.blockchain.get_block_by_height(height))
+                    writer.checkpoint(BH1_HEIGHT + 1, start=BH1_HEIGHT, end=BH1_HEIGHT + 1)
+                write_checkpoint(output_path, dict(read_checkpoint(output_path), sorting=True))
+            bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path, resume=interrupted)
+            files = {}
+            for filename in os.listdir(output_path):
+                with open(os.path.join(output_path, filename)) as f:
+                    files[filename] = f.read()
+            outputs.append(files)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_export_checkpoint_input_addresses(self):
+        bcgraph = self.bitcoin_graph(base_height=0)
+        output_path = os.path.join(self.blocks_dir, 'export')
+        for options in [{'input_addresses': True}, {'integer_ids': True}]:
+            with self.assertRaises(ValueError):
+                bcgraph.export(0, 1, output_path, checkpoint_interval=1, **options)
+        self.assertFalse(os.path.exists(output_path))
+
+    def test_export_from_genesis(self):
+        bcgraph = self.bitcoin_graph()
+        output_path = os.path.join(self.blocks_dir, 'export')
+        for option in ['input_addresses', 'integer_ids', 'address_aggregates']:
+            with self.assertRaises(ValueError):
+                bcgraph.export(BH1_HEIGHT, BH1_HEIGHT + 1, output_path, **{option: True})
+        self.assertFalse(os.path.exists(output_path))
+
+    def test_synchronize_pipeline(self):
+        bcgraph = self.bitcoin_graph()
+        bcgraph.graph_db = GraphControllerMock()
+        blocks = bcgraph.blockchain.get_blocks_in_range(BH1_HEIGHT, BH1_HEIGHT + 1)
+        fractions = []
+        bcgraph._synchronize_blocks(blocks, BH1_HEIGHT, BH1_HEIGHT + 1, 1, fractions.append)
+        self.assertEqual(bcgraph.graph_db.committed, [BH1_HEIGHT, BH1_HEIGHT + 1])
+        self.assertEqual(bcgraph.graph_db.entities,
+                         [[tx.txid for tx in block.transactions]
+                          for block in bcgraph.blockchain.get_blocks_in_range(BH1_HEIGHT,
+                                                                              BH1_HEIGHT + 1)])
+        self.assertEqual(bcgraph.graph_db.events, ['commit', 'entities'] * 2)
+        self.assertEqual(fractions, [0.5, 1.0])
+
+    def test_synchronize_pipeline_failure(self):
+        bcgraph = self.bitcoin_graph()
+        bcgraph.graph_db = GraphControllerMock(BH1_HEIGHT + 1)
+        blocks = bcgraph.blockchain.get_blocks_in_range(BH1_HEIGHT, BH1_HEIGHT + 1)
+        with self.assertRaises(BitcoingraphException) as context:
+            bcgraph._synchronize_blocks(blocks, BH1_HEIGHT, BH1_HEIGHT + 1, 1)
+        self.assertEqual(str(context.exception),
+                         'Synchronisation stopped after block {}'.format(BH1_HEIGHT))
+        self.assertEqual(bcgraph.graph_db.committed, [BH1_HEIGHT])
+        self.assertEqual(len(bcgraph.graph_db.entities), 1)
+
+    def test_synchronize_pipeline_entity_failure(self):
+        bcgraph = self.bitcoin_graph()
+        bcgraph.graph_db = GraphControllerMock(failing_entities_height=BH1_HEIGHT + 1)
+        blocks = bcgraph.blockchain.get_blocks_in_range(BH1_HEIGHT, BH1_HEIGHT + 1)
+        with self.assertRaises(BitcoingraphException) as context:
+            bcgraph._synchronize_blocks(blocks, BH1_HEIGHT, BH1_HEIGHT + 1, 1)
+        self.assertEqual(str(context.exception),
+                         'Synchronisation stopped after block {}, entities of block {} are '
+                         'missing'.format(BH1_HEIGHT, BH1_HEIGHT + 1))
+
+
+class GraphControllerMock:
+
+    def __init__(self, failing_height=None, failing_entities_height=None):
+        self.failing_height = failing_height
+        self.failing_entities_height = failing_entities_height
+        self.committed = []
+        self.entities = []
+        self.events = []
+
+    def prepare_block(self, block):
+        return {'height': block.height,
+                'transactions': [{'txid': tx.txid} for tx in block.transactions]}
+
+    def commit_block(self, parameters):
+        if parameters['height'] == self.failing_height:
+            raise Exception('commit failed')
+        self.committed.append(parameters['height'])
+        self.events.append('commit')
+
+    def create_entities(self, txids):
+        if self.committed[-1] == self.failing_entities_height:
+            raise Exception('entity creation failed')
+        self.entities.append(txids)
+        self.events.append('entities')
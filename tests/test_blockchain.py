@@ -2,6 +2,7 @@ import unittest
 
 from tests.rpc_mock import BitcoinProxyMock
 
+from bitcoingraph.bitcoind import BitcoindException, RPC_INVALID_PARAMETER
 from bitcoingraph.blockchain import Blockchain, BlockchainException
 from bitcoingraph.model import Input, Output
 
@@ -222,6 +223,48 @@ class TestBlockchain(TestBlockchainObject):
         self.assertEqual(blocks[1].height, 100000)
         self.assertEqual(blocks[2].height, 100001)
 
+    def test_get_blocks_in_range_batched(self):
+        blocks = [block for block in self.blockchain.get_blocks_in_range(
+                  99999, 100001, batch_size=2)]
+        self.assertEqual([block.height for block in blocks], [99999, 100000, 100001])
+        self.assertEqual(self.bitcoin_proxy.batch_requests, 4)
+
+    def test_get_blocks_in_range_batched_beyond_tip(self):
+        blocks = [block for block in self.blockchain.get_blocks_in_range(
+                  100000, 100005, batch_size=10)]
+        self.assertEqual([block.height for block in blocks], [100000, 100001])
+        self.assertEqual(self.bitcoin_proxy.batch_requests, 2)
+
+    def test_get_blocks_in_range_prefetched(self):
+        blocks = [block for block in self.blockchain.get_blocks_in_range(
+                  99999, 100000, lookahead=4)]
+        self.assertEqual([block.height for block in blocks], [99999, 100000])
+        self.assertEqual(len(blocks[1].transactions[1].outputs), 2)
+
+    def test_get_blocks_in_range_prefetched_batches(self):
+        blocks = [block for block in self.blockchain.get_blocks_in_range(
+                  99999, 100000, batch_size=1, lookahead=1)]
+        self.assertEqual([block.height for block in blocks], [99999, 100000])
+
+    def test_get_blocks_in_range_prefetched_batches_beyond_lookahead(self):
+        blocks = [block for block in self.blockchain.get_blocks_in_range(
+                  99999, 100000, batch_size=2, lookahead=1)]
+        self.assertEqual([block.height for block in blocks], [99999, 100000])
+        # two windows of one block
+        self.assertEqual(self.bitcoin_proxy.batch_requests, 2 * 2)
+
+    def test_get_blocks_in_range_transactions(self):
+        for options in [{'batch_size': 2}, {'lookahead': 2}, {'batch_size': 2, 'lookahead': 2}]:
+            blocks = list(self.blockchain.get_blocks_in_range(99999, 100000, **options))
+            self.assertEqual(sum(len(tx.outputs) for block in blocks
+                                 for tx in block.transactions), 7)
+        self.assertEqual(self.bitcoin_proxy.transaction_requests, 0)
+
+    def test_get_blocks_in_range_prefetched_early_stop(self):
+        blocks = self.blockchain.get_blocks_in_range(99999, 100000, lookahead=2)
+        self.assertEqual(next(blocks).height, 99999)
+        blocks.close()
+
     def test_get_transaction(self):
         tx = self.blockchain.get_transaction(TX1)
         self.assertEqual(tx.txid, TX1)
@@ -249,3 +292,143 @@ class TestBlockchain(TestBlockchainObject):
             self.blockchain.get_transaction("bb")
         self.assertEqual("Cannot retrieve transaction with id bb",
                          cm.exception.msg)
+
+
+class PrevoutBitcoinProxyMock(BitcoinProxyMock):
+
+    def __init__(self, supports_prevouts):
+        super().__init__()
+        self.supports_prevouts = supports_prevouts
+        self.failures = 0
+
+    def getblock(self, block_hash, verbosity=None):
+        if verbosity is None or verbosity < 3:
+            return super().getblock(block_hash, verbosity)
+        block = super().getblock(block_hash)
+        if self.failures:
+            self.failures -= 1
+            raise BitcoindException("Loading block index...", code=-28)
+        if not self.supports_prevouts:
+            raise BitcoindException("Verbosity must be in range 0..2",
+                                    code=RPC_INVALID_PARAMETER)
+        block = dict(block)
+        block['tx'] = [self._with_prevouts(self.txs[tx_id]) for tx_id in block['tx']]
+        return block
+
+    def _with_prevouts(self, tx):
+        tx = dict(tx)
+        tx['vin'] = [dict(vin, prevout=self.txs[vin['txid']]['vout'][vin['vout']])
+                     if 'txid' in vin else vin for vin in tx['vin']]
+        return tx
+
+    def getrawtransactions(self, tx_ids, verbose=1):
+        self.batch_requests += 1
+        return [self.txs[tx_id] for tx_id in tx_ids]
+
+
+class TestPrevoutResolution(unittest.TestCase):
+
+    def assertResolved(self, block):
+        self.assertTrue(all(input.is_resolved() for tx in block.transactions
+                            for input in tx.inputs))
+        tx = [tx for tx in block.transactions if tx.txid == TX2][0]
+        self.assertEqual(tx.input_sum(), 50)
+        self.assertEqual(tx.inputs[0].output.addresses, ["1BNwxHGaFbeUBitpjy2AsKpJ29Ybxntqvb"])
+
+    def test_getblock_verbosity(self):
+        bitcoin_proxy = PrevoutBitcoinProxyMock(True)
+        blockchain = Blockchain(bitcoin_proxy, resolve_prevouts=True)
+        block = blockchain.get_block_by_hash(BH2)
+        self.assertResolved(block)
+        self.assertEqual(bitcoin_proxy.transaction_requests, 0)
+
+    def test_batch_fallback(self):
+        bitcoin_proxy = PrevoutBitcoinProxyMock(False)
+        blockchain = Blockchain(bitcoin_proxy, resolve_prevouts=True)
+        block = blockchain.get_block_by_hash(BH2)
+        self.assertResolved(block)
+        self.assertEqual(bitcoin_proxy.transaction_requests, 0)
+        # failed and repeated getblock, spent transactions
+        self.assertEqual(bitcoin_proxy.batch_requests, 2 + 1)
+
+    def test_transient_error(self):
+        bitcoin_proxy = PrevoutBitcoinProxyMock(True)
+        bitcoin_proxy.failures = 1
+        blockchain = Blockchain(bitcoin_proxy, resolve_prevouts=True)
+        with self.assertRaises(BlockchainException):
+            blockchain.get_block_by_hash(BH2)
+        self.assertResolved(blockchain.get_block_by_hash(BH2))
+        self.assertEqual(bitcoin_proxy.transaction_requests, 0)
+        # failed and successful getblock
+        self.assertEqual(bitcoin_proxy.batch_requests, 2)
+
+    def test_batch_size(self):
+        bitcoin_proxy = PrevoutBitcoinProxyMock(False)
+        blockchain = Blockchain(bitcoin_proxy, resolve_prevouts=True, prevout_batch_size=2)
+        blocks = list(blockchain.get_blocks_in_range(99999, 100000, batch_size=2))
+        self.assertResolved(blocks[1])
+        # getblockhash, failed and repeated getblock, 3 spent transactions
+        self.assertEqual(bitcoin_proxy.batch_requests, 1 + 2 + 2)
+
+
+class TestObjectCache(unittest.TestCase):
+
+    def setUp(self):
+        self.bitcoin_proxy = PrevoutBitcoinProxyMock(False)
+
+    def test_disabled(self):
+        blockchain = Blockchain(self.bitcoin_proxy)
+        self.assertIsNone(blockchain.cache_statistics())
+        blockchain.get_transaction(TX1)
+        blockchain.get_transaction(TX1)
+        self.assertEqual(self.bitcoin_proxy.transaction_requests, 2)
+
+    def test_get_transaction(self):
+        blockchain = Blockchain(self.bitcoin_proxy, cache_entries=10)
+        tx = blockchain.get_transaction(TX1)
+        self.assertIs(blockchain.get_transaction(TX1), tx)
+        self.assertEqual(self.bitcoin_proxy.transaction_requests, 1)
+        statistics = blockchain.cache_statistics()
+        self.assertEqual(statistics['hits'], 1)
+        self.assertEqual(statistics['misses'], 1)
+        self.assertEqual(statistics['entries'], 1)
+
+    def test_get_transactions(self):
+        blockchain = Blockchain(self.bitcoin_proxy, cache_entries=10)
+        blockchain.get_transaction(TX1)
+        txs = blockchain.get_transactions([TX1, TX2])
+        self.assertEqual([tx.txid for tx in txs], [TX1, TX2])
+        self.assertEqual(self.bitcoin_proxy.batch_requests, 1)
+        blockchain.get_transactions([TX2, TX1])
+        self.assertEqual(self.bitcoin_proxy.batch_requests, 1)
+
+    def test_populated_from_blocks(self):
+        blockchain = Blockchain(self.bitcoin_proxy, resolve_prevouts=True, cache_entries=100)
+        block = blockchain.get_block_by_hash(BH2)
+        requests = self.bitcoin_proxy.batch_requests
+        self.assertIs(blockchain.get_block_by_hash(BH2), block)
+        tx = [tx for tx in block.transactions if tx.txid == TX2][0]
+        self.assertIs(blockchain.get_transaction(TX2), tx)
+        self.assertEqual(self.bitcoin_proxy.batch_requests, requests)
+        self.assertEqual(self.bitcoin_proxy.transaction_requests, 0)
+
+    def test_entry_limit(self):
+        blockchain = Blockchain(self.bitcoin_proxy, cache_entries=2)
+        blockchain.get_transaction(TX1)
+        blockchain.get_transaction(TX2)
+        blockchain.get_transaction(TX1)
+        blockchain.get_transaction(TX3)
+        statistics = blockchain.cache_statistics()
+        self.assertEqual(statistics['evictions'], 1)
+        self.assertEqual(statistics['entries'], 2)
+        blockchain.get_transaction(TX1)
+        blockchain.get_transaction(TX2)
+        self.assertEqual(self.bitcoin_proxy.transaction_requests, 4)
+
+    def test_size_limit(self):
+        blockchain = Blockchain(self.bitcoin_proxy, cache_size=1)
+        blockchain.get_transaction(TX1)
+        statistics = blockchain.cache_statistics()
+        self.assertEqual(statistics['entries'], 0)
+        self.assertEqual(statistics['size'], 0)
+        self.assertEqual(statistics['evictions'], 1)
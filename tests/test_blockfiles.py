@@ -0,0 +1,105 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph.bitcoind import BitcoindException
+from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.blockfiles import BlockFileProxy, MAINNET_MAGIC
+
+BH1 = "000000000002d01c1fccc21636b607dfd930d31d01c3a62104612a1719011250"
+BH1_HEIGHT = 99999
+BH2 = "000000000003ba27aa200b1cecaad478d2b00432346c3f1f3986da1afd33e506"
+
+TX1 = "8c14f0db3df150123e6f3dbbf30f8b955a8249b62ac1d1ff16284aefa3d06d87"
+
+
+def stale_block(previous_block_hash):
+    header = struct.pack('<I', 1) + bytes.fromhex(previous_block_hash)[::-1]
+    header += bytes(32) + struct.pack('<III', 1293623000, 0x1b04864c, 0)
+    return header + b'\x00'
+
+
+def block_record(raw_block):
+    return MAINNET_MAGIC + struct.pack('<I', len(raw_block)) + raw_block
+
+
+class TestBlockFileProxy(unittest.TestCase):
+
+    xor_key = None
+
+    def setUp(self):
+        self.blocks_dir = tempfile.mkdtemp()
+        self.data = BitcoinProxyMock()
+        raw_blocks = [self.data.getrawblock(BH2),
+                      stale_block(self.data.getblock(BH1)['previousblockhash']),
+                      self.data.getrawblock(BH1)]
+        self.write_block_file(0, b''.join(block_record(b) for b in raw_blocks[:2]))
+        self.write_block_file(1, block_record(raw_blocks[2]) + bytes(100))
+        self.bitcoin_proxy = BlockFileProxy(self.blocks_dir, base_height=BH1_HEIGHT)
+        self.blockchain = Blockchain(self.bitcoin_proxy)
+
+    def write_block_file(self, number, data):
+        if self.xor_key is not None:
+            with open(os.path.join(self.blocks_dir, 'xor.dat'), 'wb') as f:
+                f.write(self.xor_key)
+            data = bytes(b ^ self.xor_key[i % len(self.xor_key)] for i, b in enumerate(data))
+        with open(os.path.join(self.blocks_dir, 'blk{:05d}.dat'.format(number)), 'wb') as f:
+            f.write(data)
+
+    def tearDown(self):
+        self.bitcoin_proxy.close()
+        shutil.rmtree(self.blocks_dir)
+
+    def test_main_chain(self):
+        self.assertEqual(self.bitcoin_proxy.getblockcount(), BH1_HEIGHT + 1)
+        self.assertEqual(self.bitcoin_proxy.getblockhash(BH1_HEIGHT), BH1)
+        self.assertEqual(self.bitcoin_proxy.getblockhash(BH1_HEIGHT + 1), BH2)
+
+    def test_getblock(self):
+        block = self.bitcoin_proxy.getblock(BH1)
+        self.assertEqual(block['height'], BH1_HEIGHT)
+        self.assertEqual(block['nextblockhash'], BH2)
+        self.assertNotIn('nextblockhash', self.bitcoin_proxy.getblock(BH2))
+
+    def test_blocks_in_range(self):
+        blocks = list(self.blockchain.get_blocks_in_range(BH1_HEIGHT, BH1_HEIGHT + 1))
+        self.assertEqual([block.hash for block in blocks], [BH1, BH2])
+        self.assertEqual(blocks[1].transactions[0].txid, TX1)
+        self.assertEqual(blocks[1].transactions[0].outputs[0].addresses,
+                         self.data.getrawtransaction(TX1)['vout'][0]['scriptPubKey']['addresses'])
+
+    def test_open_files(self):
+        proxy = BlockFileProxy(self.blocks_dir, base_height=BH1_HEIGHT, max_open_files=1)
+        self.assertEqual(len(proxy._files), 0)
+        self.assertEqual(proxy.getblock(BH1), self.bitcoin_proxy.getblock(BH1))
+        self.assertEqual(proxy.getblock(BH2), self.bitcoin_proxy.getblock(BH2))
+        self.assertEqual(len(proxy._files), 1)
+        proxy.close()
+
+    def test_index_range(self):
+        proxy = BlockFileProxy(self.blocks_dir, index=self.bitcoin_proxy.index_range(
+            BH1_HEIGHT, BH1_HEIGHT))
+        self.assertEqual(proxy.getblockhash(BH1_HEIGHT), BH1)
+        self.assertEqual(proxy.getblock(BH1), self.bitcoin_proxy.getblock(BH1))
+        proxy.close()
+        proxy = BlockFileProxy(self.blocks_dir, index=self.bitcoin_proxy.index_range(
+            BH1_HEIGHT + 1, BH1_HEIGHT + 1))
+        with self.assertRaises(BitcoindException):
+            proxy.getblock(BH1)
+        self.assertEqual(proxy.getblock(BH2), self.bitcoin_proxy.getblock(BH2))
+        proxy.close()
+
+    def test_unknown(self):
+        with self.assertRaises(BitcoindException):
+            self.bitcoin_proxy.getblockhash(BH1_HEIGHT + 2)
+        with self.assertRaises(BitcoindException):
+            self.bitcoin_proxy.getrawtransaction(TX1)
+
+
+class TestObfuscatedBlockFileProxy(TestBlockFileProxy):
+
+    xor_key = bytes.fromhex('0123456789abcdef')
@@ -0,0 +1,101 @@
+import shutil
+import tempfile
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.cache import BlockCache, CachedBitcoinProxy
+
+BH1 = "000000000002d01c1fccc21636b607dfd930d31d01c3a62104612a1719011250"
+BH2 = "000000000003ba27aa200b1cecaad478d2b00432346c3f1f3986da1afd33e506"
+BH3 = "00000000000080b66c911bd5ba14a74260057311eaeb1982802f7010f1a9f090"
+
+TX1 = "8c14f0db3df150123e6f3dbbf30f8b955a8249b62ac1d1ff16284aefa3d06d87"
+TX2 = "fff2525b8931402dd09222c50775608f75787bd2b87e56995a7bdd30f79702c4"
+
+
+class CountingBitcoinProxyMock(BitcoinProxyMock):
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    def getblock(self, block_hash, verbosity=None):
+        self.requests += 1
+        return super().getblock(block_hash, verbosity)
+
+    def getrawtransaction(self, tx_id, verbose=1):
+        self.requests += 1
+        return super().getrawtransaction(tx_id, verbose)
+
+
+class TestBlockCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.bitcoin_proxy = CountingBitcoinProxyMock()
+        self.cache = BlockCache(self.cache_path)
+        self.cached_proxy = CachedBitcoinProxy(self.bitcoin_proxy, self.cache)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.cache_path)
+
+    def test_block_hit(self):
+        self.cached_proxy.getblock(BH1)
+        block = self.cached_proxy.getblock(BH1)
+        self.assertEqual(block, self.bitcoin_proxy.getblock(BH1))
+        self.assertEqual(self.bitcoin_proxy.requests, 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self.cache.hit_rate(), 0.5)
+
+    def test_tip_not_cached(self):
+        self.cached_proxy.getblock(BH3)
+        self.cached_proxy.getblock(BH3)
+        self.assertEqual(self.bitcoin_proxy.requests, 2)
+
+    def test_height_index(self):
+        self.cached_proxy.getblocks([BH1, BH2])
+        self.assertEqual(self.cache.get_block_hash(99999), BH1)
+        self.assertEqual(self.cached_proxy.getblockhashes([99999, 100000, 100001]),
+                         [BH1, BH2, BH3])
+
+    def test_transaction_hit(self):
+        self.cached_proxy.getrawtransactions([TX1, TX2])
+        self.cached_proxy.getrawtransaction(TX1)
+        self.assertEqual(self.bitcoin_proxy.requests, 2)
+
+    def test_persistence(self):
+        self.cached_proxy.getblock(BH1)
+        self.cache.close()
+        self.cache = BlockCache(self.cache_path)
+        self.cached_proxy = CachedBitcoinProxy(self.bitcoin_proxy, self.cache)
+        self.cached_proxy.getblock(BH1)
+        self.assertEqual(self.bitcoin_proxy.requests, 1)
+
+    def test_read_only(self):
+        self.cached_proxy.getblock(BH1)
+        self.cache.commit()
+        cache = BlockCache(self.cache_path, read_only=True)
+        cached_proxy = CachedBitcoinProxy(self.bitcoin_proxy, cache)
+        cached_proxy.getblocks([BH1, BH2])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIsNone(cache.get_block(BH2))
+        cache.close()
+
+    def test_lru_eviction(self):
+        self.cached_proxy.getblock(BH1)
+        self.cached_proxy.getblock(BH2)
+        self.cache.max_size = self.cache._size - 1
+        self.cached_proxy.getblock(BH1)
+        self.cached_proxy.getrawtransaction(TX1)
+        self.assertIsNone(self.cache.get_block(BH2))
+        self.assertIsNotNone(self.cache.get_block(BH1))
+
+    def test_blockchain(self):
+        blockchain = Blockchain(self.cached_proxy)
+        for _ in range(2):
+            blocks = list(blockchain.get_blocks_in_range(99999, 100001, batch_size=3))
+            self.assertEqual(len(blocks), 3)
+        self.assertEqual(self.bitcoin_proxy.requests, 3 + 1)
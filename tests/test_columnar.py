@@ -0,0 +1,79 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph import columnar
+from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.columnar import ParquetDumpWriter, to_satoshi
+from bitcoingraph.serialization import to_hex
+from bitcoingraph.writer import CSVDumpWriter
+
+
+class TestToSatoshi(unittest.TestCase):
+
+    def test_to_satoshi(self):
+        self.assertEqual(to_satoshi(50.0), 5000000000)
+        self.assertEqual(to_satoshi(0.29), 29000000)
+        self.assertEqual(to_satoshi(0.00000001), 1)
+
+
+@unittest.skipIf(columnar.pyarrow is None, 'pyarrow is not installed')
+class TestParquetDumpWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.blockchain = Blockchain(BitcoinProxyMock())
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_parquet(self, name):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(
+            os.path.join(self.path, 'parquet', name + '.parquet')).to_pylist()
+
+    def read_csv(self, name):
+        with open(os.path.join(self.path, 'csv', name + '.csv')) as f:
+            return list(csv.reader(f))
+
+    def test_write(self):
+        block = self.blockchain.get_block_by_height(100000)
+        with ParquetDumpWriter(os.path.join(self.path, 'parquet'), row_group_size=2) as writer:
+            writer.write(block)
+        with CSVDumpWriter(os.path.join(self.path, 'csv')) as writer:
+            writer.write(block)
+        self.assertEqual(self.read_parquet('blocks'),
+                         [{'hash': bytes.fromhex(block.hash), 'height': 100000,
+                           'timestamp': block.timestamp}])
+        self.assertEqual([[to_hex(row['txid']), str(row['coinbase'])]
+                          for row in self.read_parquet('transactions')],
+                         self.read_csv('transactions'))
+        self.assertEqual([['{}_{}'.format(to_hex(row['txid']), row['n']), str(row['n']),
+                           row['value'], row['type']]
+                          for row in self.read_parquet('outputs')],
+                         [[txid_n, n, to_satoshi(float(value)), output_type]
+                          for txid_n, n, value, output_type in self.read_csv('outputs')])
+        self.assertEqual([['{}_{}'.format(to_hex(row['txid']), row['n']), row['address']]
+                          for row in self.read_parquet('rel_output_address')],
+                         self.read_csv('rel_output_address'))
+        self.assertEqual([[to_hex(row['txid']),
+                           '{}_{}'.format(to_hex(row['output_txid']), row['output_n'])]
+                          for row in self.read_parquet('rel_input')],
+                         self.read_csv('rel_input'))
+
+    def test_deduplicate(self):
+        block = self.blockchain.get_block_by_height(100000)
+        with ParquetDumpWriter(os.path.join(self.path, 'parquet'), deduplicate=True,
+                               deduplication_memory=1000) as writer:
+            writer.write(block)
+            writer.write(block)
+        self.assertEqual(len(self.read_parquet('transactions')), 4)
+        self.assertEqual(len(self.read_parquet('rel_block_tx')), 8)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, 'parquet'))), sorted(
+            name + '.parquet' for name in ['blocks', 'transactions', 'outputs', 'addresses',
+                                           'rel_block_tx', 'rel_tx_output', 'rel_input',
+                                           'rel_output_address']))
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bitcoingraph import compression
+from bitcoingraph.compression import CompressedWriter, compression_of, open_reader
+from bitcoingraph.helper import sort
+
+
+class TestCompressedWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self, filename):
+        with open_reader(os.path.join(self.path, filename)) as f:
+            return f.read().decode()
+
+    def test_compression_of(self):
+        self.assertEqual(compression_of('addresses.csv.gz'), 'gzip')
+        self.assertEqual(compression_of('addresses.csv.zst'), 'zstd')
+        self.assertIsNone(compression_of('addresses.csv'))
+
+    def test_round_trip(self):
+        lines = ['{},{}\n'.format(i, i * i) for i in range(10000)]
+        with CompressedWriter(os.path.join(self.path, 'a.csv.gz'), 'gzip',
+                              chunk_size=1000, max_chunks=2) as writer:
+            for line in lines:
+                writer.write(line)
+        self.assertEqual(self.read('a.csv.gz'), ''.join(lines))
+
+    def test_append(self):
+        file_path = os.path.join(self.path, 'a.csv.gz')
+        with CompressedWriter(file_path, 'gzip', 'w') as writer:
+            writer.write('header\n')
+        with CompressedWriter(file_path, 'gzip') as writer:
+            writer.write('a\n')
+            writer.write_bytes(b'b\n')
+            writer.write('c\n')
+        self.assertEqual(self.read('a.csv.gz'), 'header\na\nb\nc\n')
+
+    def test_flush(self):
+        file_path = os.path.join(self.path, 'a.csv.gz')
+        with CompressedWriter(file_path, 'gzip') as writer:
+            writer.write('a\n')
+            writer.flush()
+            size = os.path.getsize(file_path)
+            writer.write('b\n')
+        with open(file_path, 'r+b') as f:
+            f.truncate(size)
+        with CompressedWriter(file_path, 'gzip') as writer:
+            writer.write('c\n')
+        self.assertEqual(self.read('a.csv.gz'), 'a\nc\n')
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            CompressedWriter(os.path.join(self.path, 'a.csv.xz'), 'xz')
+
+    @unittest.skipIf(compression.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        file_path = os.path.join(self.path, 'a.csv.zst')
+        for text in ['a\n', 'b\n']:
+            with CompressedWriter(file_path, 'zstd') as writer:
+                writer.write(text)
+        self.assertEqual(self.read('a.csv.zst'), 'a\nb\n')
+
+    def test_sort(self):
+        with CompressedWriter(os.path.join(self.path, 'a.csv.gz'), 'gzip') as writer:
+            writer.write('c\na\nb\na\n')
+        sort(self.path, 'a.csv.gz', '-u')
+        self.assertEqual(self.read('a.csv.gz'), 'a\nb\nc\n')
+        self.assertEqual(os.listdir(self.path), ['a.csv.gz'])
+
+    def test_failed_sort(self):
+        with open(os.path.join(self.path, 'a.csv'), 'w') as f:
+            f.write('c\na\n')
+        with self.assertRaises(Exception):
+            sort(self.path, 'a.csv', '--no-such-option')
+        self.assertEqual(self.read('a.csv'), 'c\na\n')
+        self.assertEqual(os.listdir(self.path), ['a.csv'])
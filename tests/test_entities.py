@@ -0,0 +1,372 @@
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph import bitcoingraph, entities
+from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.entities import AddressTable, SortedCSVFile, UnionFind
+from bitcoingraph.model import Block
+from bitcoingraph.writer import CSVDumpWriter
+
+ADDRESSES = ['1A', '1Bb', '1C', '1Dddd', '1E', '1F']
+
+
+class TestAddressTable(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.address_path = os.path.join(self.path, 'addresses.csv')
+        with open(self.address_path, 'w') as f:
+            f.write('\n'.join(ADDRESSES) + '\n')
+        self.table = AddressTable.from_file(self.address_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_len(self):
+        self.assertEqual(len(self.table), len(ADDRESSES))
+        self.assertEqual(self.table.width, 5)
+
+    def test_memory_mapped(self):
+        table = AddressTable.from_file(self.address_path, os.path.join(self.path, 'table'))
+        self.assertEqual(table.index('1E'), 4)
+        table.close()
+        self.assertEqual(os.path.getsize(os.path.join(self.path, 'table')), 30)
+
+    def test_index(self):
+        for i, address in enumerate(ADDRESSES):
+            self.assertEqual(self.table.index(address), i)
+            self.assertEqual(self.table.address(i), address)
+
+    def test_unknown_address(self):
+        for address in ['1B', '1G', '0']:
+            with self.assertRaises(KeyError):
+                self.table.index(address)
+
+
+class TestUnionFind(unittest.TestCase):
+
+    def test_group(self):
+        union_find = UnionFind(6)
+        union_find.group([3, 1])
+        union_find.group([4, 5])
+        self.assertEqual(union_find.find(3), 1)
+        self.assertEqual(union_find.find(5), 4)
+        union_find.group([5, 2])
+        self.assertEqual(union_find.find(2), 4)
+        union_find.group([3, 5])
+        self.assertEqual({union_find.find(i) for i in [1, 2, 3, 4, 5]}, {1})
+        self.assertEqual(union_find.find(0), 0)
+        self.assertEqual(union_find.rank[1], 2)
+
+    def test_memory_mapped(self):
+        path = tempfile.mkdtemp()
+        try:
+            union_find = UnionFind(5, os.path.join(path, 'uf'))
+            union_find.group([4, 2, 3])
+            self.assertEqual([union_find.find(i) for i in range(5)], [0, 1, 2, 2, 2])
+            union_find.close()
+            self.assertEqual(os.path.getsize(os.path.join(path, 'uf.rank')), 5)
+        finally:
+            shutil.rmtree(path)
+
+    def test_entity(self):
+        union_find = UnionFind(6)
+        union_find.group([4, 5])
+        union_find.group([5, 2])
+        self.assertEqual(union_find.find(2), 4)
+        self.assertEqual([union_find.entity(i) for i in range(6)], [0, 1, 2, 3, 2, 2])
+        self.assertEqual(union_find.group([3, 4, 1]), {2, 3})
+        self.assertEqual([union_find.entity(i) for i in range(6)], [0, 1, 1, 1, 1, 1])
+
+    def test_path_compression(self):
+        union_find = UnionFind(4)
+        union_find.parent[3] = 2
+        union_find.parent[2] = 1
+        union_find.parent[1] = 0
+        self.assertEqual(union_find.find(3), 0)
+        self.assertEqual(list(union_find.parent), [0, 0, 0, 0])
+
+
+class TestComputeEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with open(os.path.join(self.path, 'addresses.csv'), 'w') as f:
+            f.write('\n'.join(ADDRESSES) + '\n')
+        with open(os.path.join(self.path, 'input_addresses.csv'), 'w') as f:
+            f.write('t1,1Bb\nt1,1Dddd\nt2,1E\nt3,1A\nt4,1E\nt4,1F\nt4,1Dddd\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_csv(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return list(csv.reader(f))
+
+    def test_compute_entities(self):
+        with redirect_stdout(io.StringIO()):
+            entities.compute_entities(self.path)
+        self.assertEqual(self.read_csv('entities.csv'),
+                         [['id:ID(Entity)'], ['0'], ['1'], ['2']])
+        self.assertEqual(self.read_csv('rel_address_entity.csv'),
+                         [[':START_ID(Address)', ':END_ID(Entity)'],
+                          ['1A', '0'], ['1Bb', '1'], ['1C', '2'], ['1Dddd', '1'],
+                          ['1E', '1'], ['1F', '1']])
+
+    def test_compute_entities_out_of_core(self):
+        with redirect_stdout(io.StringIO()):
+            entities.compute_entities(self.path)
+            expected = [self.read_csv('entities.csv'), self.read_csv('rel_address_entity.csv')]
+            entities.compute_entities(self.path, memory_limit=1024)
+        self.assertEqual([self.read_csv('entities.csv'),
+                          self.read_csv('rel_address_entity.csv')], expected)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['addresses.csv', 'entities.csv', 'input_addresses.csv',
+                          'rel_address_entity.csv'])
+
+
+class TestParallelEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        generator = random.Random(7)
+        addresses = sorted({'1' + ''.join(generator.choice('abcdefXYZ123')
+                                          for _ in range(generator.randint(3, 12)))
+                            for _ in range(400)})
+        rows = []
+        for number in range(300):
+            for address in sorted(set(generator.sample(addresses, generator.randint(1, 4)))):
+                rows.append('tx{:04d},{}'.format(number, address))
+        write_lines(self.path, 'addresses.csv', addresses)
+        write_lines(self.path, 'input_addresses.csv', rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def compute(self, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            entities.compute_entities(self.path, **kwargs)
+        result = []
+        for name in ['entities.csv', 'rel_address_entity.csv']:
+            with open(os.path.join(self.path, name)) as f:
+                result.append(f.read())
+        return result
+
+    def test_chunk_boundaries(self):
+        path = os.path.join(self.path, 'input_addresses.csv')
+        chunks = entities._chunk_boundaries(path, 7)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(path))
+        with open(path, 'rb') as f:
+            data = f.read()
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, start)
+            previous_line = data[:start].splitlines()[-1]
+            next_line = data[start:].splitlines()[0]
+            self.assertNotEqual(previous_line.split(b',')[0], next_line.split(b',')[0])
+
+    def test_same_output_as_serial(self):
+        expected = self.compute()
+        self.assertEqual(self.compute(workers=3), expected)
+        self.assertEqual(self.compute(workers=2, memory_limit=1024), expected)
+        self.assertNotIn('entities.addresses', os.listdir(self.path))
+
+
+def write_lines(path, name, lines):
+    with open(os.path.join(path, name), 'w', newline='') as f:
+        f.write(''.join(line + '\r\n' for line in lines))
+
+
+class TestSortedCSVFile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_lines(self.path, 'rows.csv',
+                    ['a_0,1A', 'a_1,1B', 'a_10,1C', 'a_10,1D', 'b_0,1E', 'c_5,1F'])
+        self.file = SortedCSVFile(os.path.join(self.path, 'rows.csv'))
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.path)
+
+    def test_find(self):
+        self.assertEqual(self.file.find('a_0'), ['1A'])
+        self.assertEqual(self.file.find('a_1'), ['1B'])
+        self.assertEqual(self.file.find('a_10'), ['1C', '1D'])
+        self.assertEqual(self.file.find('c_5'), ['1F'])
+
+    def test_find_missing(self):
+        for key in ['0', 'a', 'a_2', 'b_00', 'z']:
+            self.assertEqual(self.file.find(key), [])
+
+
+class TestUpdateEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.first = os.path.join(self.path, 'first')
+        self.second = os.path.join(self.path, 'second')
+        self.state = os.path.join(self.path, 'state')
+        os.makedirs(self.first)
+        os.makedirs(self.second)
+        write_lines(self.first, 'addresses.csv', ['1A', '1B', '1C', '1D'])
+        write_lines(self.first, 'rel_output_address.csv',
+                    ['a_0,1A', 'a_1,1B', 'b_0,1C', 'b_1,1D'])
+        write_lines(self.first, 'rel_input.csv', ['c,a_0', 'c,b_0'])
+        write_lines(self.first, 'input_addresses.csv', ['c,1A', 'c,1C'])
+        write_lines(self.second, 'addresses.csv', ['1B', '1E', '1F'])
+        write_lines(self.second, 'rel_output_address.csv', ['d_0,1E', 'd_1,1B', 'e_0,1F'])
+        write_lines(self.second, 'rel_input.csv',
+                    ['f,a_1', 'f,b_1', 'f,d_0', 'g,e_0', 'h,x_0', 'h,d_1'])
+        with redirect_stdout(io.StringIO()):
+            entities.compute_entities(self.first, state_path=self.state)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_csv(self, name):
+        with open(os.path.join(self.second, name)) as f:
+            return list(csv.reader(f))
+
+    def test_update(self):
+        with redirect_stdout(io.StringIO()):
+            entities.update_entities(self.state, self.second)
+        self.assertEqual(self.read_csv('entities.csv'), [['id:ID(Entity)'], ['5']])
+        self.assertEqual(self.read_csv('rel_address_entity.csv'),
+                         [[':START_ID(Address)', ':END_ID(Entity)'],
+                          ['1E', '1'], ['1F', '5']])
+        self.assertEqual(self.read_csv('entity_merges.csv'),
+                         [['entity', 'merged_into'], ['3', '1']])
+
+    def test_repeated_update(self):
+        third = os.path.join(self.path, 'third')
+        os.makedirs(third)
+        write_lines(third, 'addresses.csv', ['1G'])
+        write_lines(third, 'rel_output_address.csv', ['i_0,1G'])
+        write_lines(third, 'rel_input.csv', ['j,e_0', 'j,c_0', 'j,a_0', 'j,d_1', 'j,i_0'])
+        with redirect_stdout(io.StringIO()):
+            entities.update_entities(self.state, self.second)
+            entities.update_entities(self.state, third)
+        with open(os.path.join(third, 'entity_merges.csv')) as f:
+            self.assertEqual(list(csv.reader(f)),
+                             [['entity', 'merged_into'], ['1', '0'], ['5', '0']])
+        with open(os.path.join(third, 'rel_address_entity.csv')) as f:
+            self.assertEqual(list(csv.reader(f))[1:], [['1G', '0']])
+        with open(os.path.join(self.state, 'state.json')) as f:
+            self.assertEqual(len(json.load(f)['exports']), 3)
+
+
+def block(height, transactions):
+    return {'hash': 'b{}'.format(height), 'height': height, 'time': height, 'tx': [
+        {'txid': txid,
+         'vin': [{'txid': input_txid, 'vout': 0} for input_txid in inputs] or [{'coinbase': ''}],
+         'vout': [{'value': 1.0, 'scriptPubKey': {'type': 'pubkeyhash', 'addresses': [address]}}]}
+        for txid, inputs, address in transactions]}
+
+
+class TestUpdateAfterWriterDeduplication(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.first = os.path.join(self.path, 'first')
+        self.second = os.path.join(self.path, 'second')
+        self.state = os.path.join(self.path, 'state')
+        blockchain = Blockchain(BitcoinProxyMock())
+        # transaction ids in descending order, so that the files are not sorted
+        for path, blocks in [(self.first, [block(1, [('f1', [], '1A'), ('c1', [], '1B')]),
+                                           block(2, [('a1', [], '1C')])]),
+                             (self.second, [block(3, [('e3', [], '1D'),
+                                                      ('d3', ['f1', 'c1', 'a1'], '1D')])])]:
+            with CSVDumpWriter(path, deduplicate=True) as writer:
+                for data in blocks:
+                    writer.write(Block(blockchain, json_data=data))
+        with redirect_stdout(io.StringIO()):
+            bitcoingraph.compute_entities(self.first, state_path=self.state, hash_index=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_update(self):
+        with redirect_stdout(io.StringIO()):
+            bitcoingraph.update_entities(self.second, self.state, sort_input=True)
+        with open(os.path.join(self.second, 'entity_merges.csv')) as f:
+            self.assertEqual(list(csv.reader(f)),
+                             [['entity', 'merged_into'], ['1', '0'], ['2', '0']])
+
+    def test_unsorted_update(self):
+        with self.assertRaises(ValueError), redirect_stdout(io.StringIO()):
+            bitcoingraph.update_entities(self.second, self.state)
+
+
+class TestOutputAddressIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        rows = ['{:x}_{},1A{}'.format(number * 7919, number % 3, number)
+                for number in range(3000)]
+        rows += ['m_0,1M', 'm_0,1N', 'd_1,1D', 'd_1,1D']
+        random.Random(3).shuffle(rows)
+        write_lines(self.path, 'rel_output_address.csv', rows)
+        self.index = entities.OutputAddressIndex(
+            os.path.join(self.path, 'rel_output_address.csv'), os.path.join(self.path, 'index'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.path)
+
+    def test_get(self):
+        for number in range(3000):
+            self.assertEqual(self.index.get('{:x}_{}'.format(number * 7919, number % 3)),
+                             '1A{}'.format(number))
+        self.assertEqual(self.index.get('d_1'), '1D')
+
+    def test_ambiguous(self):
+        self.assertIsNone(self.index.get('m_0'))
+
+    def test_missing(self):
+        self.assertIsNone(self.index.get('0_1'))
+        self.assertIsNone(self.index.get('x_0'))
+
+
+class TestResolveInputAddresses(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_lines(self.path, 'rel_output_address.csv',
+                    ['b_0,1C', 'a_0,1A', 'm_0,1M', 'a_1,1B', 'm_0,1N'])
+        write_lines(self.path, 'rel_input.csv',
+                    ['t2,a_1', 't2,m_0', 't2,b_0', 't1,a_0', 't1,x_0'])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_resolve(self):
+        with redirect_stdout(io.StringIO()):
+            entities.resolve_input_addresses(self.path)
+        with open(os.path.join(self.path, 'input_addresses.csv')) as f:
+            self.assertEqual(list(csv.reader(f)), [['t2', '1B'], ['t2', '1C'], ['t1', '1A']])
+        self.assertNotIn('rel_output_address.index', os.listdir(self.path))
+
+    def test_same_as_merge_join(self):
+        with redirect_stdout(io.StringIO()):
+            entities.resolve_input_addresses(self.path)
+            with open(os.path.join(self.path, 'input_addresses.csv')) as f:
+                resolved = sorted(csv.reader(f))
+            for name in ['rel_output_address.csv', 'rel_input.csv']:
+                with open(os.path.join(self.path, name)) as f:
+                    lines = sorted(f, key=lambda line: line.split(',')[1]
+                                   if name == 'rel_input.csv' else line)
+                with open(os.path.join(self.path, name), 'w') as f:
+                    f.writelines(lines)
+            entities.calculate_input_addresses(self.path)
+        with open(os.path.join(self.path, 'input_addresses.csv')) as f:
+            self.assertEqual(sorted(csv.reader(f)), resolved)
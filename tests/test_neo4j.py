@@ -0,0 +1,215 @@
+import shutil
+import tempfile
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.graphdb import GraphController, decode_cursor, encode_cursor
+from bitcoingraph.neo4j import Neo4jController
+from bitcoingraph.writer import CSVDumpWriter
+
+
+class ResponseMock:
+
+    def __init__(self, result):
+        self._result = result
+
+    def json(self):
+        return self._result
+
+
+class SessionMock:
+
+    def __init__(self, rows, columns=('id(b)',)):
+        self.urls = []
+        self.payloads = []
+        self._rows = rows
+        self._columns = list(columns)
+
+    def post(self, url, auth=None, headers=None, json=None):
+        self.urls.append(url)
+        self.payloads.append(json)
+        return ResponseMock({'errors': [], 'results': [
+            {'columns': self._columns, 'data': [{'row': row} for row in self._rows]}]})
+
+
+class BatchSessionMock:
+    """Answers each statement with its index."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def post(self, url, auth=None, headers=None, json=None):
+        self.payloads.append(json)
+        return ResponseMock({'errors': [], 'results': [
+            {'columns': ['index'], 'data': [{'row': [index]}]}
+            for index in range(len(json['statements']))]})
+
+
+class TestQueryBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = GraphController('localhost', 7474, 'neo4j', 'neo4j')
+        self.session = BatchSessionMock()
+        self.controller.graph_db._session = self.session
+
+    def test_query_batch(self):
+        results = self.controller.graph_db.query_batch([('RETURN 0', None),
+                                                        ('RETURN {a}', {'a': 1})])
+        self.assertEqual([result.single_result() for result in results], [0, 1])
+        self.assertEqual(self.session.payloads, [{'statements': [
+            {'statement': 'RETURN 0'},
+            {'statement': 'RETURN {a}', 'parameters': {'a': 1}}]}])
+
+    def test_get_entity(self):
+        entity = self.controller.get_entity(5)
+        self.assertEqual(entity, {'id': 5, 'addresses': [{'index': 1}],
+                                  'number_of_addresses': 0})
+        self.assertEqual(len(self.session.payloads), 1)
+
+
+class AddressSessionMock:
+    """Answers the transactions statement of an address with a page of
+    rows and any other statement with an empty result."""
+
+    def __init__(self, rows):
+        self.payloads = []
+        self._rows = rows
+
+    def post(self, url, auth=None, headers=None, json=None):
+        self.payloads.append(json)
+        statement = json['statements'][0]
+        limit = statement['parameters']['limit']
+        rows = [[txid, 1.0, timestamp] for timestamp, txid in self._rows
+                if (timestamp, txid) < (statement['parameters']['before_timestamp'],
+                                        statement['parameters']['before_txid'])]
+        return ResponseMock({'errors': [], 'results': [
+            {'columns': ['txid', 'value', 'timestamp'],
+             'data': [{'row': row} for row in rows[:limit]]},
+            {'columns': ['identities'], 'data': [{'row': [[]]}]}]})
+
+
+class TestKeysetPagination(unittest.TestCase):
+
+    def test_cursor(self):
+        cursor = encode_cursor(1293623863, 'abc')
+        self.assertEqual(decode_cursor(cursor), (1293623863, 'abc'))
+        with self.assertRaises(ValueError):
+            decode_cursor('abc')
+
+    def test_pages(self):
+        rows = sorted([(1293623863 - i // 2, 'tx{}'.format(i)) for i in range(5)], reverse=True)
+        controller = GraphController('localhost', 7474, 'neo4j', 'neo4j')
+        controller.graph_db._session = AddressSessionMock(rows)
+        txids = []
+        cursor = None
+        for page in range(3):
+            address = controller.get_address('1A', 0, rows_per_page=2, cursor=cursor)
+            txids.extend(output['txid'] for output in address.outputs)
+            cursor = address.next_cursor
+        self.assertIsNone(cursor)
+        self.assertEqual(txids, [txid for _, txid in rows])
+
+    def test_numbered_pages(self):
+        controller = Neo4jController('localhost', 7474, 'neo4j', 'neo4j')
+        order = 'ORDER BY b.timestamp desc, t.txid desc'
+        keyset_statement, _ = controller.keyset_address_statement('1A', None, None, 2)
+        statement, _ = controller.paginated_address_statement('1A', None, None, 2, 2)
+        self.assertIn(order, keyset_statement)
+        self.assertIn(order + '\nSKIP {skip} LIMIT {limit}', statement)
+
+
+class TestIngestBlock(unittest.TestCase):
+
+    def setUp(self):
+        self.blockchain = Blockchain(BitcoinProxyMock())
+        self.controller = Neo4jController('localhost', 7474, 'neo4j', 'neo4j')
+        self.controller._session = SessionMock([[42]])
+
+    def test_single_request(self):
+        block = self.blockchain.get_block_by_height(100000)
+        self.assertEqual(self.controller.ingest_block(block), 42)
+        self.assertEqual(len(self.controller._session.payloads), 1)
+        statements = self.controller._session.payloads[0]['statements']
+        self.assertEqual(len(statements), 1)
+        parameters = statements[0]['parameters']
+        self.assertEqual(parameters['height'], 100000)
+        transactions = parameters['transactions']
+        self.assertEqual([tx['txid'] for tx in transactions],
+                         [tx.txid for tx in block.transactions])
+        self.assertTrue(transactions[0]['coinbase'])
+        self.assertEqual(transactions[0]['inputs'], [])
+        tx = block.transactions[1]
+        self.assertEqual(transactions[1]['inputs'],
+                         ['{}_{}'.format(input.output_reference['txid'],
+                                         input.output_reference['vout'])
+                          for input in tx.inputs])
+        self.assertEqual(transactions[1]['outputs'][0],
+                         {'txid_n': tx.txid + '_0', 'n': 0, 'value': tx.outputs[0].value,
+                          'type': tx.outputs[0].type, 'addresses': tx.outputs[0].addresses})
+
+
+class TestAddressAggregates(unittest.TestCase):
+
+    def test_aggregate_property(self):
+        controller = Neo4jController('localhost', 7474, 'neo4j', 'neo4j')
+        controller._session = SessionMock([[12.5]])
+        self.assertEqual(controller.get_received_bitcoins('1A'), 12.5)
+        self.assertEqual(len(controller._session.payloads), 1)
+
+    def test_scan_without_aggregates(self):
+        controller = Neo4jController('localhost', 7474, 'neo4j', 'neo4j')
+        controller._session = SessionMock([[None]])
+        controller.get_unspent_bitcoins('1A')
+        self.assertEqual(len(controller._session.payloads), 2)
+        self.assertIn('NOT (o)-[:INPUT]->()',
+                      controller._session.payloads[1]['statements'][0]['statement'])
+
+
+class TestLoadExport(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.block = Blockchain(BitcoinProxyMock()).get_block_by_height(100000)
+        with CSVDumpWriter(self.path) as writer:
+            writer.write(self.block)
+        self.controller = GraphController('localhost', 7474, 'neo4j', 'neo4j')
+        self.session = SessionMock([[100000, 42]], ['height', 'id'])
+        self.controller.graph_db._session = self.session
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def statements(self, keyword):
+        return [payload['statements'][0] for payload in self.session.payloads
+                if payload is not None and keyword in payload['statements'][0]['statement']]
+
+    def test_load_export(self):
+        self.controller.load_export(self.path, batch_size=3)
+        outputs = [row for statement in self.statements('MERGE (o:Output')
+                   for row in statement['parameters']['rows']]
+        self.assertEqual(len(outputs), sum(len(tx.outputs) for tx in self.block.transactions))
+        self.assertEqual(outputs[0][1:3], [0, self.block.transactions[0].outputs[0].value])
+        blocks = self.statements('MERGE (b:Block')
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(blocks[0]['parameters']['rows'],
+                         [[self.block.hash, 100000, self.block.timestamp,
+                           [tx.txid for tx in self.block.transactions]]])
+        self.assertEqual(max(len(statement['parameters']['rows'])
+                             for statement in self.statements('UNWIND {rows}')), 3)
+        entities = self.session.payloads[-1]['statements']
+        self.assertEqual([statement['parameters'] for statement in entities],
+                         [{'txid': tx.txid} for tx in self.block.transactions])
+        self.assertTrue(all(statement['statement'] ==
+                            Neo4jController.transaction_entity_statement
+                            for statement in entities))
+        self.assertFalse(any('createEntities' in url for url in self.session.urls))
+
+    def test_same_entities_as_synchronize(self):
+        self.controller.load_export(self.path)
+        session = SessionMock([[42]])
+        controller = GraphController('localhost', 7474, 'neo4j', 'neo4j')
+        controller.graph_db._session = session
+        controller.add_block(self.block)
+        self.assertEqual(session.payloads[-1], self.session.payloads[-1])
@@ -0,0 +1,113 @@
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph.serialization import classify_script, deserialize_block, \
+    deserialize_transaction, DeserializationException, to_hex, _ripemd160
+
+BH1 = "000000000002d01c1fccc21636b607dfd930d31d01c3a62104612a1719011250"
+BH2 = "000000000003ba27aa200b1cecaad478d2b00432346c3f1f3986da1afd33e506"
+
+# transaction with unknown output
+TXE = "a288fec5559c3f73fd3d93db8e8460562ebfe2fcf04a5114e8d0f2920a6270dc"
+
+# transaction with multiple in and outputs
+TXM = "d5f013abf2cf4af6d68bcacd675c91f19bab5b7103b4ac2f4941686eb47da1f0"
+
+PUBKEY = ("041b0e8c2567c12536aa13357b79a073dc4444acb83c4ec7a0e2f99dd7457516c5"
+          "817242da796924ca4e99947d087fedf9ce467cb9f7c6287078f801df276fdf84")
+PUBKEY_ADDRESS = "1HWqMzw1jfpXb3xyuUZ4uWXY4tqL2cW47J"
+
+
+class TestDeserializeBlock(unittest.TestCase):
+
+    def setUp(self):
+        self.bitcoin_proxy = BitcoinProxyMock()
+
+    def test_header(self):
+        for block_hash in [BH1, BH2]:
+            block = deserialize_block(self.bitcoin_proxy.getrawblock(block_hash))
+            expected = self.bitcoin_proxy.getblock(block_hash)
+            for key in ['hash', 'time', 'previousblockhash', 'merkleroot', 'bits', 'nonce']:
+                self.assertEqual(block[key], expected[key])
+
+    def test_transactions(self):
+        block = deserialize_block(self.bitcoin_proxy.getrawblock(BH2))
+        expected = self.bitcoin_proxy.getblock(BH2)
+        self.assertEqual([tx['txid'] for tx in block['tx']], expected['tx'])
+        for tx in block['tx']:
+            self.assertTransaction(tx, self.bitcoin_proxy.getrawtransaction(tx['txid']))
+
+    def test_standalone_transactions(self):
+        for tx_id in [TXE, TXM]:
+            expected = self.bitcoin_proxy.getrawtransaction(tx_id)
+            tx = deserialize_transaction(bytes.fromhex(expected['hex']))
+            self.assertTransaction(tx, expected)
+
+    def test_truncated(self):
+        raw_block = self.bitcoin_proxy.getrawblock(BH2)
+        with self.assertRaises(DeserializationException):
+            deserialize_block(raw_block[:-10])
+
+    def assertTransaction(self, tx, expected):
+        self.assertEqual(tx['txid'], expected['txid'])
+        self.assertEqual(len(tx['vin']), len(expected['vin']))
+        for vin, expected_vin in zip(tx['vin'], expected['vin']):
+            self.assertEqual('coinbase' in vin, 'coinbase' in expected_vin)
+            if 'coinbase' not in vin:
+                self.assertEqual(vin['txid'], expected_vin['txid'])
+                self.assertEqual(vin['vout'], expected_vin['vout'])
+        self.assertEqual(len(tx['vout']), len(expected['vout']))
+        for vout, expected_vout in zip(tx['vout'], expected['vout']):
+            self.assertEqual(vout['value'], expected_vout['value'])
+            self.assertEqual(vout['scriptPubKey']['type'], expected_vout['scriptPubKey']['type'])
+            self.assertEqual(vout['scriptPubKey'].get('addresses'),
+                             expected_vout['scriptPubKey'].get('addresses'))
+
+
+class TestClassifyScript(unittest.TestCase):
+
+    def test_pubkeyhash(self):
+        script = bytes.fromhex('76a914' + '00' * 20 + '88ac')
+        self.assertEqual(classify_script(script),
+                         ('pubkeyhash', ['1111111111111111111114oLvT2']))
+
+    def test_scripthash(self):
+        script = bytes.fromhex('a914' + '00' * 20 + '87')
+        self.assertEqual(classify_script(script),
+                         ('scripthash', ['31h1vYVSYuKP6AhS86fbRdMw9XHieotbST']))
+
+    def test_multisig(self):
+        script = bytes.fromhex('5141' + PUBKEY + '41' + PUBKEY + '52ae')
+        self.assertEqual(classify_script(script),
+                         ('multisig', [PUBKEY_ADDRESS, PUBKEY_ADDRESS]))
+
+    def test_witness_v0_keyhash(self):
+        script = bytes.fromhex('0014751e76e8199196d454941c45d1b3a323f1433bd6')
+        self.assertEqual(classify_script(script),
+                         ('witness_v0_keyhash', ['bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4']))
+
+    def test_witness_v1_taproot(self):
+        script = bytes.fromhex('5120' + '79be667ef9dcbbac55a06295ce870b07'
+                                        '029bfcdb2dce28d959f2815b16f81798')
+        self.assertEqual(classify_script(script), (
+            'witness_v1_taproot',
+            ['bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0']))
+
+    def test_nulldata(self):
+        self.assertEqual(classify_script(bytes.fromhex('6a0401020304')), ('nulldata', []))
+
+    def test_nonstandard(self):
+        self.assertEqual(classify_script(bytes.fromhex('6a4c')), ('nonstandard', []))
+        self.assertEqual(classify_script(b''), ('nonstandard', []))
+
+
+class TestRipemd160(unittest.TestCase):
+
+    def test_digests(self):
+        for message, digest in [
+                (b'', '9c1185a5c5e9fc54612808977ee8f548b2258d31'),
+                (b'abc', '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'),
+                (b'message digest', '5d0689ef49d2fae572b881b123a85ffa21595f36'),
+                (b'1234567890' * 8, '9b752e45573d4b39f4dbd3323cab82bf63326bfb')]:
+            self.assertEqual(to_hex(_ripemd160(message)), digest)
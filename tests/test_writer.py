@@ -0,0 +1,265 @@
+import csv
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests.rpc_mock import BitcoinProxyMock
+
+from bitcoingraph.blockchain import Blockchain
+from bitcoingraph.model import Block
+from bitcoingraph.writer import CSVDumpWriter, DigestSet, OutputAddressStore, OutputIdStore
+
+TXID = 'fff2525b8931402dd09222c50775608f75787bd2b87e56995a7bdd30f79702c4'
+
+
+class TestOutputAddressStore(unittest.TestCase):
+
+    def test_spend(self):
+        store = OutputAddressStore()
+        store.add(TXID, 0, ['1A'])
+        store.add(TXID, 1, ['1B'])
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.spend(TXID, 1), '1B')
+        self.assertIsNone(store.spend(TXID, 1))
+        self.assertEqual(len(store), 1)
+
+    def test_ambiguous_and_empty(self):
+        store = OutputAddressStore()
+        store.add(TXID, 0, ['1A', '1B'])
+        store.add(TXID, 1, [])
+        self.assertEqual(len(store), 0)
+        self.assertIsNone(store.spend(TXID, 0))
+
+    def test_addresses(self):
+        store = OutputAddressStore()
+        addresses = ['1111BNwxHGaFbeUBitpjy2AsKpJ29Ybxntqvb', '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy',
+                     'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4',
+                     'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0',
+                     'BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4', '1' * 300, 'z' * 80, '']
+        for index, address in enumerate(addresses):
+            store.add(TXID, index, [address])
+        self.assertEqual([store.spend(TXID, index) for index in range(len(addresses))],
+                         addresses)
+        self.assertEqual(len(store), 0)
+
+    def test_random_operations(self):
+        path = tempfile.mkdtemp()
+        store = OutputAddressStore(os.path.join(path, 'store'), capacity=4)
+        expected = {}
+        generator = random.Random(5)
+        for _ in range(5000):
+            txid = '{:064x}'.format(generator.randrange(50))
+            index = generator.randrange(20)
+            if generator.random() < 0.6:
+                address = '1A{}'.format(generator.randrange(10 ** 6))
+                store.add(txid, index, [address])
+                expected[txid, index] = address
+            else:
+                self.assertEqual(store.spend(txid, index), expected.pop((txid, index), None))
+            self.assertEqual(len(store), len(expected))
+        for (txid, index), address in expected.items():
+            self.assertEqual(store.spend(txid, index), address)
+        store.close()
+        self.assertEqual(os.listdir(path), [])
+        shutil.rmtree(path)
+
+
+class TestOutputIdStore(unittest.TestCase):
+
+    def test_spend(self):
+        store = OutputIdStore()
+        store.add(TXID, 7, 2)
+        store.add(TXID[::-1], 9, 0)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.spend(TXID, 1), 8)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.spend(TXID, 0), 7)
+        self.assertEqual(len(store), 0)
+        self.assertIsNone(store.spend(TXID, 0))
+
+    def test_random_operations(self):
+        path = tempfile.mkdtemp()
+        store = OutputIdStore(os.path.join(path, 'store'), capacity=4)
+        expected = {}
+        generator = random.Random(5)
+        for number in range(3000):
+            txid = '{:064x}'.format(generator.randrange(400))
+            if txid not in expected:
+                outputs = set(range(generator.randrange(4)))
+                store.add(txid, number * 10, len(outputs))
+                if outputs:
+                    expected[txid] = number * 10, outputs
+            else:
+                first_id, outputs = expected[txid]
+                index = outputs.pop()
+                self.assertEqual(store.spend(txid, index), first_id + index)
+                if not outputs:
+                    del expected[txid]
+            self.assertEqual(len(store), len(expected))
+        store.close()
+        self.assertEqual(os.listdir(path), [])
+        shutil.rmtree(path)
+
+
+class TestDigestSet(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_add(self):
+        digest_set = DigestSet(os.path.join(self.path, 'spill'))
+        self.assertTrue(digest_set.add('1A'))
+        self.assertTrue(digest_set.add('1B'))
+        self.assertFalse(digest_set.add('1A'))
+        digest_set.close()
+
+    def test_spill(self):
+        spill_path = os.path.join(self.path, 'spill')
+        digest_set = DigestSet(spill_path, max_entries=10, expected_keys=10, max_runs=3)
+        keys = ['1A{}'.format(number) for number in range(200)]
+        self.assertTrue(all(digest_set.add(key) for key in keys))
+        self.assertTrue(os.path.exists(spill_path))
+        self.assertLessEqual(len(os.listdir(spill_path)), 3)
+        self.assertFalse(any(digest_set.add(key) for key in reversed(keys)))
+        self.assertTrue(digest_set.add('1B'))
+        digest_set.close()
+        self.assertFalse(os.path.exists(spill_path))
+
+    def test_expected_keys(self):
+        small = DigestSet(os.path.join(self.path, 'small'), expected_keys=100)
+        large = DigestSet(os.path.join(self.path, 'large'), expected_keys=10000)
+        self.assertEqual(small._bloom_hashes, 7)
+        self.assertEqual(large._bloom_hashes, 7)
+        self.assertGreater(len(large._bloom), len(small._bloom) * 90)
+        keys = ['1A{}'.format(number) for number in range(10000)]
+        self.assertTrue(all(large.add(key) for key in keys))
+        # few new keys pass the Bloom filter at the expected number of keys
+        bloom = large._bloom
+        false_positives = sum(
+            all(bloom[position >> 3] & (1 << (position & 7))
+                for position in large._bloom_positions(
+                    hashlib.blake2b('1B{}'.format(number).encode(), digest_size=16).digest()))
+            for number in range(10000))
+        self.assertLess(false_positives, 200)
+        small.close()
+        large.close()
+
+
+class TestCSVDumpWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.blockchain = Blockchain(BitcoinProxyMock())
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_csv(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return list(csv.reader(f))
+
+    def test_input_addresses(self):
+        with CSVDumpWriter(self.path, input_addresses=True) as writer:
+            for block in self.blockchain.get_blocks_in_range(99999, 100000):
+                writer.write(block)
+        output_addresses = {}
+        for output, address in self.read_csv('rel_output_address.csv'):
+            output_addresses.setdefault(output, []).append(address)
+        expected = [[txid, output_addresses[output][0]]
+                    for txid, output in self.read_csv('rel_input.csv')
+                    if len(output_addresses.get(output, [])) == 1]
+        self.assertEqual(self.read_csv('input_addresses.csv'), expected)
+
+    def test_spent_in_export(self):
+        def output(addresses):
+            return {'value': 1.0, 'scriptPubKey': {'type': 'pubkeyhash', 'addresses': addresses}}
+
+        def tx(txid, inputs, outputs):
+            return {'txid': txid, 'vin': [{'txid': input_txid, 'vout': vout}
+                                          for input_txid, vout in inputs] or [{'coinbase': ''}],
+                    'vout': [output(addresses) for addresses in outputs]}
+
+        first = {'hash': 'b1', 'height': 1, 'time': 0, 'tx': [
+            tx('a1', [], [['1A']]),
+            tx('a2', [('a1', 0)], [['1B'], ['1C', '1D'], ['1E']])]}
+        second = {'hash': 'b2', 'height': 2, 'time': 0, 'tx': [
+            tx('a3', [('a2', 0), ('a2', 1), ('a2', 2), ('a0', 0)], [['1F']]),
+            tx('a4', [('a2', 0)], [['1G']])]}
+        with CSVDumpWriter(self.path, input_addresses=True) as writer:
+            for block in [first, second]:
+                writer.write(Block(self.blockchain, json_data=block))
+        self.assertEqual(self.read_csv('input_addresses.csv'),
+                         [['a2', '1A'], ['a3', '1B'], ['a3', '1E']])
+
+    def test_integer_ids(self):
+        def output(addresses):
+            return {'value': 1.0, 'scriptPubKey': {'type': 'pubkeyhash', 'addresses': addresses}}
+
+        def tx(txid, inputs, outputs):
+            return {'txid': txid, 'vin': [{'txid': input_txid, 'vout': vout}
+                                          for input_txid, vout in inputs] or [{'coinbase': ''}],
+                    'vout': [output(addresses) for addresses in outputs]}
+
+        first = {'hash': 'b1', 'height': 1, 'time': 0, 'tx': [
+            tx('a1', [], [['1A']]),
+            tx('a2', [('a1', 0)], [['1B'], ['1C', '1D'], ['1E']])]}
+        second = {'hash': 'b2', 'height': 2, 'time': 0, 'tx': [
+            tx('a3', [('a2', 2), ('a2', 0), ('a0', 0)], [['1F']])]}
+        with CSVDumpWriter(self.path, integer_ids=True) as writer:
+            for block in [first, second]:
+                writer.write(Block(self.blockchain, json_data=block))
+        self.assertEqual(self.read_csv('transactions_header.csv'),
+                         [[':ID(Transaction){id-type:long}', 'txid', 'coinbase:boolean']])
+        self.assertEqual(self.read_csv('transactions.csv'),
+                         [['0', 'a1', 'True'], ['1', 'a2', 'False'], ['2', 'a3', 'False']])
+        self.assertEqual(self.read_csv('outputs.csv')[1:3],
+                         [['1', 'a2_0', '0', '1.0', 'pubkeyhash'],
+                          ['2', 'a2_1', '1', '1.0', 'pubkeyhash']])
+        self.assertEqual(self.read_csv('rel_block_tx.csv'),
+                         [['b1', '0'], ['b1', '1'], ['b2', '2']])
+        self.assertEqual(self.read_csv('rel_tx_output.csv'),
+                         [['0', '0'], ['1', '1'], ['1', '2'], ['1', '3'], ['2', '4']])
+        self.assertEqual(self.read_csv('rel_input.csv'), [['1', '0'], ['2', '3'], ['2', '1']])
+        self.assertEqual(self.read_csv('rel_output_address.csv'),
+                         [['0', '1A'], ['1', '1B'], ['2', '1C'], ['2', '1D'], ['3', '1E'],
+                          ['4', '1F']])
+
+    def test_integer_ids_unspendable(self):
+        coinbase = {'txid': 'c1', 'vin': [{'coinbase': ''}], 'vout': [
+            {'value': 1.0, 'scriptPubKey': {'type': 'pubkeyhash', 'addresses': ['1A']}},
+            {'value': 0.0, 'scriptPubKey': {'type': 'nulldata'}}]}
+        spending = {'txid': 'c2', 'vin': [{'txid': 'c1', 'vout': 0}], 'vout': []}
+        with CSVDumpWriter(self.path, integer_ids=True) as writer:
+            writer.write(Block(self.blockchain, json_data={
+                'hash': 'b1', 'height': 1, 'time': 0, 'tx': [coinbase, spending]}))
+            self.assertEqual(len(writer._output_ids), 0)
+        self.assertEqual(self.read_csv('rel_input.csv'), [['1', '0']])
+        self.assertNotIn('.output_ids', os.listdir(self.path))
+
+    def test_deduplicate(self):
+        block = self.blockchain.get_block_by_height(100000)
+        with CSVDumpWriter(self.path, deduplicate=True, deduplication_memory=1000) as writer:
+            writer.write(block)
+            writer.write(block)
+        addresses = self.read_csv('addresses.csv')
+        self.assertEqual(len(addresses), len({tuple(row) for row in addresses}))
+        self.assertEqual(len(self.read_csv('transactions.csv')), 4)
+        self.assertEqual(len(self.read_csv('rel_block_tx.csv')), 8)
+        self.assertEqual(len(self.read_csv('outputs.csv')),
+                         len({tuple(row) for row in self.read_csv('outputs.csv')}))
+        self.assertEqual(sorted(os.listdir(self.path)), sorted(
+            name + suffix for name in ['blocks', 'transactions', 'outputs', 'addresses',
+                                       'rel_block_tx', 'rel_tx_output', 'rel_input',
+                                       'rel_output_address']
+            for suffix in ['.csv', '_header.csv']))
+
+    def test_without_input_addresses(self):
+        with CSVDumpWriter(self.path) as writer:
+            writer.write(self.blockchain.get_block_by_height(100000))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'input_addresses.csv')))